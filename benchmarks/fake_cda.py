@@ -0,0 +1,193 @@
+"""
+Local stand-in for the Contentful Delivery API, serving a SyntheticSpace.
+Supports what migrate_to_postgres.py uses: /entries with content_type, skip/limit
+and sys.createdAt[gte] pagination (always in creation order), sys.id[in],
+select=sys and includes, the Sync API, 429 rate limiting with
+X-Contentful-RateLimit-Reset headers and the 400 for oversized responses.
+"""
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from math import ceil
+from time import monotonic
+from urllib.parse import parse_qs, urlparse
+
+from synthetic_content import first_index_created_from
+
+
+MAX_LIMIT = 1000
+MAX_RESPONSE_BYTES = 7 * 1024 * 1024
+SYNC_PAGE_SIZE = 100
+ENDPOINT = re.compile(r'^/spaces/[^/]+(?:/environments/[^/]+)?/(entries|sync)$')
+
+
+class FakeCDAServer(ThreadingHTTPServer):
+    """
+    Serves space on 127.0.0.1. rate_limit is the requests per second allowed
+    before answering 429 (None for no limit); entries responses larger than
+    max_response_bytes are refused. Counts every request it answers.
+    """
+    daemon_threads = True
+
+    def __init__(self, space, rate_limit=None, port=0, max_response_bytes=MAX_RESPONSE_BYTES):
+        super().__init__(('127.0.0.1', port), FakeCDAHandler)
+        self.space = space
+        self.rate_limit = rate_limit
+        self.max_response_bytes = max_response_bytes
+        self.lock = threading.Lock()
+        self.window_start = monotonic()
+        self.window_requests = 0
+        self.counters = {'requests': 0, 'throttled': 0}
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def reset_counters(self):
+        with self.lock:
+            self.counters = {'requests': 0, 'throttled': 0}
+
+    def admit(self):
+        """
+        Count a request; return the seconds until the rate limit resets if it is over the limit
+        """
+        with self.lock:
+            self.counters['requests'] += 1
+            if self.rate_limit is None:
+                return None
+            now = monotonic()
+            if now - self.window_start >= 1:
+                self.window_start = now
+                self.window_requests = 0
+            self.window_requests += 1
+            if self.window_requests > self.rate_limit:
+                self.counters['throttled'] += 1
+                return max(1, ceil(1 - (now - self.window_start)))
+            return None
+
+
+class FakeCDAHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        match = ENDPOINT.match(url.path)
+        if not match:
+            return self.send_json(404, {'sys': {'type': 'Error', 'id': 'NotFound'}})
+        reset = self.server.admit()
+        if reset is not None:
+            return self.send_json(
+                429, {'sys': {'type': 'Error', 'id': 'RateLimitExceeded'}},
+                {'X-Contentful-RateLimit-Reset': str(reset)}
+            )
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if match.group(1) == 'sync':
+            return self.send_json(200, self.sync(query))
+        body = self.entries(query)
+        if len(json.dumps(body)) > self.server.max_response_bytes:
+            return self.send_json(400, {
+                'sys': {'type': 'Error', 'id': 'BadRequest'},
+                'message': f"Response size too big. Maximum allowed response size: {self.server.max_response_bytes}B.",
+            })
+        return self.send_json(200, body)
+
+    def entries(self, query):
+        space = self.server.space
+        skip = int(query.get('skip', 0))
+        limit = min(int(query.get('limit', 100)), MAX_LIMIT)
+        include = int(query.get('include', 1))
+
+        if 'sys.id[in]' in query:
+            wanted = [entry_id for entry_id in query['sys.id[in]'].split(',') if entry_id]
+            items = [entry for entry in map(space.entry, wanted) if entry is not None]
+            total = len(items)
+            items = items[skip:skip + limit]
+        else:
+            content_type = query.get('content_type')
+            start = first_index_created_from(query['sys.createdAt[gte]']) if 'sys.createdAt[gte]' in query else 0
+            total = max(0, space.counts.get(content_type, 0) - start)
+            items = [space.entry(entry_id) for entry_id in space.ids(content_type, start + skip, limit)]
+
+        body = {'sys': {'type': 'Array'}, 'total': total, 'skip': skip, 'limit': limit}
+        if query.get('select') == 'sys':
+            body['items'] = [{'sys': item['sys']} for item in items]
+            return body
+        body['items'] = items
+        if include > 0:
+            linked_ids = sorted({linked for item in items for linked in space.linked_ids(item)})
+            body['includes'] = {'Entry': [entry for entry in map(space.entry, linked_ids) if entry is not None]}
+        return body
+
+    def sync(self, query):
+        """
+        Sync tokens are 'page-<n>' while an initial sync is paging and 'done'
+        afterwards; the synthetic space never changes, so a delta is always empty
+        """
+        space = self.server.space
+        token = query.get('sync_token')
+        if token == 'done':
+            return {'sys': {'type': 'Array'}, 'items': [], 'nextSyncUrl': self.sync_url('done')}
+
+        page = int(token.split('-')[1]) if token else 0
+        start = page * SYNC_PAGE_SIZE
+        items = []
+        # Walk the content types as one concatenated listing
+        offset = 0
+        for content_type, count in space.counts.items():
+            if start < offset + count and len(items) < SYNC_PAGE_SIZE:
+                skip = max(0, start - offset)
+                for entry_id in space.ids(content_type, skip, SYNC_PAGE_SIZE - len(items)):
+                    entry = space.entry(entry_id)
+                    entry['fields'] = {name: {'en-US': value} for name, value in entry['fields'].items()}
+                    items.append(entry)
+            offset += count
+
+        body = {'sys': {'type': 'Array'}, 'items': items}
+        if start + SYNC_PAGE_SIZE < space.total():
+            body['nextPageUrl'] = self.sync_url(f"page-{page + 1}")
+        else:
+            body['nextSyncUrl'] = self.sync_url('done')
+        return body
+
+    def sync_url(self, token):
+        return f"{self.server.url}{urlparse(self.path).path}?sync_token={token}"
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/vnd.contentful.delivery.v1+json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+if __name__ == '__main__':
+    import argparse
+    from synthetic_content import SyntheticSpace, parse_size
+
+    parser = argparse.ArgumentParser(description="Serve a synthetic Contentful space on localhost")
+    parser.add_argument('--questions', default='1k', help="1k, 10k, 100k, 1m or a number (default 1k)")
+    parser.add_argument('--port', type=int, default=8123)
+    parser.add_argument('--rate-limit', type=float, default=55, help="requests per second before 429s (default 55)")
+    parser.add_argument('--max-response-bytes', type=int, default=MAX_RESPONSE_BYTES,
+                        help=f"refuse entries responses larger than this (default {MAX_RESPONSE_BYTES})")
+    args = parser.parse_args()
+    server = FakeCDAServer(SyntheticSpace(parse_size(args.questions)), args.rate_limit, args.port, args.max_response_bytes)
+    print(f"Serving {server.space.total()} entries at {server.url} (set CONTENTFUL_API_URL to this)")
+    server.serve_forever()
@@ -0,0 +1,180 @@
+"""
+Replay Contentful entry webhooks against `migrate_to_postgres.py serve` and
+measure how long each edit takes to become visible in the database:
+
+    python benchmarks/fake_cda.py --questions 1k &
+    python migrate_to_postgres.py --full
+    python migrate_to_postgres.py serve &
+    python benchmarks/replay_webhooks.py --questions 1k --edits 200
+
+with CONTENTFUL_API_URL pointing at the fake CDA and the DB_* variables at a
+database holding benchmarks/schema.sql, which the --full run loads first.
+
+Each edit is a publish webhook for a question of the synthetic space with a new
+questionText and the next revision; every --drop-option-every-th edit of a
+multiple choice question also drops its last answer option. The database is
+polled until every edited question shows its new text, and the publish-to-visible
+latencies are printed as JSON. With --from-file, recorded webhooks (one JSON
+object per line: {"topic": ..., "body": {...}}) are posted instead and only
+the responses are reported.
+"""
+import argparse
+import json
+import os
+import sys
+from time import monotonic, sleep
+
+import pg8000
+from requests import Session
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [BENCHMARK_DIR, os.path.dirname(BENCHMARK_DIR)]
+
+from migrate_to_postgres import LOCALE, convert_to_uuid
+from synthetic_content import MULTIPLE_CHOICE_CONTENT_TYPE, TRUE_FALSE_CONTENT_TYPE, SyntheticSpace, parse_size
+
+PUBLISH_TOPIC = 'ContentManagement.Entry.publish'
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def edited_question(space, entry_id, edit, drop_option):
+    """
+    The webhook body of a question republished with new text (and one option fewer if drop_option)
+    """
+    entry = space.entry(entry_id)
+    entry['sys']['revision'] += 1
+    entry['sys']['version'] = entry['sys']['revision'] * 2
+    fields = entry['fields']
+    fields['questionText'] = f"Edit {edit}: {fields['questionText']}"
+    if drop_option:
+        fields['answerOptions'] = fields['answerOptions'][:-1]
+    entry['fields'] = {name: {LOCALE: value} for name, value in fields.items()}
+    return entry
+
+
+def question_ids(space, edits):
+    """
+    The entry IDs of the first edits questions, spread over both question types
+    """
+    ids = []
+    for index in range(max(space.counts[MULTIPLE_CHOICE_CONTENT_TYPE], space.counts[TRUE_FALSE_CONTENT_TYPE])):
+        ids.extend(space.ids(MULTIPLE_CHOICE_CONTENT_TYPE, index, 1) + space.ids(TRUE_FALSE_CONTENT_TYPE, index, 1))
+        if len(ids) >= edits:
+            return ids[:edits]
+    return ids
+
+
+def post(session, url, topic, body, secret):
+    headers = {'X-Contentful-Topic': topic, 'Content-Type': 'application/vnd.contentful.management.v1+json'}
+    if secret:
+        headers['X-Webhook-Secret'] = secret
+    return session.post(url, data=json.dumps(body), headers=headers, timeout=10).status_code
+
+
+def replay_file(args, session):
+    statuses = {}
+    with open(args.from_file) as file:
+        for line in file:
+            if not line.strip():
+                continue
+            webhook = json.loads(line)
+            status = post(session, args.url, webhook['topic'], webhook['body'], args.secret)
+            statuses[status] = statuses.get(status, 0) + 1
+            if args.rate:
+                sleep(1 / args.rate)
+    return {'posted': sum(statuses.values()), 'statuses': statuses}
+
+
+def replay_edits(args, session):
+    space = SyntheticSpace(parse_size(args.questions))
+    db = pg8000.connect(host=args.db_host, port=args.db_port, database=args.db_name,
+                        user=args.db_user, password=args.db_password)
+    db.autocommit = True
+    cursor = db.cursor()
+
+    sent = {}      # question UUID -> (expected text, monotonic time the webhook was answered)
+    dropped = []   # question UUIDs whose last option was dropped
+    statuses = {}
+    for edit, entry_id in enumerate(question_ids(space, args.edits)):
+        drop_option = entry_id.startswith('mcq-') and args.drop_option_every and edit % args.drop_option_every == 0
+        body = edited_question(space, entry_id, edit, drop_option)
+        status = post(session, args.url, PUBLISH_TOPIC, body, args.secret)
+        statuses[status] = statuses.get(status, 0) + 1
+        question_id = convert_to_uuid(entry_id)
+        sent[question_id] = (body['fields']['questionText'][LOCALE], monotonic())
+        if drop_option:
+            dropped.append(question_id)
+        if args.rate:
+            sleep(1 / args.rate)
+
+    latencies = []
+    waiting = dict(sent)
+    deadline = monotonic() + args.timeout
+    while waiting and monotonic() < deadline:
+        cursor.execute(
+            "SELECT question_id::text, question_text FROM v2.questions WHERE question_id = ANY(%s::uuid[])",
+            (list(waiting),)
+        )
+        now = monotonic()
+        for question_id, text in cursor.fetchall():
+            expected, sent_at = waiting[question_id]
+            if text == expected:
+                latencies.append(now - sent_at)
+                del waiting[question_id]
+        sleep(args.poll_interval)
+
+    cursor.execute(
+        "SELECT COUNT(*) FROM v2.options WHERE question_id = ANY(%s::uuid[])",
+        (dropped,)
+    )
+    options_left = cursor.fetchone()[0]
+    db.close()
+
+    result = {
+        'edits': len(sent),
+        'statuses': statuses,
+        'visible': len(latencies),
+        'timed_out': len(waiting),
+        'options_dropped_from': len(dropped),
+        'options_left_on_those': options_left,
+    }
+    if latencies:
+        result['latency_seconds'] = {
+            'p50': round(percentile(latencies, 0.5), 3),
+            'p95': round(percentile(latencies, 0.95), 3),
+            'p99': round(percentile(latencies, 0.99), 3),
+            'max': round(max(latencies), 3),
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay Contentful webhooks against the webhook service")
+    parser.add_argument('--url', default='http://127.0.0.1:8080/', help="webhook service URL (default http://127.0.0.1:8080/)")
+    parser.add_argument('--secret', default=os.environ.get('WEBHOOK_SECRET'), help="X-Webhook-Secret to send (default $WEBHOOK_SECRET)")
+    parser.add_argument('--questions', default='1k', help="size of the synthetic space the service's database was loaded from (default 1k)")
+    parser.add_argument('--edits', type=int, default=100, help="questions to republish (default 100)")
+    parser.add_argument('--rate', type=float, default=50, help="webhooks per second, 0 for as fast as possible (default 50)")
+    parser.add_argument('--drop-option-every', type=int, default=5,
+                        help="drop the last answer option on every n-th edit of a multiple choice question (default 5, 0 for never)")
+    parser.add_argument('--from-file', help="post the recorded webhooks in this JSON-lines file instead")
+    parser.add_argument('--timeout', type=float, default=120, help="seconds to wait for the edits to become visible (default 120)")
+    parser.add_argument('--poll-interval', type=float, default=0.05)
+    parser.add_argument('--db-host', default=os.environ.get('DB_HOST', '127.0.0.1'))
+    parser.add_argument('--db-port', type=int, default=int(os.environ.get('DB_PORT', 5432)))
+    parser.add_argument('--db-name', default=os.environ.get('DB_NAME'))
+    parser.add_argument('--db-user', default=os.environ.get('DB_USER', 'postgres'))
+    parser.add_argument('--db-password', default=os.environ.get('DB_PASSWORD', ''))
+    args = parser.parse_args()
+
+    session = Session()
+    result = replay_file(args, session) if args.from_file else replay_edits(args, session)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
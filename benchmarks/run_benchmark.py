@@ -0,0 +1,316 @@
+"""
+Benchmark migrate_to_postgres.py against synthetic spaces served by a local fake
+CDA (fake_cda.py) and a throwaway PostgreSQL database, and print the results as
+JSON so runs of different versions can be compared:
+
+    python benchmarks/run_benchmark.py --sizes 1k,10k --output results.json
+
+By default a temporary PostgreSQL cluster is created with initdb and pg_ctl
+(found on PATH or in --pg-bin; both refuse to run as root). With --db-host a
+throwaway database is created on that server instead and dropped afterwards.
+
+Each size is measured in up to three runs, each in its own process:
+    initial: empty tables, no sync token, so a full sync writes everything
+    unchanged: the sync token is removed and the same content is synced again
+    incremental: the stored token is used, so only the (empty) Sync API delta is applied
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime, timezone
+from time import perf_counter
+
+import pg8000
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+
+from fake_cda import MAX_RESPONSE_BYTES, FakeCDAServer
+from synthetic_content import SyntheticSpace, parse_size
+
+RUNS = ['initial', 'unchanged', 'incremental']
+DEFAULT_SIZES = '1k,10k'
+DEFAULT_SERVER_RATE_LIMIT = 55
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+@contextmanager
+def throwaway_database(args):
+    """
+    Yield pg8000 connection settings for an empty database that is removed afterwards
+    """
+    if args.db_host:
+        server = {'host': args.db_host, 'port': args.db_port, 'user': args.db_user, 'password': args.db_password}
+        database = f"contentful_benchmark_{os.getpid()}"
+        run_admin_sql(server, f"CREATE DATABASE {database}")
+        try:
+            yield dict(server, database=database)
+        finally:
+            run_admin_sql(server, f"DROP DATABASE IF EXISTS {database}")
+        return
+
+    initdb = shutil.which('initdb', path=args.pg_bin)
+    pg_ctl = shutil.which('pg_ctl', path=args.pg_bin)
+    if not initdb or not pg_ctl:
+        raise SystemExit("initdb/pg_ctl not found; pass --pg-bin, or --db-host to use an existing server")
+    workdir = tempfile.mkdtemp(prefix='contentful-benchmark-')
+    data_dir = os.path.join(workdir, 'data')
+    port = free_port()
+    try:
+        subprocess.run([initdb, '-D', data_dir, '-U', 'postgres', '--auth=trust', '-E', 'UTF8'],
+                       check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([pg_ctl, '-D', data_dir, '-l', os.path.join(workdir, 'postgres.log'), '-w',
+                        '-o', f"-p {port} -c listen_addresses=127.0.0.1 -k {workdir}", 'start'],
+                       check=True, stdout=subprocess.DEVNULL)
+        server = {'host': '127.0.0.1', 'port': port, 'user': 'postgres', 'password': ''}
+        run_admin_sql(server, "CREATE DATABASE benchmark")
+        yield dict(server, database='benchmark')
+    finally:
+        if os.path.exists(os.path.join(data_dir, 'postmaster.pid')):
+            subprocess.run([pg_ctl, '-D', data_dir, '-m', 'fast', 'stop'], stdout=subprocess.DEVNULL)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_admin_sql(server, sql):
+    conn = pg8000.connect(database='postgres', **server)
+    conn.autocommit = True
+    conn.cursor().execute(sql)
+    conn.close()
+
+
+def run_sql(database, statements):
+    conn = pg8000.connect(**database)
+    conn.autocommit = True
+    cursor = conn.cursor()
+    for statement in statements:
+        cursor.execute(statement)
+    conn.close()
+
+
+def reset_schema(database):
+    with open(os.path.join(BENCHMARK_DIR, 'schema.sql')) as schema:
+        lines = [line for line in schema if not line.lstrip().startswith('--')]
+    statements = [statement for statement in ''.join(lines).split(';') if statement.strip()]
+    run_sql(database, ["DROP SCHEMA IF EXISTS v2 CASCADE"] + statements)
+
+
+def seed_user_answers(database, per_question):
+    """
+    Give every question per_question user answers, so cleanup and correctness
+    passes run against a populated user_answers table
+    """
+    run_sql(database, [f"""
+        INSERT INTO v2.user_answers (user_id, question_id, chosen_answer_id, is_correct)
+        SELECT users.user_id, o.question_id, o.option_id, o.is_correct
+        FROM (SELECT DISTINCT ON (question_id) * FROM v2.options ORDER BY question_id, option_id) o
+        CROSS JOIN generate_series(1, {per_question}) AS users(user_id)
+    """])
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_child(config):
+    """
+    Run one sync in a fresh process and return its metrics
+    """
+    env = dict(
+        os.environ,
+        DB_HOST=config['database']['host'],
+        DB_PORT=str(config['database']['port']),
+        DB_NAME=config['database']['database'],
+        DB_USER=config['database']['user'],
+        DB_PASSWORD=config['database']['password'],
+        CONTENTFUL_API_URL=config['api_url'],
+        ACCESS_TOKEN='benchmark',
+    )
+    result = subprocess.run([sys.executable, __file__, '--child', json.dumps(config)],
+                            env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        return {'error': result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'child failed'}
+    return json.loads(result.stdout)
+
+
+# Counters from the run's metrics that give each stage its row count
+STAGE_ROW_COUNTERS = {
+    'load': 'rows_written_total',
+    'stale_cleanup': 'rows_deleted_total',
+    'delete_entries': 'rows_deleted_total',
+    'correctness': 'user_answers_recomputed_total',
+}
+
+
+def counter_total(summary, name, **labels):
+    return sum(
+        series['value'] for series in summary['counters'].get(name, [])
+        if all(series['labels'].get(key) == value for key, value in labels.items())
+    )
+
+
+def child_main(config):
+    """
+    Runs inside the child process: run one sync and print its metrics (see RunMetrics) as JSON
+    """
+    import resource
+
+    sys.path.insert(0, REPO_DIR)
+    import migrate_to_postgres as mp
+
+    options = config['options']
+    mp.request_scheduler = mp.RequestScheduler(rate=options['rate_limit'], max_concurrency=options['max_concurrency'])
+    if options['raw_json']:
+        mp.client = mp.RawContentfulClient(mp.SPACE_ID, mp.ACCESS_TOKEN, environment=mp.ENVIRONMENT_ID,
+                                           pool_size=options['max_concurrency'])
+
+    with open(config['log_path'], 'w') as log, redirect_stdout(log):
+        start = perf_counter()
+        mp.insert_contentful_data(
+            batch_size=options['batch_size'],
+            max_concurrency=options['max_concurrency'],
+            commit_mode=options['commit_mode'],
+            connections=options['connections'],
+        )
+        wall_seconds = perf_counter() - start
+    summary = mp.run_metrics.summary()
+
+    def rate(rows, seconds):
+        return round(rows / seconds) if seconds else None
+
+    stages = {}
+    for name, seconds in summary['stages'].items():
+        rows = counter_total(summary, STAGE_ROW_COUNTERS[name]) if name in STAGE_ROW_COUNTERS else None
+        stages[name] = {'seconds': seconds, 'rows': rows, 'rows_per_second': rate(rows, seconds) if rows is not None else None}
+    upserts = {}
+    for series in summary['histograms'].get('insert_seconds', []):
+        table_name = series['labels']['table']
+        rows = counter_total(summary, 'rows_written_total', table=table_name)
+        upserts[table_name] = {'rows': rows, 'seconds': round(series['sum'], 4), 'rows_per_second': rate(rows, series['sum'])}
+
+    print(json.dumps({
+        'wall_seconds': round(wall_seconds, 3),
+        'sql_statements': counter_total(summary, 'sql_statements_total'),
+        'sql_round_trips': counter_total(summary, 'sql_round_trips_total'),
+        'contentful_requests': {
+            outcome: counter_total(summary, f"contentful_{outcome}_total")
+            for outcome in ['requests', 'throttled', 'retried', 'failed']
+        },
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'stages': stages,
+        'upserts': upserts,
+        'error': summary['error'],
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark migrate_to_postgres.py against a fake CDA and a throwaway database")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help=f"comma-separated question counts: 1k, 10k, 100k, 1m or numbers (default {DEFAULT_SIZES})")
+    parser.add_argument('--runs', default=','.join(RUNS), help=f"comma-separated runs per size (default {','.join(RUNS)})")
+    parser.add_argument('--output', help="write the JSON results here instead of stdout")
+    parser.add_argument('--log-dir', help="keep each run's output here (default: a temporary directory)")
+    parser.add_argument('--user-answers-per-question', type=int, default=2,
+                        help="user answers seeded per question after the initial run (default 2)")
+    parser.add_argument('--server-rate-limit', type=float, default=DEFAULT_SERVER_RATE_LIMIT,
+                        help=f"requests per second the fake CDA allows before answering 429 (default {DEFAULT_SERVER_RATE_LIMIT}; 0 for none)")
+    parser.add_argument('--server-max-response-bytes', type=int, default=MAX_RESPONSE_BYTES,
+                        help=f"largest entries response the fake CDA builds before answering 400 (default {MAX_RESPONSE_BYTES})")
+    parser.add_argument('--pg-bin', help="directory holding initdb and pg_ctl (default: PATH)")
+    parser.add_argument('--db-host', help="use this PostgreSQL server instead of starting one")
+    parser.add_argument('--db-port', type=int, default=5432)
+    parser.add_argument('--db-user', default='postgres')
+    parser.add_argument('--db-password', default='')
+    # Passed through to the sync
+    parser.add_argument('--raw-json', action='store_true')
+    parser.add_argument('--commit-mode', default='autocommit')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--max-concurrency', type=int, default=8)
+    parser.add_argument('--connections', type=int, default=1)
+    parser.add_argument('--rate-limit', type=float, default=55)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child_main(json.loads(args.child))
+        return
+
+    runs = [run for run in args.runs.split(',') if run]
+    unknown = set(runs) - set(RUNS)
+    if unknown:
+        parser.error(f"unknown runs: {', '.join(sorted(unknown))}")
+    log_dir = args.log_dir or tempfile.mkdtemp(prefix='contentful-benchmark-logs-')
+    os.makedirs(log_dir, exist_ok=True)
+    options = {
+        'raw_json': args.raw_json,
+        'commit_mode': args.commit_mode,
+        'batch_size': args.batch_size,
+        'max_concurrency': args.max_concurrency,
+        'connections': args.connections,
+        'rate_limit': args.rate_limit,
+    }
+    results = []
+
+    with throwaway_database(args) as database:
+        for size in args.sizes.split(','):
+            questions = parse_size(size)
+            space = SyntheticSpace(questions)
+            server = FakeCDAServer(space, args.server_rate_limit or None,
+                                   max_response_bytes=args.server_max_response_bytes).start()
+            reset_schema(database)
+            try:
+                for run in runs:
+                    if run == 'unchanged':
+                        run_sql(database, ["DELETE FROM v2.sync_state"])
+                    server.reset_counters()
+                    log_path = os.path.join(log_dir, f"{size}-{run}.log")
+                    print(f"Running {run} sync of {questions} questions...", file=sys.stderr)
+                    metrics = run_child({
+                        'database': database,
+                        'api_url': server.url,
+                        'options': options,
+                        'log_path': log_path,
+                    })
+                    results.append(dict(
+                        {'questions': questions, 'entries': space.total(), 'run': run},
+                        http_requests=server.counters['requests'],
+                        http_throttled=server.counters['throttled'],
+                        log=log_path,
+                        **metrics
+                    ))
+                    if run == 'initial' and args.user_answers_per_question:
+                        seed_user_answers(database, args.user_answers_per_question)
+            finally:
+                server.stop()
+
+    output = json.dumps({
+        'revision': git_revision(),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'options': options,
+        'server_rate_limit': args.server_rate_limit,
+        'server_max_response_bytes': args.server_max_response_bytes,
+        'results': results,
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
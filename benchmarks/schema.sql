@@ -0,0 +1,63 @@
+-- Minimal v2 schema for benchmark databases: the tables, keys and foreign keys
+-- migrate_to_postgres.py writes to. Not the production DDL.
+CREATE SCHEMA v2;
+CREATE TABLE v2.subjects (
+    subject_id UUID PRIMARY KEY,
+    subject_name TEXT,
+    subject_jurisdiction TEXT,
+    is_free BOOLEAN
+);
+CREATE TABLE v2.topics (
+    topic_id UUID PRIMARY KEY,
+    topic_name TEXT,
+    subject_id UUID REFERENCES v2.subjects ON DELETE CASCADE
+);
+CREATE TABLE v2.subtopics (
+    subtopic_id UUID PRIMARY KEY,
+    subtopic_name TEXT,
+    topic_id UUID REFERENCES v2.topics ON DELETE CASCADE,
+    parent_subtopic_id UUID REFERENCES v2.subtopics ON DELETE CASCADE
+);
+CREATE TABLE v2.questions (
+    question_id UUID PRIMARY KEY,
+    question_text TEXT,
+    subtopic_id UUID REFERENCES v2.subtopics ON DELETE CASCADE,
+    subject_id UUID REFERENCES v2.subjects ON DELETE CASCADE,
+    topic_id UUID REFERENCES v2.topics ON DELETE CASCADE,
+    question_type TEXT,
+    correct_answer_id UUID,
+    explanation TEXT
+);
+CREATE TABLE v2.options (
+    option_id UUID PRIMARY KEY,
+    question_id UUID REFERENCES v2.questions ON DELETE CASCADE,
+    option_text TEXT,
+    is_correct BOOLEAN
+);
+CREATE TABLE v2.quiz (
+    quiz_id UUID PRIMARY KEY,
+    quiz_name TEXT,
+    subject_id UUID REFERENCES v2.subjects ON DELETE CASCADE,
+    topic_id UUID REFERENCES v2.topics ON DELETE CASCADE,
+    subtopic_id UUID REFERENCES v2.subtopics ON DELETE CASCADE,
+    distinction TEXT
+);
+CREATE TABLE v2.quiz_questions (
+    quiz_id UUID REFERENCES v2.quiz ON DELETE CASCADE,
+    question_id UUID REFERENCES v2.questions ON DELETE CASCADE,
+    question_order INTEGER,
+    PRIMARY KEY (quiz_id, question_id)
+);
+CREATE TABLE v2.user_answers (
+    answer_id SERIAL PRIMARY KEY,
+    user_id INTEGER,
+    question_id UUID REFERENCES v2.questions ON DELETE CASCADE,
+    chosen_answer_id UUID REFERENCES v2.options ON DELETE CASCADE,
+    is_correct BOOLEAN
+);
+CREATE INDEX ON v2.user_answers (question_id);
+CREATE INDEX ON v2.user_answers (chosen_answer_id);
+CREATE TABLE v2.subscriptions (
+    subscription_id SERIAL PRIMARY KEY,
+    subject_id UUID REFERENCES v2.subjects ON DELETE CASCADE
+);
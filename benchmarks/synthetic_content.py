@@ -0,0 +1,212 @@
+"""
+Deterministic synthetic Contentful space for benchmarking migrate_to_postgres.py.
+Every entry is computed from its ID when it is requested, so even the
+1M-question space costs no memory beyond the page being served.
+"""
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrate_to_postgres import (
+    ISSUE_CONTENT_TYPE,
+    QUIZ_CONTENT_TYPE,
+    SPACE_ID,
+    SUBJECT_CONTENT_TYPE,
+    SUBTOPIC_CONTENT_TYPE,
+    TOPIC_CONTENT_TYPE,
+)
+
+ANSWER_CONTENT_TYPE = 'answerOption'
+MULTIPLE_CHOICE_CONTENT_TYPE = 'multipleChoiceQuestion'
+TRUE_FALSE_CONTENT_TYPE = 'trueFalseQuestion'
+
+# Entry ID prefix of each content type; IDs look like "mcq-42" or "answer-42-3"
+ID_PREFIXES = {
+    SUBJECT_CONTENT_TYPE: 'subject',
+    TOPIC_CONTENT_TYPE: 'topic',
+    SUBTOPIC_CONTENT_TYPE: 'subtopic',
+    ISSUE_CONTENT_TYPE: 'issue',
+    MULTIPLE_CHOICE_CONTENT_TYPE: 'mcq',
+    TRUE_FALSE_CONTENT_TYPE: 'tfq',
+    QUIZ_CONTENT_TYPE: 'quiz',
+    ANSWER_CONTENT_TYPE: 'answer',
+}
+CONTENT_TYPES_BY_PREFIX = {prefix: content_type for content_type, prefix in ID_PREFIXES.items()}
+
+SIZES = {'1k': 1000, '10k': 10000, '100k': 100000, '1m': 1000000}
+ANSWERS_PER_QUESTION = 4
+QUESTIONS_PER_QUIZ = 20
+HIERARCHY_LEVELS = ['Subtopic', 'Issue', 'Topic', 'Subject']
+# Entries of a content type were created one second apart, in index order
+CREATED_EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.000Z'
+
+
+def parse_size(size):
+    """
+    Turn '10k', '1M' or '2500' into a question count
+    """
+    return SIZES.get(size.lower()) or int(size)
+
+
+def created_at(index):
+    return (CREATED_EPOCH + timedelta(seconds=index)).strftime(TIMESTAMP_FORMAT)
+
+
+def first_index_created_from(timestamp):
+    """
+    Index of the first entry created at or after timestamp (see created_at)
+    """
+    moment = datetime.strptime(timestamp[:19], '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc)
+    seconds = (moment - CREATED_EPOCH).total_seconds()
+    if timestamp[19:].strip('.0Z'):
+        seconds += 1  # a fraction of a second past an entry's timestamp
+    return max(0, int(seconds))
+
+
+def link(entry_id):
+    return {'sys': {'type': 'Link', 'linkType': 'Entry', 'id': entry_id}}
+
+
+class SyntheticSpace:
+    """
+    A space with the given number of questions and a proportional hierarchy:
+    three quarters multiple choice (four answer options each), one quarter
+    true/false, one subtopic per 50 questions, an issue under every other
+    subtopic, five subtopics per topic, ten topics per subject and a quiz of
+    twenty questions per 100 questions.
+    """
+
+    def __init__(self, questions, revision=1):
+        self.questions = questions
+        self.revision = revision
+        subtopics = max(1, questions // 50)
+        topics = max(1, subtopics // 5)
+        multiple_choice = questions * 3 // 4
+        self.counts = {
+            SUBJECT_CONTENT_TYPE: max(1, topics // 10),
+            TOPIC_CONTENT_TYPE: topics,
+            SUBTOPIC_CONTENT_TYPE: subtopics,
+            ISSUE_CONTENT_TYPE: max(1, subtopics // 2),
+            MULTIPLE_CHOICE_CONTENT_TYPE: multiple_choice,
+            TRUE_FALSE_CONTENT_TYPE: questions - multiple_choice,
+            QUIZ_CONTENT_TYPE: max(1, questions // 100),
+            ANSWER_CONTENT_TYPE: multiple_choice * ANSWERS_PER_QUESTION,
+        }
+
+    def total(self):
+        return sum(self.counts.values())
+
+    def ids(self, content_type, skip=0, limit=100):
+        """
+        IDs of one page of a content type, in creation order (sys.createdAt, then sys.id)
+        """
+        if content_type == ANSWER_CONTENT_TYPE:
+            stop = min(skip + limit, self.counts[content_type])
+            return [
+                f"answer-{index // ANSWERS_PER_QUESTION}-{index % ANSWERS_PER_QUESTION}"
+                for index in range(skip, stop)
+            ]
+        prefix = ID_PREFIXES[content_type]
+        stop = min(skip + limit, self.counts.get(content_type, 0))
+        return [f"{prefix}-{index}" for index in range(skip, stop)]
+
+    def entry(self, entry_id):
+        """
+        The CDA JSON of an entry, or None if the ID is not in this space
+        """
+        prefix, _, rest = entry_id.partition('-')
+        content_type = CONTENT_TYPES_BY_PREFIX.get(prefix)
+        if content_type is None:
+            return None
+        try:
+            numbers = [int(part) for part in rest.split('-')]
+        except ValueError:
+            return None
+        if content_type == ANSWER_CONTENT_TYPE:
+            if len(numbers) != 2 or numbers[1] >= ANSWERS_PER_QUESTION:
+                return None
+            index = numbers[0] * ANSWERS_PER_QUESTION + numbers[1]
+        else:
+            if len(numbers) != 1:
+                return None
+            index = numbers[0]
+        if not 0 <= index < self.counts[content_type]:
+            return None
+
+        return {
+            'sys': {
+                'id': entry_id,
+                'type': 'Entry',
+                'revision': self.revision,
+                'createdAt': created_at(index),
+                'updatedAt': created_at(index),
+                'locale': 'en-US',
+                'space': {'sys': {'type': 'Link', 'linkType': 'Space', 'id': SPACE_ID}},
+                'environment': {'sys': {'type': 'Link', 'linkType': 'Environment', 'id': 'master'}},
+                'contentType': {'sys': {'type': 'Link', 'linkType': 'ContentType', 'id': content_type}},
+            },
+            'fields': self.fields(content_type, numbers),
+        }
+
+    def fields(self, content_type, numbers):
+        index = numbers[0]
+        counts = self.counts
+        if content_type == SUBJECT_CONTENT_TYPE:
+            return {'name': f"Subject {index}", 'jurisdiction': ['CA', 'NY', 'TX'][index % 3]}
+        if content_type == TOPIC_CONTENT_TYPE:
+            return {'name': f"Topic {index}", 'subjectReference': link(f"subject-{index % counts[SUBJECT_CONTENT_TYPE]}")}
+        if content_type == SUBTOPIC_CONTENT_TYPE:
+            return {'name': f"Subtopic {index}", 'topicReference': link(f"topic-{index % counts[TOPIC_CONTENT_TYPE]}")}
+        if content_type == ISSUE_CONTENT_TYPE:
+            return {'name': f"Issue {index}", 'subtopicReference': link(f"subtopic-{index * 2 % counts[SUBTOPIC_CONTENT_TYPE]}")}
+        if content_type == ANSWER_CONTENT_TYPE:
+            question, option = numbers
+            return {'answerText': f"Answer {option} to question {question}", 'isCorrectAnswer': option == question % ANSWERS_PER_QUESTION}
+        if content_type == QUIZ_CONTENT_TYPE:
+            questions = []
+            for offset in range(QUESTIONS_PER_QUIZ):
+                number = (index * QUESTIONS_PER_QUIZ + offset) % self.questions
+                if number < counts[MULTIPLE_CHOICE_CONTENT_TYPE]:
+                    questions.append(link(f"mcq-{number}"))
+                else:
+                    questions.append(link(f"tfq-{number - counts[MULTIPLE_CHOICE_CONTENT_TYPE]}"))
+            return {
+                'name': f"Quiz {index}",
+                'subjectReference': link(f"subject-{index % counts[SUBJECT_CONTENT_TYPE]}"),
+                'distinction': 'Practice' if index % 2 else None,
+                'questions': questions,
+            }
+
+        # Both question types
+        level = HIERARCHY_LEVELS[index % len(HIERARCHY_LEVELS)]
+        reference = {
+            'Subtopic': f"subtopic-{index % counts[SUBTOPIC_CONTENT_TYPE]}",
+            'Issue': f"issue-{index % counts[ISSUE_CONTENT_TYPE]}",
+            'Topic': f"topic-{index % counts[TOPIC_CONTENT_TYPE]}",
+            'Subject': f"subject-{index % counts[SUBJECT_CONTENT_TYPE]}",
+        }[level]
+        fields = {
+            'questionText': f"Question {index}: which of the following best describes the rule? " * 2,
+            'hierarchyReference': link(reference),
+            'contentHierarchyLevelText': level,
+            'answerExplanation': f"Explanation for question {index}. " * 4,
+        }
+        if content_type == MULTIPLE_CHOICE_CONTENT_TYPE:
+            fields['answerOptions'] = [link(f"answer-{index}-{option}") for option in range(ANSWERS_PER_QUESTION)]
+        else:
+            fields['correctAnswer'] = index % 2 == 0
+        return fields
+
+    def linked_ids(self, entry):
+        """
+        IDs of the entries an entry links to, for the includes of a response
+        """
+        ids = []
+        for value in entry.get('fields', {}).values():
+            for item in value if isinstance(value, list) else [value]:
+                if isinstance(item, dict) and item.get('sys', {}).get('linkType') == 'Entry':
+                    ids.append(item['sys']['id'])
+        return ids
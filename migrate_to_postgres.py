@@ -1,28 +1,81 @@
+import argparse
+import cProfile
+import gzip
+import hashlib
+import hmac
+import io
+import json
+import multiprocessing
+import os
+import pstats
+import signal
+import sqlite3
+import sys
+import zlib
+from bisect import bisect_left
+from datetime import datetime, timezone
 from re import sub
 import pg8000
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import contextmanager, nullcontext, redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Full, Queue
 from contentful import Client
-from time import sleep
+from contentful.errors import HTTPError, RateLimitExceededError, get_error
+from random import uniform
+from time import monotonic, sleep, time
+from requests import Session
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
+from urllib.parse import parse_qs, urlparse
 
 # Database connection details
 
-DB_HOST = "xxx"
-DB_NAME = "BarTakerDB"
-DB_USER = "bartaker_admin"
-DB_PASSWORD = "xxxx"
+DB_HOST = os.environ.get("DB_HOST", "xxx")
+DB_PORT = int(os.environ.get("DB_PORT", 5432))
+DB_NAME = os.environ.get("DB_NAME", "BarTakerDB")
+DB_USER = os.environ.get("DB_USER", "bartaker_admin")
+DB_PASSWORD = os.environ.get("DB_PASSWORD", "xxxx")
+DB_SCHEMA = os.environ.get("DB_SCHEMA", "v2")  # schema holding the synced tables
 
 # Contentful connection details
 SPACE_ID = "hxu8jsem6qms"
 ENVIRONMENT_ID = "master"  # Replace if using a different environment
-ACCESS_TOKEN = "xxxx"
-
-# Create a Contentful client instance with longer timeout
-client = Client(
-    SPACE_ID, 
-    ACCESS_TOKEN, 
-    environment=ENVIRONMENT_ID,
-    timeout_s=30
-)
+ACCESS_TOKEN = os.environ.get("ACCESS_TOKEN", "xxxx")
+# Overridden to point both clients at a stand-in server (see benchmarks/)
+CONTENTFUL_API_URL = os.environ.get("CONTENTFUL_API_URL", "https://cdn.contentful.com")
+LOCALE = "en-US"  # The locale requested from the CDA and picked out of Sync API pages, which carry every locale
+
+# Contentful content type IDs
+SUBJECT_CONTENT_TYPE = '2UVKc9N9FTQ9lfqyfwQaGl'
+TOPIC_CONTENT_TYPE = '60H8p8k0YxbzjCVXs30xEA'
+SUBTOPIC_CONTENT_TYPE = '4ISm6Gy7vvKHsaIhOybTmh'
+ISSUE_CONTENT_TYPE = '71Bp6hF5Z1rB75OvLZH5Mk'
+QUIZ_CONTENT_TYPE = '4W0to1SsFsewSPWUfFJzGC'
+QUESTION_CONTENT_TYPES = {
+    'multipleChoiceQuestion': 'multiple_choice',
+    'trueFalseQuestion': 'true_false',
+}
+
+def create_client():
+    """
+    Create a Contentful client instance for SPACE_ID and ENVIRONMENT_ID with longer timeout.
+    429s are raised straight away so RequestScheduler can handle them.
+    """
+    return Client(
+        SPACE_ID, 
+        ACCESS_TOKEN, 
+        environment=ENVIRONMENT_ID,
+        api_url=urlparse(CONTENTFUL_API_URL).netloc,
+        https=urlparse(CONTENTFUL_API_URL).scheme == 'https',
+        timeout_s=30,
+        max_rate_limit_retries=0,
+        content_type_cache=False  # only raw fields are read, so skip the content type request
+    )
+
+
+client = create_client()
 
 import uuid
 
@@ -34,540 +87,3685 @@ def convert_to_uuid(contentful_id):
     return str(uuid.uuid5(NAMESPACE_UUID, contentful_id))
 
 
-# Helper function to get a UUID by querying the ID field in the database
-def get_uuid_by_id(cursor, table_name, id_value):
-    cursor.execute(
-        f"SELECT {table_name[:-1]}_id FROM v2.{table_name} WHERE {table_name[:-1]}_id = %s",
-        (id_value,)
-    )
-    result = cursor.fetchone()
-    return result[0] if result else None
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+METRICS_PREFIX = 'contentful_sync'
+DEFAULT_METRICS_JSON_PATH = 'run_metrics.json'
+
+
+class RunMetrics:
+    """
+    Counters, latency histograms and stage timings for one run, written at the
+    end as a JSON summary and optionally as a Prometheus textfile-collector file.
+    Metric names follow Prometheus conventions (..._total, ..._seconds) and take
+    labels such as table or stage. Safe to record from the fetch threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}    # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [observations per bucket..., over the last bucket, sum]
+        self.stages = {}      # stage -> seconds, in the order the stages first ran
+        self.started_at = datetime.now(timezone.utc)
+        self.start = time()
+        self.error = None
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+            histogram[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            histogram[-1] += seconds
+
+    @contextmanager
+    def timed(self, name, **labels):
+        start = time()
+        try:
+            yield
+        finally:
+            self.observe(name, time() - start, **labels)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time one stage of the run; a stage that runs more than once is summed
+        """
+        start = time()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time() - start)
+
+    def add_stage(self, name, seconds):
+        with self.lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def summary(self, **details):
+        """
+        The run as a JSON-serialisable dict; details (the command and its options) are included as is
+        """
+        with self.lock:
+            counters = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                counters.setdefault(name, []).append({'labels': dict(labels), 'value': value})
+            histograms = {}
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                buckets = {}
+                for bound, observations in zip(LATENCY_BUCKETS, histogram):
+                    cumulative += observations
+                    buckets[str(bound)] = cumulative
+                histograms.setdefault(name, []).append({
+                    'labels': dict(labels),
+                    'count': sum(histogram[:-1]),
+                    'sum': round(histogram[-1], 6),
+                    'buckets': buckets,
+                })
+            return dict(
+                details,
+                started_at=self.started_at.isoformat(),
+                wall_seconds=round(time() - self.start, 3),
+                status='failed' if self.error else 'ok',
+                error=self.error,
+                stages={name: round(seconds, 3) for name, seconds in self.stages.items()},
+                counters=counters,
+                histograms=histograms,
+            )
+
+    def prometheus(self):
+        """
+        The run in the Prometheus text exposition format
+        """
+        def escape(label):
+            # Backslash, double quote and newline must be escaped in label values
+            return str(label).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        def series(name, labels, value, extra=()):
+            pairs = list(labels) + list(extra)
+            label_text = ','.join(f'{key}="{escape(label)}"' for key, label in pairs)
+            return f"{METRICS_PREFIX}_{name}{{{label_text}}} {value}" if pairs else f"{METRICS_PREFIX}_{name} {value}"
+
+        lines = [
+            f"# TYPE {METRICS_PREFIX}_last_run_timestamp_seconds gauge",
+            series('last_run_timestamp_seconds', (), round(self.start)),
+            f"# TYPE {METRICS_PREFIX}_last_run_success gauge",
+            series('last_run_success', (), 0 if self.error else 1),
+            f"# TYPE {METRICS_PREFIX}_run_duration_seconds gauge",
+            series('run_duration_seconds', (), round(time() - self.start, 3)),
+            f"# TYPE {METRICS_PREFIX}_stage_duration_seconds gauge",
+        ]
+        with self.lock:
+            for name, seconds in self.stages.items():
+                lines.append(series('stage_duration_seconds', [('stage', name)], round(seconds, 6)))
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {METRICS_PREFIX}_{name} counter")
+                lines.append(series(name, labels, value))
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {METRICS_PREFIX}_{name} histogram")
+                cumulative = 0
+                for bound, observations in zip(LATENCY_BUCKETS, histogram):
+                    cumulative += observations
+                    lines.append(series(f"{name}_bucket", labels, cumulative, [('le', bound)]))
+                count = sum(histogram[:-1])
+                lines.append(series(f"{name}_bucket", labels, count, [('le', '+Inf')]))
+                lines.append(series(f"{name}_sum", labels, round(histogram[-1], 6)))
+                lines.append(series(f"{name}_count", labels, count))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, json_path=None, textfile_path=None, **details):
+        """
+        Write the JSON summary and/or the Prometheus textfile. The textfile is
+        renamed into place so the collector never reads a partial file.
+        """
+        if json_path:
+            with open(json_path, 'w') as file:
+                json.dump(self.summary(**details), file, indent=2)
+            print(f"Run metrics written to {json_path}")
+        if textfile_path:
+            temp_path = f"{textfile_path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w') as file:
+                file.write(self.prometheus())
+            os.replace(temp_path, textfile_path)
+            print(f"Prometheus metrics written to {textfile_path}")
+
+
+run_metrics = RunMetrics()
+
+
+class InstrumentedCursor:
+    """
+    Wraps a pg8000 cursor so every statement is counted and timed in run_metrics,
+    labelled by its kind (INSERT, UPDATE, DELETE, SELECT, ...)
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, operation, *args, **kwargs):
+        kind = operation.split(None, 1)[0].upper()
+        with run_metrics.timed('sql_statement_seconds', kind=kind):
+            result = self.cursor.execute(operation, *args, **kwargs)
+        run_metrics.count('sql_statements_total', kind=kind)
+        run_metrics.count('sql_round_trips_total')
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+class HierarchyIndex:
+    """
+    In-memory copy of the subject/topic/subtopic hierarchy, filled in as those
+    tables load so questions and quizzes resolve their parents without
+    querying the database. References to entries that are not in the index
+    are counted as dangling and reported at the end of the run.
+    """
+
+    def __init__(self):
+        self.subjects = {}   # subject_id -> subject_jurisdiction
+        self.topics = {}     # topic_id -> subject_id
+        self.subtopics = {}  # subtopic_id -> (topic_id, parent_subtopic_id)
+        self.dangling = {}   # (from_table, to_table) -> list of missing UUIDs
+
+    @classmethod
+    def from_database(cls, cursor, active_ids=None):
+        """
+        Seed the index from rows already in the database, for runs that only
+        load part of the hierarchy. With active_ids (table -> set of IDs), rows
+        not in those sets are left out, so stale rows cannot be resolved as parents.
+        """
+        index = cls()
+        cursor.execute(f"SELECT subject_id, subject_jurisdiction FROM {DB_SCHEMA}.subjects")
+        for subject_id, jurisdiction in cursor.fetchall():
+            index.subjects[str(subject_id)] = jurisdiction
+        cursor.execute(f"SELECT topic_id, subject_id FROM {DB_SCHEMA}.topics")
+        for topic_id, subject_id in cursor.fetchall():
+            index.topics[str(topic_id)] = str(subject_id) if subject_id else None
+        cursor.execute(f"SELECT subtopic_id, topic_id, parent_subtopic_id FROM {DB_SCHEMA}.subtopics")
+        for subtopic_id, topic_id, parent_subtopic_id in cursor.fetchall():
+            index.subtopics[str(subtopic_id)] = (
+                str(topic_id) if topic_id else None,
+                str(parent_subtopic_id) if parent_subtopic_id else None
+            )
+        if active_ids is not None:
+            for table_name in ['subjects', 'topics', 'subtopics']:
+                entries = getattr(index, table_name)
+                for stale_id in set(entries) - active_ids[table_name]:
+                    del entries[stale_id]
+        return index
+
+    def lookup(self, from_table, to_table, id_value):
+        """
+        Return id_value if it exists in to_table, otherwise record it as dangling
+        """
+        if id_value in getattr(self, to_table):
+            return id_value
+        self.dangling.setdefault((from_table, to_table), []).append(id_value)
+        return None
+
+    def resolve(self, from_table, hierarchy_level, hierarchy_ref):
+        """
+        Resolve a Subject/Topic/Subtopic/Issue reference to (subject_id, topic_id, subtopic_id)
+        """
+        subject_id = None
+        topic_id = None
+        subtopic_id = None
+
+        if hierarchy_level == "Subject":
+            subject_id = self.lookup(from_table, 'subjects', hierarchy_ref)
+        elif hierarchy_level == "Topic":
+            topic_id = self.lookup(from_table, 'topics', hierarchy_ref)
+            subject_id = self.topics.get(topic_id)
+        elif hierarchy_level in ("Subtopic", "Issue"):
+            # Issues are stored in the subtopics table alongside subtopics
+            subtopic_id = self.lookup(from_table, 'subtopics', hierarchy_ref)
+            if subtopic_id:
+                topic_id = self.subtopics[subtopic_id][0]
+                subject_id = self.topics.get(topic_id)
 
+        return subject_id, topic_id, subtopic_id
 
-# Helper function to insert data with a specific set of fields
-def insert_data(cursor, table_name, data_dict):
-    columns = ', '.join(data_dict.keys())
-    values_placeholder = ', '.join(['%s'] * len(data_dict))
+    def report(self):
+        if not self.dangling:
+            print("No dangling hierarchy references")
+            return
+        print("Dangling hierarchy references:")
+        for (from_table, to_table), missing in sorted(self.dangling.items()):
+            examples = ', '.join(missing[:3])
+            print(f"- {from_table} -> {to_table}: {len(missing)} (e.g. {examples})")
+
+
+# Helper function to upsert a batch of rows that share the same set of fields.
+# Returns the IDs of rows that affect user_answers correctness and actually changed.
+def insert_data(cursor, table_name, rows):
+    columns = ', '.join(rows[0].keys())
+    row_placeholder = '(' + ', '.join(['%s'] * len(rows[0])) + ')'
+    values_placeholder = ', '.join([row_placeholder] * len(rows))
     
-    if table_name == 'quiz_questions':
+    if table_name == 'question_answers':
+        # Not a table: sets correct_answer_id (and explanation, when Contentful has one)
+        # once the question's options have been written
+        query = f"""
+            UPDATE {DB_SCHEMA}.questions q
+            SET 
+                correct_answer_id = v.correct_answer_id::uuid,
+                explanation = CASE WHEN v.has_explanation::boolean THEN v.explanation::text ELSE q.explanation END
+            FROM (VALUES {values_placeholder}) AS v({columns})
+            WHERE q.question_id = v.question_id::uuid
+            AND (q.correct_answer_id IS DISTINCT FROM v.correct_answer_id::uuid OR
+                 (v.has_explanation::boolean AND q.explanation IS DISTINCT FROM v.explanation::text))
+            RETURNING q.question_id
+        """
+    elif table_name == 'quiz_questions':
         query = f"""
-            INSERT INTO v2.{table_name} ({columns}) 
-            VALUES ({values_placeholder})
+            INSERT INTO {DB_SCHEMA}.{table_name} ({columns}) 
+            VALUES {values_placeholder}
             ON CONFLICT (quiz_id, question_id) DO UPDATE 
             SET question_order = EXCLUDED.question_order
         """
+    elif table_name == 'entry_state':
+        query = f"""
+            INSERT INTO {DB_SCHEMA}.{table_name} ({columns})
+            VALUES {values_placeholder}
+            ON CONFLICT (entry_uuid) DO UPDATE
+            SET version = EXCLUDED.version, row_hash = EXCLUDED.row_hash, updated_at = now()
+        """
     elif table_name == 'options':
+        # user_answers.is_correct is recomputed once at the end of the load from the
+        # returned IDs (see recompute_user_answer_correctness)
         query = f"""
-            WITH updated_option AS (
-                INSERT INTO v2.{table_name} ({columns}) 
-                VALUES ({values_placeholder})
-                ON CONFLICT (option_id) DO UPDATE 
-                SET 
-                    option_text = EXCLUDED.option_text,
-                    is_correct = EXCLUDED.is_correct
-                WHERE 
-                    v2.{table_name}.option_id = EXCLUDED.option_id AND
-                    (v2.{table_name}.option_text != EXCLUDED.option_text OR
-                     v2.{table_name}.is_correct != EXCLUDED.is_correct)
-                RETURNING option_id, question_id, is_correct
-            )
-            UPDATE v2.user_answers ua
-            SET is_correct = uo.is_correct
-            FROM updated_option uo
-            WHERE ua.chosen_answer_id = uo.option_id
-            AND EXISTS (SELECT 1 FROM updated_option)
+            INSERT INTO {DB_SCHEMA}.{table_name} ({columns}) 
+            VALUES {values_placeholder}
+            ON CONFLICT (option_id) DO UPDATE 
+            SET 
+                option_text = EXCLUDED.option_text,
+                is_correct = EXCLUDED.is_correct
+            WHERE 
+                {DB_SCHEMA}.{table_name}.option_text != EXCLUDED.option_text OR
+                {DB_SCHEMA}.{table_name}.is_correct != EXCLUDED.is_correct
+            RETURNING option_id
         """
     elif table_name == 'questions':
+        # correct_answer_id and explanation are not in these rows; question_answers sets them
         query = f"""
-            WITH updated_question AS (
-                INSERT INTO v2.{table_name} ({columns}) 
-                VALUES ({values_placeholder})
-                ON CONFLICT (question_id) DO UPDATE 
-                SET 
-                    question_text = EXCLUDED.question_text,
-                    correct_answer_id = EXCLUDED.correct_answer_id,
-                    explanation = EXCLUDED.explanation,
-                    subtopic_id = EXCLUDED.subtopic_id,
-                    question_type = EXCLUDED.question_type
-                WHERE 
-                    v2.{table_name}.question_id = EXCLUDED.question_id AND
-                    (v2.{table_name}.question_text != EXCLUDED.question_text OR
-                     v2.{table_name}.correct_answer_id IS DISTINCT FROM EXCLUDED.correct_answer_id OR
-                     v2.{table_name}.explanation IS DISTINCT FROM EXCLUDED.explanation OR
-                     v2.{table_name}.subtopic_id IS DISTINCT FROM EXCLUDED.subtopic_id OR
-                     v2.{table_name}.question_type != EXCLUDED.question_type)
-                RETURNING question_id, correct_answer_id
-            )
-            UPDATE v2.user_answers ua
-            SET is_correct = (ua.chosen_answer_id = uq.correct_answer_id)
-            FROM updated_question uq
-            WHERE ua.question_id = uq.question_id
-            AND ua.chosen_answer_id IS NOT NULL
-            AND uq.correct_answer_id IS NOT NULL
-            AND EXISTS (SELECT 1 FROM updated_question)
+            INSERT INTO {DB_SCHEMA}.{table_name} ({columns}) 
+            VALUES {values_placeholder}
+            ON CONFLICT (question_id) DO UPDATE 
+            SET 
+                question_text = EXCLUDED.question_text,
+                subtopic_id = EXCLUDED.subtopic_id,
+                question_type = EXCLUDED.question_type
+            WHERE 
+                {DB_SCHEMA}.{table_name}.question_text != EXCLUDED.question_text OR
+                {DB_SCHEMA}.{table_name}.subtopic_id IS DISTINCT FROM EXCLUDED.subtopic_id OR
+                {DB_SCHEMA}.{table_name}.question_type != EXCLUDED.question_type
         """
     else:
         # Original logic for other tables
-        update_set = ', '.join([f"{k} = EXCLUDED.{k}" for k in data_dict.keys()])
+        update_set = ', '.join([f"{k} = EXCLUDED.{k}" for k in rows[0].keys()])
         primary_key = f"{table_name[:-1] if table_name != 'quiz' else 'quiz'}_id"
         query = f"""
-            INSERT INTO v2.{table_name} ({columns}) 
-            VALUES ({values_placeholder})
+            INSERT INTO {DB_SCHEMA}.{table_name} ({columns}) 
+            VALUES {values_placeholder}
             ON CONFLICT ({primary_key}) DO UPDATE 
             SET {update_set}
         """
     
-    cursor.execute(query, tuple(data_dict.values()))
+    with run_metrics.timed('insert_seconds', table=table_name):
+        cursor.execute(query, tuple(value for row in rows for value in row.values()))
+    run_metrics.count('rows_written_total', len(rows), table=table_name)
+    run_metrics.count('rows_affected_total', max(cursor.rowcount, 0), table=table_name)
+    if 'RETURNING' in query:
+        return [str(row[0]) for row in cursor.fetchall()]
+    return []
+
+
+# Conflict key of each batch; rows repeating a key within one batch keep the last value,
+# since ON CONFLICT DO UPDATE cannot touch the same row twice in one statement
+CONFLICT_KEYS = {
+    'subjects': ('subject_id',),
+    'topics': ('topic_id',),
+    'subtopics': ('subtopic_id',),
+    'questions': ('question_id',),
+    'options': ('option_id',),
+    'question_answers': ('question_id',),
+    'quiz': ('quiz_id',),
+    'quiz_questions': ('quiz_id', 'question_id'),
+    'entry_state': ('entry_uuid',),
+}
+# Flushing a table flushes everything before it first, so foreign keys are always satisfied
+TABLE_LOAD_ORDER = list(CONFLICT_KEYS)
+DEFAULT_BATCH_SIZE = 500
+# Most parameters one statement can bind (a 16-bit count in the Postgres protocol)
+MAX_QUERY_PARAMETERS = 65535
+
+# Tables each v2 table references; they are written before it and cleaned up after it.
+# question_answers points questions at their options, so it waits for both.
+TABLE_DEPENDENCIES = {
+    'subjects': (),
+    'topics': ('subjects',),
+    'subtopics': ('topics',),
+    'questions': ('subjects', 'topics', 'subtopics'),
+    'options': ('questions',),
+    'question_answers': ('questions', 'options'),
+    'quiz': ('subjects', 'topics', 'subtopics'),
+    'quiz_questions': ('quiz', 'questions'),
+    'entry_state': (),
+    'user_answers': ('questions', 'options'),
+    'subscriptions': ('subjects',),
+}
+# Rows that reference other rows of their own table: (key column, parent column)
+SELF_REFERENCES = {
+    'subtopics': ('subtopic_id', 'parent_subtopic_id'),  # issues hang off subtopics
+}
 
 
-def get_contentful_entries_with_retry(client, query, max_retries=3, delay=5):
+def dependency_levels(tables, dependencies):
     """
-    Fetch entries from Contentful with retry logic
+    Group tables into levels where every table comes after the tables it depends
+    on (among those given), so the tables of one level can be written at the same time
     """
-    for attempt in range(max_retries):
-        try:
-            return client.entries(query)
-        except Exception as e:
-            if attempt == max_retries - 1:  # Last attempt
-                raise e
-            print(f"Attempt {attempt + 1} failed. Retrying in {delay} seconds...")
-            sleep(delay)
-            delay *= 2  # Exponential backoff
+    levels = []
+    remaining = list(tables)
+    while remaining:
+        level = [table for table in remaining if not set(dependencies.get(table, ())) & set(remaining)]
+        if not level:
+            raise ValueError(f"Circular table dependencies among {', '.join(remaining)}")
+        levels.append(level)
+        remaining = [table for table in remaining if table not in level]
+    return levels
+
 
-def get_paginated_entries(client, content_type, batch_size=100):
+# A watermark is only written once every row of its entry is in, so entry_state goes last
+LOAD_LEVELS = dependency_levels(
+    TABLE_LOAD_ORDER,
+    dict(TABLE_DEPENDENCIES, entry_state=tuple(name for name in TABLE_LOAD_ORDER if name != 'entry_state'))
+)
+
+
+def split_self_referencing(table_name, rows):
     """
-    Get all entries of a content type using pagination
+    Split rows into waves so that a row whose parent is among the rows comes in a
+    later wave than the parent; only needed when the waves go to different connections
     """
-    skip = 0
-    all_entries = []
-    
-    while True:
+    if table_name not in SELF_REFERENCES:
+        return [rows]
+    key, parent = SELF_REFERENCES[table_name]
+    waves = []
+    while rows:
+        waiting_keys = {row[key] for row in rows}
+        wave = [row for row in rows if row[parent] not in waiting_keys or row[parent] == row[key]]
+        if not wave:
+            # A cycle; leave it to the database to reject
+            wave = rows
+        waves.append(wave)
+        in_wave = {row[key] for row in wave}
+        rows = [row for row in rows if row[key] not in in_wave]
+    return waves
+
+
+# Column of each table's rows naming the Contentful entry (watermark) the row belongs to
+ENTRY_KEY_COLUMNS = {
+    'subjects': 'subject_id',
+    'topics': 'topic_id',
+    'subtopics': 'subtopic_id',
+    'questions': 'question_id',
+    'options': 'question_id',
+    'question_answers': 'question_id',
+    'quiz': 'quiz_id',
+    'quiz_questions': 'quiz_id',
+    'entry_state': 'entry_uuid',
+}
+# Column of each table's rows naming the question or quiz they count towards in the analytics summary
+SUMMARY_KEY_COLUMNS = {
+    'questions': 'question_id',
+    'question_answers': 'question_id',
+    'options': 'question_id',
+    'quiz': 'quiz_id',
+    'quiz_questions': 'quiz_id',
+}
+# Deleting rows of these may cascade to questions and quizzes the summary cannot see go,
+# so the IDs reported for them are None, which makes AnalyticsSummary rebuild
+SUMMARY_CASCADE_TABLES = ('subjects', 'topics', 'subtopics')
+COMMIT_MODES = ['autocommit', 'batched', 'atomic']
+DEFAULT_COMMIT_EVERY = 5000
+
+
+class CommitPolicy:
+    """
+    Decides when a run commits.
+    Modes:
+        autocommit: every statement commits on its own
+        batched: commit every commit_every rows written and at the end of each stage
+        atomic: one transaction for the whole run, committed only once everything succeeded
+    """
+
+    def __init__(self, conn, mode='autocommit', commit_every=DEFAULT_COMMIT_EVERY):
+        self.conn = conn
+        self.mode = mode
+        self.commit_every = commit_every
+        self.uncommitted_rows = 0
+        self.commits = 0
+        self.commit_seconds = 0.0
+        conn.autocommit = mode == 'autocommit'
+
+    @contextmanager
+    def savepoint(self, cursor):
+        """
+        Roll a failed block back to where it started instead of aborting the transaction
+        """
+        if self.mode == 'autocommit':
+            yield
+            return
+        cursor.execute("SAVEPOINT batch")
         try:
-            entries = get_contentful_entries_with_retry(client, {
-                'content_type': content_type,
-                'limit': batch_size,
-                'skip': skip
-            })
-            
-            if not entries:
-                break
-                
-            all_entries.extend(entries)
-            print(f"Retrieved {len(all_entries)} {content_type} entries so far...")
-            
-            if len(entries) < batch_size:
-                break
-                
-            skip += batch_size
-            
-        except Exception as e:
-            print(f"Error retrieving {content_type} entries at skip={skip}: {e}")
+            yield
+        except Exception:
+            cursor.execute("ROLLBACK TO SAVEPOINT batch")
             raise
-            
-    return all_entries
+        cursor.execute("RELEASE SAVEPOINT batch")
+
+    def rows_written(self, count):
+        self.uncommitted_rows += count
+        if self.mode == 'batched' and self.uncommitted_rows >= self.commit_every:
+            self.commit()
+
+    def end_stage(self):
+        if self.mode == 'batched':
+            self.commit()
+
+    def finish(self):
+        if self.mode != 'autocommit':
+            self.commit()
+
+    def commit(self):
+        start = time()
+        self.conn.commit()
+        seconds = time() - start
+        run_metrics.observe('commit_seconds', seconds)
+        run_metrics.count('sql_round_trips_total')
+        self.commit_seconds += seconds
+        self.commits += 1
+        self.uncommitted_rows = 0
+
+    def report(self):
+        if self.mode == 'autocommit':
+            print("\nCommits: one per statement (autocommit)")
+        else:
+            print(f"\nCommits: {self.commits} in {self.mode} mode, {self.commit_seconds:.2f}s spent committing")
+
+
+def connect_database():
+    return pg8000.connect(host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PASSWORD)
 
-def delete_stale_data(cursor, table_name, active_ids):
+
+class ConnectionPool:
     """
-    Delete records that exist in the database but not in Contentful
+    Extra database connections, each with its own cursor and CommitPolicy, for
+    running the independent statements of one dependency level at the same time.
+    A connection only ever runs one task at a time. One transaction cannot span
+    several connections, so atomic commit mode is not supported.
+    """
+
+    def __init__(self, size, commit_mode='autocommit', commit_every=DEFAULT_COMMIT_EVERY):
+        if commit_mode == 'atomic':
+            raise ValueError("Atomic commit mode needs a single connection; use batched or autocommit with more connections")
+        self.executor = ThreadPoolExecutor(max_workers=size)
+        self.workers = []
+        for _ in range(size):
+            conn = connect_database()
+            self.workers.append((conn, InstrumentedCursor(conn.cursor()), CommitPolicy(conn, commit_mode, commit_every)))
+
+    def __len__(self):
+        return len(self.workers)
+
+    def run(self, tasks):
+        """
+        Run tasks, a list of (worker, function) pairs, and return their results in order
+        once all of them have finished. Each function is called as function(cursor, commits)
+        on connection worker % len(self), after the earlier tasks given to that connection.
+        Before returning, every connection ends its stage (commits, in batched mode), so
+        whatever runs next on any connection sees these rows.
+        """
+        assigned = {}
+        for position, (worker, function) in enumerate(tasks):
+            assigned.setdefault(worker % len(self.workers), []).append((position, function))
+
+        def run_worker(worker, functions):
+            _, cursor, commits = self.workers[worker]
+            results = [(position, function(cursor, commits)) for position, function in functions]
+            commits.end_stage()
+            return results
+
+        futures = [self.executor.submit(run_worker, worker, functions) for worker, functions in assigned.items()]
+        # Let every connection finish before raising, so none is still busy afterwards
+        wait(futures)
+        results = [None] * len(tasks)
+        for future in futures:
+            for position, result in future.result():
+                results[position] = result
+        return results
+
+    def report(self):
+        commits = sum(commits.commits for _, _, commits in self.workers)
+        print(f"Loader connections: {len(self.workers)} ({commits} commits between them)")
+
+    def close(self):
+        self.executor.shutdown()
+        for conn, _, _ in self.workers:
+            conn.close()
+
+
+class BatchWriter:
+    """
+    Collects rows per table and writes them with one multi-row upsert per
+    batch_size rows instead of one statement per row. A batch the database
+    rejects is retried row by row so only the bad rows are skipped.
+    With a ConnectionPool, batches are written over all its connections at
+    once, one dependency level (see LOAD_LEVELS) at a time, and a table is only
+    flushed once it holds a batch for every connection.
+    """
+
+    def __init__(self, cursor, batch_size=DEFAULT_BATCH_SIZE, commits=None, pool=None):
+        self.cursor = cursor
+        self.batch_size = batch_size
+        self.commits = commits
+        self.pool = pool
+        # Rows a table buffers before it is flushed: enough to keep every connection busy
+        self.flush_size = batch_size * (len(pool) if pool is not None else 1)
+        self.lock = threading.Lock()
+        self.pending = {table_name: {} for table_name in TABLE_LOAD_ORDER}
+        self.stats = {}  # table_name -> [rows written, seconds spent]
+        self.rejected = {}  # table_name -> rows skipped after a database error
+        self.rejected_entries = set()  # their entries keep the old watermark so the next run retries them
+        # IDs whose correctness inputs changed, for recompute_user_answer_correctness
+        self.changed_question_ids = set()
+        self.changed_option_ids = set()
+        # Questions and quizzes whose rows were written or deleted, for AnalyticsSummary
+        self.summary_ids = set()
+
+    def add(self, table_name, row):
+        if table_name == 'entry_state' and row['entry_uuid'] in self.rejected_entries:
+            return
+        summary_column = SUMMARY_KEY_COLUMNS.get(table_name)
+        if summary_column:
+            self.summary_ids.add(str(row[summary_column]))
+        rows = self.pending[table_name]
+        rows[tuple(row[column] for column in CONFLICT_KEYS[table_name])] = row
+        if len(rows) >= self.flush_size:
+            self.flush(table_name)
+
+    def flush(self, table_name=None):
+        """
+        Write pending rows for table_name and every table it depends on,
+        or for all tables when table_name is None
+        """
+        last = len(TABLE_LOAD_ORDER) if table_name is None else TABLE_LOAD_ORDER.index(table_name) + 1
+        if self.pool is not None:
+            self.flush_in_parallel(TABLE_LOAD_ORDER[:last])
+            return
+        for name in TABLE_LOAD_ORDER[:last]:
+            rows = list(self.pending[name].values())
+            if not rows:
+                continue
+            self.pending[name] = {}
+            start = time()
+            for batch in self.batches(rows):
+                self.record_changed(name, self.write(name, batch))
+            stats = self.stats.setdefault(name, [0, 0.0])
+            stats[0] += len(rows)
+            stats[1] += time() - start
+
+    def flush_in_parallel(self, names):
+        """
+        Write the pending rows of names level by level, spreading each level's
+        batches over the pool's connections. A level starts only once the one
+        before it is written and committed, so every foreign key is satisfied.
+        """
+        if self.commits is not None:
+            # The pool's connections must see, and not wait on, what this connection wrote
+            self.commits.end_stage()
+        for level in LOAD_LEVELS:
+            rows_by_table = {}
+            for name in level:
+                if name in names and self.pending[name]:
+                    rows_by_table[name] = list(self.pending[name].values())
+                    self.pending[name] = {}
+            if not rows_by_table:
+                continue
+            start = time()
+            waves = {name: split_self_referencing(name, rows) for name, rows in rows_by_table.items()}
+            for wave in range(max(len(table_waves) for table_waves in waves.values())):
+                batches = [
+                    (name, batch)
+                    for name, table_waves in waves.items() if wave < len(table_waves)
+                    for batch in self.batches(table_waves[wave])
+                ]
+                results = self.pool.run([
+                    (worker, lambda cursor, commits, name=name, rows=rows: self.write(name, rows, cursor, commits))
+                    for worker, (name, rows) in enumerate(batches)
+                ])
+                for (name, _), changed_ids in zip(batches, results):
+                    self.record_changed(name, changed_ids)
+            seconds = time() - start
+            for name, rows in rows_by_table.items():
+                stats = self.stats.setdefault(name, [0, 0.0])
+                stats[0] += len(rows)
+                stats[1] += seconds
+
+    def batches(self, rows):
+        """
+        Split rows of one table into statements of batch_size rows, fewer for
+        wide tables so no statement binds more than MAX_QUERY_PARAMETERS values
+        """
+        size = max(1, min(self.batch_size, MAX_QUERY_PARAMETERS // len(rows[0])))
+        return [rows[offset:offset + size] for offset in range(0, len(rows), size)]
+
+    def record_changed(self, table_name, changed_ids):
+        if table_name == 'options':
+            self.changed_option_ids.update(changed_ids)
+        elif table_name == 'question_answers':
+            self.changed_question_ids.update(changed_ids)
+
+    def write(self, table_name, rows, cursor=None, commits=None):
+        """
+        Upsert rows through cursor and commits (this writer's own unless a pool connection's are given)
+        """
+        if cursor is None:
+            cursor, commits = self.cursor, self.commits
+        try:
+            if commits is None:
+                changed_ids = insert_data(cursor, table_name, rows)
+            else:
+                with commits.savepoint(cursor):
+                    changed_ids = insert_data(cursor, table_name, rows)
+        except pg8000.DatabaseError as e:
+            if len(rows) > 1:
+                # Find the bad rows instead of losing the whole batch
+                return [changed_id for row in rows for changed_id in self.write(table_name, [row], cursor, commits)]
+            entry_uuid = rows[0][ENTRY_KEY_COLUMNS[table_name]]
+            print(f"Skipping {table_name} row of entry {entry_uuid}: {e}")
+            with self.lock:
+                self.rejected[table_name] = self.rejected.get(table_name, 0) + 1
+                self.rejected_entries.add(entry_uuid)
+                self.pending['entry_state'].pop((entry_uuid,), None)
+            return []
+        if commits is not None:
+            commits.rows_written(len(rows))
+        return changed_ids
+
+    def report(self):
+        print("\nUpsert throughput:")
+        total_rows = 0
+        total_seconds = 0.0
+        for name in TABLE_LOAD_ORDER:
+            if name not in self.stats:
+                continue
+            rows, seconds = self.stats[name]
+            total_rows += rows
+            total_seconds += seconds
+            rate = rows / seconds if seconds else float('inf')
+            print(f"- {name}: {rows} rows in {seconds:.2f}s ({rate:.0f} rows/s)")
+        if total_rows:
+            rate = total_rows / total_seconds if total_seconds else float('inf')
+            print(f"Total: {total_rows} rows in {total_seconds:.2f}s ({rate:.0f} rows/s)")
+        for name, count in self.rejected.items():
+            print(f"Rejected {count} {name} rows (see the errors above)")
+
+
+def recompute_user_answer_correctness(cursor, question_ids, option_ids):
+    """
+    Bring user_answers.is_correct in line with questions.correct_answer_id, in one
+    pass over only the answers to questions or options changed by this load
     Args:
         cursor: Database cursor
-        table_name: Name of the table to clean up
-        active_ids: Set of UUIDs that are currently active in Contentful
+        question_ids: Questions whose correct answer changed, or None to check every answer
+                      (for a resumed run, whose earlier changes were not kept)
+        option_ids: Options that were inserted or changed
     """
-    id_column = f"{table_name[:-1] if table_name != 'quiz' else 'quiz'}_id"
-    
-    # Special handling for quiz_questions table
-    if table_name == 'quiz_questions':
-        cursor.execute(f"""
-            DELETE FROM v2.{table_name}
-            WHERE (quiz_id, question_id) NOT IN (
-                SELECT quiz_id, question_id 
-                FROM unnest(%s::uuid[], %s::uuid[]) AS t(quiz_id, question_id)
-            )
-        """, ([x[0] for x in active_ids], [x[1] for x in active_ids]))
+    if question_ids is None:
+        condition = "TRUE"
+        params = ()
+        changed = "every question"
+    elif not question_ids and not option_ids:
+        print("\nNo questions or options changed; user answer correctness left as is")
+        return 0
     else:
+        condition = "(ua.question_id = ANY(%s::uuid[]) OR ua.chosen_answer_id = ANY(%s::uuid[]))"
+        params = (list(question_ids), list(option_ids))
+        changed = f"{len(question_ids)} questions and {len(option_ids)} options"
+
+    start = time()
+    with run_metrics.stage('correctness'):
+        cursor.execute(f"""
+            UPDATE {DB_SCHEMA}.user_answers ua
+            SET is_correct = (ua.chosen_answer_id = q.correct_answer_id)
+            FROM {DB_SCHEMA}.questions q
+            WHERE ua.question_id = q.question_id
+            AND {condition}
+            AND ua.chosen_answer_id IS NOT NULL
+            AND q.correct_answer_id IS NOT NULL
+            AND ua.is_correct IS DISTINCT FROM (ua.chosen_answer_id = q.correct_answer_id)
+        """, params)
+    updated_count = cursor.rowcount
+    run_metrics.count('user_answers_recomputed_total', updated_count)
+    print(f"\nRecomputed user answer correctness for {changed}: {updated_count} answers updated in {time() - start:.2f}s")
+    return updated_count
+
+
+class UnchangedEntryFilter:
+    """
+    Sits in front of a BatchWriter and drops entries that have not changed since
+    they were last written. Each entry's sys.version and a hash of its rows are
+    kept in v2.entry_state; when the hash matches, none of the entry's rows reach
+    the database, so their upserts and user_answers fix-ups never run.
+    Rows added outside begin_entry/end_entry are passed straight through.
+    When the Contentful IDs of the entries to come are known, pass them as
+    entry_ids so only their watermarks are read.
+    """
+
+    def __init__(self, cursor, writer, rewrite_all=False, entry_ids=None):
+        self.writer = writer
+        self.rewrite_all = rewrite_all
+        self.entry = None
+        self.rows = []
+        self.counts = {}  # table_name -> {'skipped': n, 'inserted': n, 'updated': n}
+
         cursor.execute(f"""
-            DELETE FROM v2.{table_name}
-            WHERE {id_column} NOT IN (
-                SELECT unnest(%s::uuid[])
+            CREATE TABLE IF NOT EXISTS {DB_SCHEMA}.entry_state (
+                entry_uuid UUID PRIMARY KEY,
+                entry_id TEXT NOT NULL,
+                version INTEGER,
+                row_hash TEXT NOT NULL,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
             )
-        """, (list(active_ids),))
-    
-    deleted_count = cursor.rowcount
-    print(f"Deleted {deleted_count} stale records from {table_name}")
-    return deleted_count
+        """)
+        if entry_ids is None:
+            cursor.execute(f"SELECT entry_uuid, version, row_hash FROM {DB_SCHEMA}.entry_state")
+        else:
+            cursor.execute(
+                f"SELECT entry_uuid, version, row_hash FROM {DB_SCHEMA}.entry_state WHERE entry_uuid = ANY(%s::uuid[])",
+                ([convert_to_uuid(entry_id) for entry_id in entry_ids],)
+            )
+        self.watermarks = {str(row[0]): (row[1], row[2]) for row in cursor.fetchall()}
 
-# Insert Contentful data into the PostgreSQL schema with proper foreign key handling
-def insert_contentful_data():
-    print("Starting to insert data")
-    # Establish connection to the PostgreSQL database using pg8000
-    conn = pg8000.connect(
-        host=DB_HOST, database=DB_NAME, user=DB_USER, password=DB_PASSWORD
-    )
-    conn.autocommit = True
-    cursor = conn.cursor()
+    def begin_entry(self, entry_id, version):
+        self.entry = (entry_id, version)
+        self.rows = []
 
-    try:
-        # Track active IDs for each table
-        active_subject_ids = set()
-        active_topic_ids = set()
-        active_subtopic_ids = set()
-        active_question_ids = set()
-        active_option_ids = set()
-        active_quiz_ids = set()
-        active_quiz_question_pairs = set()  # Will store (quiz_id, question_id) tuples
-
-        # Insert data in the correct order to satisfy foreign key constraints
-        # Step 1: Insert Subjects with retry logic
-        print("Fetching subjects...")
-        subject_entries = get_paginated_entries(client, '2UVKc9N9FTQ9lfqyfwQaGl')
-        for subject in subject_entries:
-            subject_id = convert_to_uuid(subject.sys['id'])
-            active_subject_ids.add(subject_id)
-            is_free = False
-            if subject.name == 'Evidence':
-                is_free = True
-            insert_data(cursor, 'subjects', {'subject_id': subject_id, 'subject_name': subject.name, 'subject_jurisdiction': subject.jurisdiction, 'is_free': is_free})
-
-        # Step 2: Insert Topics with retry logic
-        print("Fetching topics...")
-        topic_entries = get_paginated_entries(client, '60H8p8k0YxbzjCVXs30xEA')
-        for topic in topic_entries:
-            topic_id = convert_to_uuid(topic.sys['id'])
-            active_topic_ids.add(topic_id)
-            # Get the subject UUID based on the Contentful ID reference
-            subject_id = get_uuid_by_id(cursor, "subjects", convert_to_uuid(topic.raw['fields']['subjectReference']['sys']['id']))
-            if subject_id:
-                insert_data(cursor, 'topics', {
-                    'topic_id': topic_id,
-                    'topic_name': topic.name,
-                    'subject_id': subject_id
-                })
+    def add(self, table_name, row):
+        if self.entry is None:
+            self.writer.add(table_name, row)
+        else:
+            self.rows.append((table_name, row))
 
-        # Step 3: Insert Subtopics and Issues with retry logic
-        print("Fetching subtopics...")
-        subtopic_entries = get_paginated_entries(client, '4ISm6Gy7vvKHsaIhOybTmh')
-        print("Fetching issues...")
-        issue_entries = get_paginated_entries(client, '71Bp6hF5Z1rB75OvLZH5Mk')
-
-        # Insert Subtopics
-        for subtopic in subtopic_entries:
-            subtopic_id = convert_to_uuid(subtopic.sys['id'])
-            active_subtopic_ids.add(subtopic_id)
-            # Get the topic UUID based on the Contentful ID reference
-            topic_id = get_uuid_by_id(cursor, "topics", convert_to_uuid(subtopic.raw['fields']['topicReference']['sys']['id']))
-            if topic_id:
-                insert_data(cursor, 'subtopics', {
-                    'subtopic_id': subtopic_id,
-                    'subtopic_name': subtopic.name,
-                    'topic_id': topic_id,  # Assign the topic_id directly from the reference
-                    'parent_subtopic_id': None  # Subtopics do not have parent subtopics
-                })
+    def end_entry(self):
+        """
+        Hand the entry's rows to the writer unless they match its watermark.
+        Returns True if the rows were written.
+        """
+        (entry_id, version), rows = self.entry, self.rows
+        self.entry = None
+        self.rows = []
+        if not rows:
+            return False
 
-        # Insert Issues as children of Subtopics
-        for issue in issue_entries:
-            issue_id = convert_to_uuid(issue.sys['id'])
-            active_subtopic_ids.add(issue_id)
-            # Get the parent subtopic UUID based on the Contentful ID reference
-            parent_subtopic_id = get_uuid_by_id(cursor, "subtopics", convert_to_uuid(issue.raw['fields']['subtopicReference']['sys']['id']))
-            if parent_subtopic_id:
-                # Retrieve the topic_id of the parent subtopic
-                cursor.execute(
-                    "SELECT topic_id FROM v2.subtopics WHERE subtopic_id = %s",
-                    (parent_subtopic_id,)
-                )
-                topic_id = cursor.fetchone()[0] if cursor.rowcount > 0 else None
+        entry_uuid = convert_to_uuid(entry_id)
+        row_hash = hashlib.sha1(json.dumps(rows, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        previous = self.watermarks.get(entry_uuid)
+        self.watermarks[entry_uuid] = (version, row_hash)
+        counts = self.counts.setdefault(rows[0][0], {'skipped': 0, 'inserted': 0, 'updated': 0})
+        state = {'entry_uuid': entry_uuid, 'entry_id': entry_id, 'version': version, 'row_hash': row_hash}
 
-                insert_data(cursor, 'subtopics', {
-                    'subtopic_id': issue_id,  # Use subtopic_id since we're treating issues as subtopics
-                    'subtopic_name': issue.name,
-                    'topic_id': topic_id,  # Assign the same topic_id as the parent subtopic
-                    'parent_subtopic_id': parent_subtopic_id  # Issues are children of a subtopic
-                })
+        if previous is not None and previous[1] == row_hash and not self.rewrite_all:
+            counts['skipped'] += 1
+            run_metrics.count('entries_total', table=rows[0][0], outcome='skipped')
+            # Republished without a change to our rows: only the watermark moves
+            if previous[0] != version:
+                self.writer.add('entry_state', state)
+            return False
 
-        # Step 4: Process Questions
-        count = 0
-        for content_type in ['multipleChoiceQuestion', 'trueFalseQuestion']:
-            print(f"Fetching {content_type}...")
-            questionType = 'multiple_choice' if content_type == 'multipleChoiceQuestion' else 'true_false'
-            
-            entries = get_paginated_entries(client, content_type)
-            for question in entries:
-                count += 1
-                question_id = convert_to_uuid(question.sys['id'])
-                active_question_ids.add(question_id)
-                
-                # Process question (existing question processing logic here)
-                question_text = question.raw['fields']['questionText']
-                hierarchy_ref = convert_to_uuid(question.raw['fields']['hierarchyReference']['sys']['id'])
-                hierarchy_level = question.raw['fields']['contentHierarchyLevelText']
-
-                # Initialize the IDs to None
-                subject_id = None
-                topic_id = None
-                subtopic_id = None
-
-                # Determine the parent entity type and get the appropriate ID
-                if hierarchy_level == "Subject":
-                    subject_id = get_uuid_by_id(cursor, "subjects", hierarchy_ref)
-                elif hierarchy_level == "Topic":
-                    topic_id = get_uuid_by_id(cursor, "topics", hierarchy_ref)
-                    cursor.execute("SELECT subject_id FROM v2.topics WHERE topic_id = %s", (topic_id,))
-                    subject_id = cursor.fetchone()[0] if cursor.rowcount > 0 else None
-                elif hierarchy_level == "Subtopic":
-                    subtopic_id = get_uuid_by_id(cursor, "subtopics", hierarchy_ref)
-                    if subtopic_id:
-                        # Retrieve the topic_id of the parent subtopic
-                        cursor.execute("SELECT topic_id FROM v2.subtopics WHERE subtopic_id = %s", (subtopic_id,))
-                        topic_id = cursor.fetchone()[0] if cursor.rowcount > 0 else None
-                        cursor.execute("SELECT subject_id FROM v2.topics WHERE topic_id = %s", (topic_id,))
-                        subject_id = cursor.fetchone()[0] if cursor.rowcount > 0 else None
-
-                elif hierarchy_level == "Issue":
-                    subtopic_id = get_uuid_by_id(cursor, "subtopics", hierarchy_ref)
-                    # Issues are already in subtopics table; get the topic_id of parent issue
-                    if subtopic_id:
-                        # Retrieve the topic_id of the parent subtopic (issue)
-                        cursor.execute("SELECT topic_id FROM v2.subtopics WHERE subtopic_id = %s", (subtopic_id,))
-                        topic_id = cursor.fetchone()[0] if cursor.rowcount > 0 else None
-                        cursor.execute("SELECT subject_id FROM v2.topics WHERE topic_id = %s", (topic_id,))
-                        subject_id = cursor.fetchone()[0] if cursor.rowcount > 0 else None
-
-                # Insert the question with appropriate references
-                insert_data(cursor, 'questions', {
-                    'question_id': question_id,
-                    'question_text': question_text,
-                    'subtopic_id': subtopic_id,
-                    'subject_id': subject_id,
-                    'topic_id': topic_id,
-                    'question_type': questionType
-                })
+        for table_name, row in rows:
+            self.writer.add(table_name, row)
+        self.writer.add('entry_state', state)
+        outcome = 'updated' if previous is not None else 'inserted'
+        counts[outcome] += 1
+        run_metrics.count('entries_total', table=rows[0][0], outcome=outcome)
+        return True
 
-                # Step 5: Insert Options for each question
-                if questionType == 'multiple_choice':
-                    answer_options = question.raw['fields']['answerOptions']
-                    for answer in answer_options:
-                        answer_id = answer['sys']['id']
-                        entity = client.entries({'sys.id[in]': answer_id})
-                        option_id = convert_to_uuid(answer_id)
-                        active_option_ids.add(option_id)
-                        entity = entity[0]
-                        insert_data(cursor, 'options', {
-                            'option_id': option_id,
-                            'question_id': question_id,
-                            'option_text': entity.raw['fields']['answerText'],
-                            'is_correct': entity.raw['fields']['isCorrectAnswer']
-                        })
-                elif questionType == 'true_false':
-                    for option in ['True', 'False']:
-                        # Create a deterministic ID by combining question ID and T/F value
-                        option_id = convert_to_uuid(f"{question.sys['id']}_{option}")
-                        active_option_ids.add(option_id)
-                        isCorrectAnswer = str(question.raw['fields']['correctAnswer']).lower() == option.lower()
-                        insert_data(cursor, 'options', {
-                            'option_id': option_id,
-                            'question_id': question_id,
-                            'option_text': option,
-                            'is_correct': isCorrectAnswer
-                        })
-
-                # Move these outside the if/elif block since they apply to both types
-                cursor.execute(
-                    "SELECT option_id FROM v2.options WHERE question_id = %s AND is_correct = %s",
-                    (question_id, True)
-                )
-                correct_option_id = cursor.fetchone()[0] if cursor.rowcount > 0 else None
-                cursor.execute(
-                    "UPDATE v2.questions SET correct_answer_id = %s WHERE question_id = %s",
-                    (correct_option_id, question_id)
-                )
-                if 'answerExplanation' in question.raw['fields']:
-                    cursor.execute(
-                        "UPDATE v2.questions SET explanation = %s WHERE question_id = %s",
-                        (question.raw['fields']['answerExplanation'], question_id)
-                    )
+    def flush(self, table_name=None):
+        self.writer.flush(table_name)
 
-        print(f"Total number of questions processed: {len(active_question_ids)}")
-
-        # Step 6: Insert Quizzes
-        quiz_entries = client.entries({'content_type': '4W0to1SsFsewSPWUfFJzGC'})  # Replace with your Contentful quiz content type ID
-        for quiz in quiz_entries:
-            quiz_id = convert_to_uuid(quiz.sys['id'])
-            active_quiz_ids.add(quiz_id)
-            quiz_name = quiz.raw['fields']['name']
-            
-            # Optional links to subject, topic, and subtopic based on hierarchy level
-            subject_id = None
-            topic_id = None
-            subtopic_id = None
-            
-            # Determine if a subject, topic, or subtopic reference exists
-            if 'subjectReference' in quiz.raw['fields']:
-                subject_id = get_uuid_by_id(cursor, "subjects", convert_to_uuid(quiz.raw['fields']['subjectReference']['sys']['id']))
-            if 'topicReference' in quiz.raw['fields']:
-                topic_id = get_uuid_by_id(cursor, "topics", convert_to_uuid(quiz.raw['fields']['topicReference']['sys']['id']))
-            if 'subtopicReference' in quiz.raw['fields']:
-                subtopic_id = get_uuid_by_id(cursor, "subtopics", convert_to_uuid(quiz.raw['fields']['subtopicReference']['sys']['id']))
-
-            # Insert the quiz record
-            insert_data(cursor, 'quiz', {
-                'quiz_id': quiz_id,
-                'quiz_name': quiz_name,
-                'subject_id': subject_id,
-                'topic_id': topic_id,
-                'subtopic_id': subtopic_id,
-                'distinction': quiz.raw['fields'].get('distinction', None)  # Optional distinction field
-            })
+    def report(self):
+        self.writer.report()
+        print("\nEntries by table:")
+        for name in TABLE_LOAD_ORDER:
+            if name in self.counts:
+                counts = self.counts[name]
+                print(f"- {name}: {counts['skipped']} skipped, {counts['inserted']} inserted, {counts['updated']} updated")
 
-            # Step 7: Insert Quiz Questions (with validation)
-            if 'questions' in quiz.raw['fields']:
-                questions = quiz.raw['fields']['questions']
-                for order, question_ref in enumerate(questions):
-                    question_id = convert_to_uuid(question_ref['sys']['id'])
-                    if question_id in active_question_ids:
-                        active_quiz_question_pairs.add((quiz_id, question_id))
-                        insert_data(cursor, 'quiz_questions', {
-                            'quiz_id': quiz_id,
-                            'question_id': question_id,
-                            'question_order': order + 1
-                        })
-                    else:
-                        print(f"Warning: Question {question_id} not found in questions table. Skipping.")
-
-        print("Contentful data successfully synchronized with the database!")
-        print(count)
-
-        # Clean up stale data in the correct order to respect foreign key constraints
-        print("\nCleaning up stale data...")
-        # First delete quiz_questions (no dependencies)
-        delete_stale_data(cursor, 'quiz_questions', active_quiz_question_pairs)
-        
-        # Delete quiz entries (no dependencies)
-        delete_stale_data(cursor, 'quiz', active_quiz_ids)
-        
-        # Delete user_answers that reference stale options
-        cursor.execute("""
-            DELETE FROM v2.user_answers
-            WHERE chosen_answer_id NOT IN (
-                SELECT unnest(%s::uuid[])
-            )
-        """, (list(active_option_ids),))
-        print(f"Deleted {cursor.rowcount} stale user answers")
-        
-        # Now we can safely delete options
-        delete_stale_data(cursor, 'options', active_option_ids)
-        
-        # Delete questions (will cascade to user_answers)
-        delete_stale_data(cursor, 'questions', active_question_ids)
-        
-        # Delete subtopics (will cascade to questions)
-        delete_stale_data(cursor, 'subtopics', active_subtopic_ids)
-        
-        # Delete topics (will cascade to subtopics)
-        delete_stale_data(cursor, 'topics', active_topic_ids)
-        
-        # Delete subscriptions that reference stale subjects
-        cursor.execute("""
-            DELETE FROM v2.subscriptions
-            WHERE subject_id NOT IN (
-                SELECT unnest(%s::uuid[])
-            )
-        """, (list(active_subject_ids),))
-        print(f"Deleted {cursor.rowcount} stale subscriptions")
-        
-        # Finally delete subjects
-        delete_stale_data(cursor, 'subjects', active_subject_ids)
 
-        # Close the cursor and connection after data insertion
-        cursor.close()
-        conn.close()
 
-        print("\n=== Data Migration Analytics ===\n")
-        
-        # Reopen connection for analytics
-        conn = pg8000.connect(
-            host=DB_HOST, database=DB_NAME, user=DB_USER, password=DB_PASSWORD
-        )
-        conn.autocommit = True
-        cursor = conn.cursor()
-
-        # Analytics checks continue here...
-        # Check subjects
-        cursor.execute("""
-            SELECT subject_name, subject_jurisdiction 
-            FROM v2.subjects 
-            ORDER BY subject_name
-        """)
-        subjects = cursor.fetchall()
-        print(f"Total Subjects: {len(subjects)}")
-        print("Subjects List:")
-        for subject in subjects:
-            print(f"- {subject[0]} ({subject[1]})")
-
-        # Check questions and their answer choices
-        cursor.execute("""
-            SELECT 
-                q.question_type,
-                COUNT(*) as total_questions,
-                COUNT(CASE WHEN q.correct_answer_id IS NULL THEN 1 END) as missing_correct_answer
-            FROM v2.questions q
-            GROUP BY q.question_type
-        """)
-        question_stats = cursor.fetchall()
-        print("\nQuestion Statistics:")
-        for stat in question_stats:
-            print(f"- {stat[0]}: {stat[1]} questions (Missing correct answer: {stat[2]})")
-
-        # Check questions without any options
-        cursor.execute("""
-            SELECT COUNT(*) 
-            FROM v2.questions q
-            LEFT JOIN v2.options o ON q.question_id = o.question_id
-            WHERE o.option_id IS NULL
-        """)
-        questions_without_options = cursor.fetchone()[0]
-        print(f"Questions without any options: {questions_without_options}")
-
-        # Check quizzes and their questions
-        cursor.execute("""
-            SELECT 
-                q.quiz_name,
-                q.distinction,
-                COUNT(qq.question_id) as question_count
-            FROM v2.quiz q
-            LEFT JOIN v2.quiz_questions qq ON q.quiz_id = qq.quiz_id
-            GROUP BY q.quiz_id, q.quiz_name, q.distinction
-            ORDER BY q.quiz_name
-        """)
-        quiz_stats = cursor.fetchall()
-        print("\nQuiz Statistics:")
-        print(f"Total Quizzes: {len(quiz_stats)}")
-        print("Quiz Details:")
-        for quiz in quiz_stats:
-            print(f"- {quiz[0]} ({quiz[1] or 'No distinction'}): {quiz[2]} questions")
-
-        # Add to analytics section
-        cursor.execute("""
-            SELECT 
-                COUNT(*) as total_answers,
-                COUNT(CASE WHEN ua.is_correct != (ua.chosen_answer_id = q.correct_answer_id) THEN 1 END) as mismatched_correctness
-            FROM v2.user_answers ua
-            JOIN v2.questions q ON ua.question_id = q.question_id
-        """)
-        integrity_check = cursor.fetchone()
-        print(f"\nUser Answer Integrity Check:")
-        print(f"Total answers: {integrity_check[0]}")
-        print(f"Answers with mismatched correctness: {integrity_check[1]}")
+CONTENTFUL_RATE_LIMIT = 55  # Content Delivery API requests per second
 
-        print("\n=== End of Analytics ===\n")
 
-    except Exception as e:
-        print(f"Error inserting data: {e}")
-    finally:
-        cursor.close()
-        conn.close()
+class RequestScheduler:
+    """
+    Token bucket that every Contentful request goes through. Requests are
+    spaced to stay under the CDA rate limit; a 429 pauses all threads for
+    exactly the X-Contentful-RateLimit-Reset the server sent. Only transient
+    failures (429, 5xx, connection errors) are retried. max_concurrency caps the
+    requests in flight in this process, whichever thread sends them: worker
+    pools and the page streams' fetch threads alike. slots, if given, is a
+    semaphore held for the duration of each request, capping the requests in
+    flight across every process that shares it (see run_sync_jobs).
+    """
 
+    def __init__(self, rate=CONTENTFUL_RATE_LIMIT, max_retries=5, max_delay=30, slots=None, max_concurrency=None):
+        self.rate = rate
+        self.slots = slots
+        self.in_flight = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self.capacity = max(1.0, rate / 10)  # small burst so a second never exceeds the limit
+        self.tokens = self.capacity
+        self.updated = monotonic()
+        self.paused_until = 0.0
+        self.max_retries = max_retries
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.counters = {'requests': 0, 'throttled': 0, 'retried': 0, 'failed': 0}
 
-# Run the function to insert data
-if __name__ == "__main__":
-    insert_contentful_data()
\ No newline at end of file
+    def acquire(self):
+        """
+        Block until a request may be sent
+        """
+        while True:
+            with self.lock:
+                now = monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        self.counters['requests'] += 1
+                        run_metrics.count('contentful_requests_total')
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, monotonic() + seconds)
+            self.tokens = 0
+
+    def count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+        run_metrics.count(f"contentful_{counter}_total")
+
+    def call(self, fetch, query):
+        """
+        Run fetch(query), waiting for the rate limit and retrying transient errors
+        """
+        delay = 1
+        for attempt in range(self.max_retries + 1):
+            self.acquire()
+            backoff = min(delay, self.max_delay) * uniform(1.0, 1.2)
+            delay *= 2  # Exponential backoff
+            try:
+                with self.in_flight or nullcontext(), self.slots or nullcontext(), \
+                        run_metrics.timed('contentful_request_seconds', endpoint=getattr(fetch, '__name__', 'request')):
+                    return fetch(query)
+            except RateLimitExceededError as e:
+                self.count('throttled')
+                # Every thread waits out the reset in acquire(), so no backoff of our own
+                wait = e.reset_time() if e._has_reset_time() else backoff
+                self.pause(wait)
+                backoff = 0
+                reason = "rate limited"
+                retry_in = wait
+                error = e
+            except HTTPError as e:
+                if e.status_code < 500:
+                    self.count('failed')
+                    raise
+                reason = f"HTTP {e.status_code}"
+                retry_in = backoff
+                error = e
+            except RequestException as e:
+                reason = type(e).__name__
+                retry_in = backoff
+                error = e
+
+            if attempt == self.max_retries:
+                self.count('failed')
+                raise error
+            self.count('retried')
+            print(f"Attempt {attempt + 1} failed ({reason}). Retrying in {retry_in:.1f} seconds...")
+            sleep(backoff)
+
+    def report(self):
+        counters = self.counters
+        print(f"Contentful requests: {counters['requests']} "
+              f"(throttled: {counters['throttled']}, retried: {counters['retried']}, failed: {counters['failed']})")
+
+
+request_scheduler = RequestScheduler()
+
+
+def get_contentful_entries_with_retry(client, query, fetch=None):
+    """
+    Fetch entries from Contentful through the shared request scheduler.
+    fetch defaults to client.entries; pass client.sync for Sync API pages.
+    """
+    return request_scheduler.call(fetch or client.entries, query)
+
+DEFAULT_MAX_CONCURRENCY = 8
+
+
+MAX_PAGE_SIZE = 1000  # the most entries the CDA returns per request
+MIN_PAGE_SIZE = 25
+MAX_RESPONSE_BYTES = 7 * 1024 * 1024  # the CDA refuses to build larger responses
+TARGET_RESPONSE_BYTES = MAX_RESPONSE_BYTES // 2
+
+
+def is_response_too_big(error):
+    return isinstance(error, HTTPError) and error.status_code == 400 and 'Response size too big' in str(error)
+
+
+class PageSizer:
+    """
+    Page size of one listing. Starts at max_size and shrinks by half when a page
+    fails (and never grows past a size that failed). When the client reports how
+    big responses are (RawContentfulClient does), pages are sized to stay around
+    half the CDA's response size limit.
+    """
+
+    def __init__(self, max_size=MAX_PAGE_SIZE, min_size=MIN_PAGE_SIZE):
+        self.max_size = max_size
+        self.min_size = min(min_size, max_size)
+        self.size = max_size
+
+    def shrink(self):
+        """
+        Halve the page size; returns False if it is already as small as it gets
+        """
+        if self.size <= self.min_size:
+            return False
+        self.size = self.max_size = max(self.min_size, self.size // 2)
+        return True
+
+    def record(self, page):
+        size_bytes = getattr(page, 'size_bytes', None)
+        if size_bytes and len(page):
+            fitting = int(TARGET_RESPONSE_BYTES / (size_bytes / len(page)))
+            self.size = max(self.min_size, min(self.max_size, fitting))
+
+
+def next_page_cursor(cursor, entries):
+    """
+    The keyset cursor (createdAt of the last entry seen, entries seen with exactly
+    that createdAt) after a page of a listing ordered by sys.createdAt. The order
+    of the entries within the page does not matter.
+    """
+    created_from, seen_at_cursor = cursor or (None, 0)
+    last_created = max(entry.raw['sys']['createdAt'] for entry in entries)
+    trailing = sum(1 for entry in entries if entry.raw['sys']['createdAt'] == last_created)
+    # A page that did not get past the cursor's timestamp only moves the skip on
+    return last_created, seen_at_cursor + trailing if last_created == created_from else trailing
+
+
+def iter_entry_pages(client, content_type, page_size=MAX_PAGE_SIZE, select=None, start=None):
+    """
+    Yield every entry of a content type one page at a time. Pages are walked by
+    keyset rather than skip offsets: the listing is ordered by (sys.createdAt, sys.id)
+    and each request starts at the createdAt of the last entry seen, skipping only
+    the entries already seen with that same timestamp. Offsets therefore stay
+    small however large the content type grows, and entries created during the
+    walk are picked up at the end.
+    The page size starts at page_size and adapts as it goes (see PageSizer).
+    select limits the fields returned (e.g. 'sys' for a version-only listing).
+    start is a cursor from next_page_cursor to continue an earlier walk from.
+    """
+    sizer = PageSizer(page_size)
+    # createdAt of the last entry seen, and entries already yielded with exactly that createdAt
+    created_from, seen_at_cursor = start or (None, 0)
+    retrieved = 0
+
+    while True:
+        query = {
+            'content_type': content_type,
+            'order': 'sys.createdAt,sys.id',
+            'locale': LOCALE,
+            'limit': sizer.size
+        }
+        if created_from:
+            query['sys.createdAt[gte]'] = created_from
+        if seen_at_cursor:
+            query['skip'] = seen_at_cursor
+        if select:
+            query['select'] = select
+        try:
+            entries = get_contentful_entries_with_retry(client, query)
+        except (HTTPError, RequestException) as e:
+            # Oversized responses and failures that outlasted the scheduler's retries
+            # may go through as smaller pages; other client errors will not
+            transient = is_response_too_big(e) or not isinstance(e, HTTPError) or e.status_code >= 500
+            if transient and sizer.shrink():
+                print(f"Retrying {content_type} entries in pages of {sizer.size}: {e}")
+                continue
+            print(f"Error retrieving {content_type} entries ({retrieved} retrieved so far): {e}")
+            raise
+
+        if not entries:
+            return
+        sizer.record(entries)
+        retrieved += len(entries)
+        print(f"Retrieved {retrieved} {content_type} entries so far...")
+        yield entries
+
+        if len(entries) < query['limit']:
+            return
+        created_from, seen_at_cursor = next_page_cursor((created_from, seen_at_cursor), entries)
+
+
+def get_entries_by_id(client, entry_ids, batch_size=100, executor=None, select=None, cache=None):
+    """
+    Fetch entries by ID in batches of sys.id[in] queries, in parallel on executor if given,
+    and through the entry cache if one is given
+    Returns a dict of Contentful ID -> entry
+    """
+    entry_ids = sorted(set(entry_ids))
+    if cache is not None:
+        return get_cached_entries_by_id(client, cache, entry_ids, executor)
+    batches = [entry_ids[start:start + batch_size] for start in range(0, len(entry_ids), batch_size)]
+
+    def fetch_batch(batch):
+        query = {
+            'sys.id[in]': ','.join(batch),
+            'locale': LOCALE,
+            'limit': batch_size
+        }
+        if select:
+            query['select'] = select
+        return get_contentful_entries_with_retry(client, query)
+
+    entries_by_id = {}
+    for entries in (executor.map if executor else map)(fetch_batch, batches):
+        for entry in entries:
+            entries_by_id[entry.sys['id']] = entry
+    return entries_by_id
+
+
+class RawEntry:
+    """
+    An entry kept as its parsed JSON, from the entry cache or RawContentfulClient;
+    exposes the same sys/raw the SDK Entry does
+    """
+    __slots__ = ('sys', 'raw')
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.sys = raw['sys']
+
+
+# The only sys keys the sync reads; the rest (space, environment, updatedAt, locale) are dropped
+RAW_SYS_KEYS = ('id', 'type', 'revision', 'version', 'contentType', 'createdAt')
+
+
+class EntryPage(list):
+    """
+    A page of RawEntry objects with the CDA's total, like the SDK's Array,
+    and the size of the response it came from (used by PageSizer)
+    """
+    total = 0
+    size_bytes = None
+
+
+class SyncPage:
+    """
+    A Sync API page, with the same attributes get_sync_pages reads from the SDK's SyncPage
+    """
+    __slots__ = ('items', 'next_page_url', 'next_sync_token')
+
+    def __init__(self, items, next_page_url, next_sync_token):
+        self.items = items
+        self.next_page_url = next_page_url
+        self.next_sync_token = next_sync_token
+
+
+class RawContentfulClient:
+    """
+    Drop-in for the parts of contentful.Client the sync uses (entries and sync).
+    Responses are parsed as plain JSON into compact RawEntry objects instead of
+    hydrated Entry graphs, links are left unresolved, and all threads share one
+    keep-alive connection pool. Errors are raised as the SDK's own classes so the
+    request scheduler treats both clients the same.
+    """
+
+    def __init__(self, space_id, access_token, environment=ENVIRONMENT_ID, timeout_s=30,
+                 pool_size=DEFAULT_MAX_CONCURRENCY):
+        self.base_url = f"{CONTENTFUL_API_URL}/spaces/{space_id}/environments/{environment}"
+        self.timeout_s = timeout_s
+        self.session = Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Authorization': f"Bearer {access_token}",
+            'Accept-Encoding': 'gzip',
+        })
+
+    def get(self, path, query):
+        params = {key: str(value).lower() if isinstance(value, bool) else value for key, value in query.items()}
+        response = self.session.get(self.base_url + path, params=params, timeout=self.timeout_s)
+        if response.status_code != 200:
+            raise get_error(response)
+        return response
+
+    @staticmethod
+    def compact(item):
+        sys = item['sys']
+        raw = {'sys': {key: sys[key] for key in RAW_SYS_KEYS if key in sys}}
+        if 'fields' in item:
+            raw['fields'] = item['fields']
+        return RawEntry(raw)
+
+    def entries(self, query):
+        # Links are resolved by ID where needed, so included entries would only be parsed and dropped
+        response = self.get('/entries', dict(query, include=0))
+        body = response.json()
+        page = EntryPage(self.compact(item) for item in body['items'])
+        page.total = body['total']
+        page.size_bytes = len(response.content)
+        return page
+
+    def sync(self, query):
+        body = self.get('/sync', query).json()
+        next_url = body.get('nextPageUrl') or body.get('nextSyncUrl')
+        return SyncPage(
+            [self.compact(item) for item in body['items']],
+            body.get('nextPageUrl'),
+            parse_qs(urlparse(next_url).query)['sync_token'][0] if next_url else None
+        )
+
+
+DEFAULT_CACHE_PATH = '.contentful_cache.sqlite'
+DEFAULT_CACHE_MAX_MB = 512
+CACHE_MODES = ['off', 'write', 'revalidate', 'offline']
+
+
+def get_entry_version(entry):
+    # The CDA reports the published version as sys.revision
+    return entry.raw['sys'].get('revision', entry.raw['sys'].get('version'))
+
+
+class EntryCache:
+    """
+    SQLite cache of raw Contentful entries keyed by (space, environment, entry id,
+    version), with zlib-compressed bodies and least-recently-used eviction.
+    Modes:
+        write: fetch as usual and store everything fetched
+        revalidate: list versions with a sys-only query and download only changed entries
+        offline: replay the last fetched listing of every content type with no network calls
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, mode='write', max_mb=DEFAULT_CACHE_MAX_MB,
+                 space_id=SPACE_ID, environment_id=ENVIRONMENT_ID):
+        self.mode = mode
+        self.max_bytes = max_mb * 1024 * 1024
+        self.scope = (space_id, environment_id)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                space_id TEXT NOT NULL,
+                environment_id TEXT NOT NULL,
+                entry_id TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                body BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (space_id, environment_id, entry_id, version)
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS listings (
+                space_id TEXT NOT NULL,
+                environment_id TEXT NOT NULL,
+                content_type TEXT NOT NULL,
+                entry_ids TEXT NOT NULL,
+                PRIMARY KEY (space_id, environment_id, content_type)
+            )
+        """)
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, entry_versions):
+        """
+        Look up (entry_id, version) pairs; a version of None means the latest cached one.
+        Returns a dict of Contentful ID -> RawEntry for the pairs found.
+        """
+        found = {}
+        with self.lock:
+            for start in range(0, len(entry_versions), 500):
+                chunk = dict(entry_versions[start:start + 500])
+                rows = self.db.execute(f"""
+                    SELECT entry_id, version, body FROM entries
+                    WHERE space_id = ? AND environment_id = ?
+                    AND entry_id IN ({', '.join(['?'] * len(chunk))})
+                    ORDER BY version
+                """, (*self.scope, *chunk)).fetchall()
+                for entry_id, version, body in rows:
+                    if chunk[entry_id] in (None, version):
+                        found[entry_id] = (version, body)
+                self.db.executemany(
+                    "UPDATE entries SET last_used = ? WHERE space_id = ? AND environment_id = ? AND entry_id = ? AND version = ?",
+                    [(time(), *self.scope, entry_id, version) for entry_id, (version, _) in found.items()]
+                )
+            self.hits += len(found)
+            self.misses += len(entry_versions) - len(found)
+        return {
+            entry_id: RawEntry(json.loads(zlib.decompress(body)))
+            for entry_id, (_, body) in found.items()
+        }
+
+    def put_many(self, entries):
+        with self.lock:
+            for entry in entries:
+                entry_id = entry.sys['id']
+                # Older versions are never read again
+                self.db.execute(
+                    "DELETE FROM entries WHERE space_id = ? AND environment_id = ? AND entry_id = ?",
+                    (*self.scope, entry_id)
+                )
+                self.db.execute(
+                    "INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                    (*self.scope, entry_id, get_entry_version(entry) or 0,
+                     zlib.compress(json.dumps(entry.raw).encode()), time())
+                )
+
+    def save_listing(self, content_type, entry_ids):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?)",
+                (*self.scope, content_type, json.dumps(entry_ids))
+            )
+
+    def get_listing(self, content_type):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT entry_ids FROM listings WHERE space_id = ? AND environment_id = ? AND content_type = ?",
+                (*self.scope, content_type)
+            ).fetchone()
+        if row is None:
+            raise LookupError(f"No cached listing for {content_type}; run once with the cache in write mode first")
+        return json.loads(row[0])
+
+    def close(self):
+        """
+        Evict least recently used entries down to the size cap and save
+        """
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT rowid, length(body) FROM entries ORDER BY last_used DESC"
+            ).fetchall()
+            total = 0
+            evict = []
+            for rowid, size in rows:
+                total += size
+                if total > self.max_bytes:
+                    evict.append((rowid,))
+            self.db.executemany("DELETE FROM entries WHERE rowid = ?", evict)
+            self.db.commit()
+            self.db.close()
+        print(f"Entry cache: {self.hits} hits, {self.misses} misses, {len(evict)} evicted")
+
+
+def get_fresh_entries(client, cache, entry_versions, executor=None):
+    """
+    Return entries for (entry_id, version) pairs from the cache, downloading only
+    the ones whose version is not cached. Keeps the order of entry_versions.
+    """
+    cached = cache.get_many(entry_versions)
+    missing = [entry_id for entry_id, _ in entry_versions if entry_id not in cached]
+    if missing:
+        downloaded = get_entries_by_id(client, missing, executor=executor)
+        cache.put_many(downloaded.values())
+        cached.update(downloaded)
+    return [cached[entry_id] for entry_id, _ in entry_versions if entry_id in cached]
+
+
+def get_cached_entries_by_id(client, cache, entry_ids, executor=None):
+    if cache.mode == 'offline':
+        return cache.get_many([(entry_id, None) for entry_id in entry_ids])
+    if cache.mode == 'revalidate':
+        versions = get_entries_by_id(client, entry_ids, executor=executor, select='sys')
+        entries = get_fresh_entries(
+            client, cache, [(entry_id, get_entry_version(entry)) for entry_id, entry in versions.items()], executor
+        )
+    else:
+        entries = get_entries_by_id(client, entry_ids, executor=executor).values()
+        cache.put_many(entries)
+    return {entry.sys['id']: entry for entry in entries}
+
+
+def iter_content_type_pages(client, content_type, executor=None, cache=None, start=None):
+    """
+    Yield every entry of a content type one page at a time, through the entry cache
+    if one is given. start continues from a keyset cursor (see iter_entry_pages);
+    an offline replay always starts from the beginning of the cached listing.
+    """
+    if cache is None:
+        yield from iter_entry_pages(client, content_type, start=start)
+        return
+    if cache.mode == 'offline':
+        entry_ids = cache.get_listing(content_type)
+        for start in range(0, len(entry_ids), 100):
+            page_ids = entry_ids[start:start + 100]
+            cached = cache.get_many([(entry_id, None) for entry_id in page_ids])
+            yield [cached[entry_id] for entry_id in page_ids if entry_id in cached]
+        return
+
+    entry_ids = []
+    if cache.mode == 'revalidate':
+        # A sys-only listing is cheap: no fields, so pages stay small at any size
+        for listing in iter_entry_pages(client, content_type, select='sys', start=start):
+            entries = get_fresh_entries(
+                client, cache, [(entry.sys['id'], get_entry_version(entry)) for entry in listing], executor
+            )
+            entry_ids.extend(entry.sys['id'] for entry in entries)
+            yield entries
+    else:
+        for entries in iter_entry_pages(client, content_type, start=start):
+            cache.put_many(entries)
+            entry_ids.extend(entry.sys['id'] for entry in entries)
+            yield entries
+    # A listing continued from a cursor is incomplete; keep the last complete one for offline replays
+    if start is None:
+        cache.save_listing(content_type, entry_ids)
+
+
+def iter_question_pages(client, content_type, executor=None, cache=None, start=None):
+    """
+    Yield (questions, answer_entries) per page of a question content type, where
+    answer_entries maps the page's linked answer option IDs to their entries
+    """
+    for entries in iter_content_type_pages(client, content_type, executor=executor, cache=cache, start=start):
+        # Resolve the page's linked answer options together instead of one request per option
+        answer_entries = get_entries_by_id(
+            client, get_answer_option_ids(question.raw['fields'] for question in entries), executor=executor, cache=cache
+        )
+        yield entries, answer_entries
+
+
+DEFAULT_PIPELINE_DEPTH = 4
+
+
+class PageStream:
+    """
+    Runs a page generator on its own thread and hands the pages over through a
+    bounded queue, so fetching never runs more than max_pages ahead of loading.
+    Errors raised while fetching are re-raised in the consumer. Time spent
+    waiting for each page and processing it is recorded under name.
+    """
+    _done = object()
+
+    def __init__(self, pages, max_pages=DEFAULT_PIPELINE_DEPTH, name=None):
+        self.name = name
+        self.queue = Queue(maxsize=max_pages)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.produce, args=(pages,), daemon=True)
+        self.thread.start()
+
+    def produce(self, pages):
+        try:
+            for page in pages:
+                if not self.put(page):
+                    return
+        except Exception as e:
+            self.put(e)
+        else:
+            self.put(self._done)
+
+    def put(self, item):
+        # Give up once the consumer has stopped reading instead of blocking forever
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def __iter__(self):
+        while True:
+            start = time()
+            item = self.queue.get()
+            run_metrics.observe('page_wait_seconds', time() - start, content_type=self.name)
+            if item is self._done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            start = time()
+            yield item
+            run_metrics.observe('page_process_seconds', time() - start, content_type=self.name)
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+# Content types in the order a full sync loads them, parents first
+FULL_SYNC_CONTENT_TYPES = [SUBJECT_CONTENT_TYPE, TOPIC_CONTENT_TYPE, SUBTOPIC_CONTENT_TYPE, ISSUE_CONTENT_TYPE,
+                           *QUESTION_CONTENT_TYPES, QUIZ_CONTENT_TYPE]
+
+
+@contextmanager
+def stream_content_types(client, max_concurrency=DEFAULT_MAX_CONCURRENCY, cache=None,
+                         max_pages=DEFAULT_PIPELINE_DEPTH, start=None):
+    """
+    Start fetching every content type of a full sync at the same time and yield a
+    dict of content type -> PageStream of entry pages, or of (entries, answer_entries)
+    pages for question types. Each content type's listing is paged on a thread of
+    its own and the answer option requests share one pool of max_concurrency
+    threads; the request scheduler keeps the requests in flight across all of them
+    within --max-concurrency (see RequestScheduler). Each content type buffers at
+    most max_pages pages until it is consumed.
+    start, when resuming, maps each content type still to fetch to the keyset
+    cursor to continue from (None for the beginning); the others stream nothing.
+    """
+    if start is None:
+        start = dict.fromkeys(FULL_SYNC_CONTENT_TYPES)
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        streams = {}
+        for content_type in FULL_SYNC_CONTENT_TYPES:
+            if content_type not in start:
+                pages = iter(())
+            elif content_type in QUESTION_CONTENT_TYPES:
+                pages = iter_question_pages(client, content_type, executor=pool, cache=cache, start=start[content_type])
+            else:
+                pages = iter_content_type_pages(client, content_type, executor=pool, cache=cache, start=start[content_type])
+            streams[content_type] = PageStream(pages, max_pages, content_type)
+        try:
+            yield streams
+        finally:
+            for stream in streams.values():
+                stream.close()
+
+
+def get_answer_option_ids(question_fields):
+    """
+    Collect the answer option IDs linked from a list of question field dicts
+    """
+    return {
+        answer['sys']['id']
+        for fields in question_fields
+        for answer in fields.get('answerOptions', [])
+    }
+
+
+# Key columns of the active ID sets collected during a full run
+ACTIVE_KEY_COLUMNS = {
+    'quiz_questions': ('quiz_id', 'question_id'),
+    'quiz': ('quiz_id',),
+    'options': ('option_id',),
+    'questions': ('question_id',),
+    'subtopics': ('subtopic_id',),
+    'topics': ('topic_id',),
+    'subjects': ('subject_id',),
+    'entries': ('entry_uuid',),
+}
+# The active ID sets a full run collects; entries is derived from the others
+CHECKPOINT_KEY_TABLES = [key_table for key_table in ACTIVE_KEY_COLUMNS if key_table != 'entries']
+# Stale-row deletes in foreign key order: (table, its referencing columns, active ID set they must match)
+STALE_DELETE_ORDER = [
+    ('entry_state', ('entry_uuid',), 'entries'),
+    ('quiz_questions', ('quiz_id', 'question_id'), 'quiz_questions'),
+    ('quiz', ('quiz_id',), 'quiz'),
+    ('user_answers', ('chosen_answer_id',), 'options'),
+    ('options', ('option_id',), 'options'),
+    ('questions', ('question_id',), 'questions'),
+    ('subtopics', ('subtopic_id',), 'subtopics'),
+    ('topics', ('topic_id',), 'topics'),
+    ('subscriptions', ('subject_id',), 'subjects'),
+    ('subjects', ('subject_id',), 'subjects'),
+]
+# The same deletes grouped so that a table is cleaned up only after every table referencing it
+STALE_DELETE_LEVELS = dependency_levels(
+    [table_name for table_name, _, _ in STALE_DELETE_ORDER],
+    {
+        table_name: [other for other, references in TABLE_DEPENDENCIES.items() if table_name in references]
+        for table_name, _, _ in STALE_DELETE_ORDER
+    }
+)
+DEFAULT_MAX_DELETE_FRACTION = 0.5
+
+
+class StaleDeleteGuardError(Exception):
+    """
+    Raised when a cleanup would delete more of a table than allowed, which
+    usually means the fetch from Contentful was incomplete
+    """
+
+
+def load_active_ids(cursor, key_table, active_ids):
+    """
+    COPY a set of active keys into an indexed temp table named active_<key_table>
+    """
+    columns = ACTIVE_KEY_COLUMNS[key_table]
+    temp_table = f"active_{key_table}"
+    cursor.execute(f"DROP TABLE IF EXISTS {temp_table}")
+    cursor.execute(f"""
+        CREATE TEMP TABLE {temp_table} (
+            {', '.join(f'{column} uuid NOT NULL' for column in columns)},
+            PRIMARY KEY ({', '.join(columns)})
+        )
+    """)
+    lines = (
+        '\t'.join(key) if isinstance(key, tuple) else key
+        for key in active_ids
+    )
+    cursor.execute(
+        f"COPY {temp_table} ({', '.join(columns)}) FROM STDIN",
+        stream=io.StringIO(''.join(f"{line}\n" for line in lines))
+    )
+    cursor.execute(f"ANALYZE {temp_table}")
+    return temp_table
+
+
+def stale_rows_condition(columns, key_table):
+    """
+    WHERE clause matching rows (aliased t) whose columns are not in the active key set
+    """
+    key_columns = ACTIVE_KEY_COLUMNS[key_table]
+    join = ' AND '.join(f"a.{key} = t.{column}" for key, column in zip(key_columns, columns))
+    not_null = ''.join(f"t.{column} IS NOT NULL AND " for column in columns)
+    return f"{not_null}NOT EXISTS (SELECT 1 FROM active_{key_table} a WHERE {join})"
+
+
+def delete_stale_data(cursor, table_name, columns, key_table):
+    """
+    Delete records that exist in the database but not in Contentful
+    Args:
+        cursor: Database cursor
+        table_name: Name of the table to clean up
+        columns: Columns of table_name holding the keys to check
+        key_table: Active ID set (loaded by load_active_ids) the keys must be in
+    Returns the questions and quizzes the deleted rows counted towards (see SUMMARY_KEY_COLUMNS
+    and SUMMARY_CASCADE_TABLES)
+    """
+    summary_column = SUMMARY_KEY_COLUMNS.get(table_name)
+    with run_metrics.timed('stale_delete_seconds', table=table_name):
+        cursor.execute(f"""
+            DELETE FROM {DB_SCHEMA}.{table_name} t
+            WHERE {stale_rows_condition(columns, key_table)}
+            {f'RETURNING t.{summary_column}' if summary_column else ''}
+        """)
+    deleted_count = cursor.rowcount
+    run_metrics.count('rows_deleted_total', deleted_count, table=table_name)
+    print(f"Deleted {deleted_count} stale records from {table_name}")
+    if table_name in SUMMARY_CASCADE_TABLES and deleted_count:
+        return [None]
+    return [str(row[0]) for row in cursor.fetchall()] if summary_column else []
+
+
+def delete_all_stale_data(cursor, active_ids, max_delete_fraction=DEFAULT_MAX_DELETE_FRACTION, pool=None):
+    """
+    Delete every row whose Contentful entry is no longer active, in foreign key order.
+    Nothing is deleted if any table would lose more than max_delete_fraction of its rows.
+    Args:
+        cursor: Database cursor
+        active_ids: Dict of table name -> set of active keys (see ACTIVE_KEY_COLUMNS)
+        max_delete_fraction: Largest share of a table a single run may delete
+        pool: Optional ConnectionPool to clean up independent tables on at once
+    Returns the questions and quizzes that lost rows, for AnalyticsSummary
+    """
+    if pool is not None:
+        return delete_all_stale_data_in_parallel(pool, active_ids, max_delete_fraction)
+    for key_table, ids in active_ids.items():
+        load_active_ids(cursor, key_table, ids)
+
+    # Check every table before deleting anything, so a partial fetch leaves the database untouched
+    for table_name, columns, key_table in STALE_DELETE_ORDER:
+        check_stale_fraction(table_name, *count_stale_rows(cursor, table_name, columns, key_table), max_delete_fraction)
+
+    summary_ids = set()
+    for table_name, columns, key_table in STALE_DELETE_ORDER:
+        summary_ids.update(delete_stale_data(cursor, table_name, columns, key_table))
+    return summary_ids
+
+
+def count_stale_rows(cursor, table_name, columns, key_table):
+    """
+    Returns (rows in table_name, rows delete_stale_data would delete)
+    """
+    cursor.execute(f"""
+        SELECT count(*), count(*) FILTER (WHERE {stale_rows_condition(columns, key_table)})
+        FROM {DB_SCHEMA}.{table_name} t
+    """)
+    return cursor.fetchone()
+
+
+def check_stale_fraction(table_name, total, stale, max_delete_fraction):
+    if total and stale / total > max_delete_fraction:
+        raise StaleDeleteGuardError(
+            f"Refusing to delete {stale} of {total} rows from {table_name} "
+            f"(limit is {max_delete_fraction:.0%}); was the Contentful fetch complete?"
+        )
+
+
+def delete_all_stale_data_in_parallel(pool, active_ids, max_delete_fraction=DEFAULT_MAX_DELETE_FRACTION):
+    """
+    delete_all_stale_data over a ConnectionPool. Each active ID set is loaded on
+    one connection, which then checks and cleans up every table matched against
+    that set. Tables are deleted one dependency level (see STALE_DELETE_LEVELS)
+    at a time, with the tables of a level deleted at once.
+    """
+    key_workers = {key_table: worker for worker, key_table in enumerate(active_ids)}
+    pool.run([
+        (key_workers[key_table], lambda cursor, commits, key_table=key_table, ids=ids: load_active_ids(cursor, key_table, ids))
+        for key_table, ids in active_ids.items()
+    ])
+
+    counts = pool.run([
+        (key_workers[key_table], lambda cursor, commits, table_name=table_name, columns=columns, key_table=key_table:
+            count_stale_rows(cursor, table_name, columns, key_table))
+        for table_name, columns, key_table in STALE_DELETE_ORDER
+    ])
+    for (table_name, _, _), (total, stale) in zip(STALE_DELETE_ORDER, counts):
+        check_stale_fraction(table_name, total, stale, max_delete_fraction)
+
+    deletes = {table_name: (columns, key_table) for table_name, columns, key_table in STALE_DELETE_ORDER}
+    summary_ids = set()
+    for level in STALE_DELETE_LEVELS:
+        for deleted_ids in pool.run([
+            (key_workers[deletes[table_name][1]], lambda cursor, commits, table_name=table_name:
+                delete_stale_data(cursor, table_name, *deletes[table_name]))
+            for table_name in level
+        ]):
+            summary_ids.update(deleted_ids)
+    return summary_ids
+
+
+def get_sync_token(cursor):
+    """
+    Return the stored Sync API token for this space/environment, or None
+    """
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {DB_SCHEMA}.sync_state (
+            space_id TEXT NOT NULL,
+            environment_id TEXT NOT NULL,
+            sync_token TEXT NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (space_id, environment_id)
+        )
+    """)
+    cursor.execute(
+        f"SELECT sync_token FROM {DB_SCHEMA}.sync_state WHERE space_id = %s AND environment_id = %s",
+        (SPACE_ID, ENVIRONMENT_ID)
+    )
+    result = cursor.fetchone()
+    return result[0] if result else None
+
+
+def save_sync_token(cursor, sync_token):
+    cursor.execute(f"""
+        INSERT INTO {DB_SCHEMA}.sync_state (space_id, environment_id, sync_token, updated_at)
+        VALUES (%s, %s, %s, now())
+        ON CONFLICT (space_id, environment_id) DO UPDATE
+        SET sync_token = EXCLUDED.sync_token, updated_at = EXCLUDED.updated_at
+    """, (SPACE_ID, ENVIRONMENT_ID, sync_token))
+
+
+class SyncCheckpoint:
+    """
+    Durable progress of a full sync, so a run that fails partway (a network blip,
+    a database failover) can continue with --resume instead of starting again
+    from subjects. v2.sync_checkpoint holds the run's sync token and options, its
+    stage, and the content type and keyset cursor of the last page written;
+    v2.sync_checkpoint_ids holds the active IDs collected so far, which stale-row
+    cleanup needs in full. Both are written on the run's own connection after the
+    rows they cover have been flushed, so a checkpoint is never committed ahead
+    of its rows: a resumed run at worst rewrites a few pages, which the entry
+    watermarks then skip.
+    Stages:
+        load: content types are being loaded, in FULL_SYNC_CONTENT_TYPES order
+        stale_cleanup: everything is loaded; stale rows are next
+    """
+
+    def __init__(self, cursor, sync_token=None, rewrite_all=False, stage='load', content_type=None,
+                 page_cursor=None, resumed=False):
+        self.cursor = cursor
+        self.sync_token = sync_token
+        self.rewrite_all = rewrite_all
+        self.stage = stage
+        self.content_type = content_type
+        self.page_cursor = page_cursor
+        self.resumed = resumed
+
+    @staticmethod
+    def create_tables(cursor):
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {DB_SCHEMA}.sync_checkpoint (
+                space_id TEXT NOT NULL,
+                environment_id TEXT NOT NULL,
+                sync_token TEXT,
+                rewrite_all BOOLEAN NOT NULL,
+                stage TEXT NOT NULL,
+                content_type TEXT,
+                cursor_created_at TEXT,
+                cursor_skip INTEGER,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                PRIMARY KEY (space_id, environment_id)
+            )
+        """)
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {DB_SCHEMA}.sync_checkpoint_ids (
+                space_id TEXT NOT NULL,
+                environment_id TEXT NOT NULL,
+                key_table TEXT NOT NULL,
+                id UUID NOT NULL,
+                other_id UUID
+            )
+        """)
+
+    @classmethod
+    def start(cls, cursor, sync_token=None, rewrite_all=False):
+        """
+        Begin checkpointing a new full sync, discarding what an earlier unfinished one left
+        """
+        cls.create_tables(cursor)
+        checkpoint = cls(cursor, sync_token, rewrite_all)
+        checkpoint.clear()
+        cursor.execute(f"""
+            INSERT INTO {DB_SCHEMA}.sync_checkpoint (space_id, environment_id, sync_token, rewrite_all, stage)
+            VALUES (%s, %s, %s, %s, 'load')
+        """, (SPACE_ID, ENVIRONMENT_ID, sync_token, rewrite_all))
+        return checkpoint
+
+    @classmethod
+    def load(cls, cursor):
+        """
+        The checkpoint of this space/environment's unfinished full sync, or None
+        """
+        cls.create_tables(cursor)
+        cursor.execute(f"""
+            SELECT sync_token, rewrite_all, stage, content_type, cursor_created_at, cursor_skip
+            FROM {DB_SCHEMA}.sync_checkpoint WHERE space_id = %s AND environment_id = %s
+        """, (SPACE_ID, ENVIRONMENT_ID))
+        result = cursor.fetchone()
+        if result is None:
+            return None
+        sync_token, rewrite_all, stage, content_type, created_at, skip = result
+        page_cursor = (created_at, skip) if created_at else None
+        return cls(cursor, sync_token, rewrite_all, stage, content_type, page_cursor, resumed=True)
+
+    def describe(self):
+        if self.stage != 'load':
+            return f"stage {self.stage}"
+        if self.content_type is None:
+            return "the start of the load"
+        position = f"after {self.page_cursor[0]}" if self.page_cursor else "from its first page"
+        return f"content type {self.content_type} {position}"
+
+    def pending_content_types(self):
+        """
+        Content type -> keyset cursor to continue from, for every content type not yet fully loaded
+        (see stream_content_types)
+        """
+        if self.stage != 'load':
+            return {}
+        if self.content_type is None:
+            return dict.fromkeys(FULL_SYNC_CONTENT_TYPES)
+        remaining = FULL_SYNC_CONTENT_TYPES[FULL_SYNC_CONTENT_TYPES.index(self.content_type):]
+        return dict(dict.fromkeys(remaining), **{self.content_type: self.page_cursor})
+
+    def active_ids(self):
+        """
+        Table -> set of the active keys checkpointed so far (see ACTIVE_KEY_COLUMNS)
+        """
+        active_ids = {key_table: set() for key_table in CHECKPOINT_KEY_TABLES}
+        if not self.resumed:
+            return active_ids
+        self.cursor.execute(f"""
+            SELECT key_table, id::text, other_id::text FROM {DB_SCHEMA}.sync_checkpoint_ids
+            WHERE space_id = %s AND environment_id = %s
+        """, (SPACE_ID, ENVIRONMENT_ID))
+        for key_table, key, other_key in self.cursor.fetchall():
+            active_ids[key_table].add((key, other_key) if other_key else key)
+        return active_ids
+
+    def hierarchy(self, active_ids):
+        """
+        The HierarchyIndex to load with: empty for a new run, and for a resumed one the
+        subjects, topics and subtopics it had already loaded, read back from the database
+        """
+        if not self.resumed:
+            return HierarchyIndex()
+        return HierarchyIndex.from_database(self.cursor, active_ids)
+
+    def page_done(self, content_type, entries, page_ids):
+        """
+        Record a page whose rows have been flushed: its active keys and the cursor after it
+        """
+        with run_metrics.timed('checkpoint_seconds'):
+            page_cursor = self.page_cursor if content_type == self.content_type else None
+            try:
+                if entries:
+                    page_cursor = next_page_cursor(page_cursor, entries)
+            except KeyError:
+                # Entries cached before createdAt was kept; resume this content type from its start
+                page_cursor = None
+            self.content_type = content_type
+            self.page_cursor = page_cursor
+
+            lines = []
+            for key_table, keys in page_ids.items():
+                for key in keys:
+                    key, other_key = key if isinstance(key, tuple) else (key, '\\N')
+                    lines.append(f"{SPACE_ID}\t{ENVIRONMENT_ID}\t{key_table}\t{key}\t{other_key}\n")
+            if lines:
+                self.cursor.execute(
+                    f"COPY {DB_SCHEMA}.sync_checkpoint_ids (space_id, environment_id, key_table, id, other_id) FROM STDIN",
+                    stream=io.StringIO(''.join(lines))
+                )
+            self.cursor.execute(f"""
+                UPDATE {DB_SCHEMA}.sync_checkpoint
+                SET content_type = %s, cursor_created_at = %s, cursor_skip = %s, updated_at = now()
+                WHERE space_id = %s AND environment_id = %s
+            """, (content_type, page_cursor[0] if page_cursor else None, page_cursor[1] if page_cursor else None,
+                  SPACE_ID, ENVIRONMENT_ID))
+        run_metrics.count('checkpoints_total')
+
+    def loaded(self):
+        """
+        Record that every content type is loaded, so a resumed run goes straight to stale-row cleanup
+        """
+        self.stage = 'stale_cleanup'
+        self.cursor.execute(f"""
+            UPDATE {DB_SCHEMA}.sync_checkpoint SET stage = %s, content_type = NULL, updated_at = now()
+            WHERE space_id = %s AND environment_id = %s
+        """, (self.stage, SPACE_ID, ENVIRONMENT_ID))
+
+    def clear(self):
+        """
+        Remove the checkpoint; called in the transaction that saves the finished run's sync token
+        """
+        for table_name in ['sync_checkpoint', 'sync_checkpoint_ids']:
+            self.cursor.execute(
+                f"DELETE FROM {DB_SCHEMA}.{table_name} WHERE space_id = %s AND environment_id = %s",
+                (SPACE_ID, ENVIRONMENT_ID)
+            )
+
+
+NO_SUBJECT_ID = '00000000-0000-0000-0000-000000000000'  # summary rows of questions and quizzes without a subject
+ANOMALY_METRICS = {
+    'questions_missing_correct_answer': "questions missing a correct answer",
+    'questions_without_options': "questions without any options",
+    'quizzes_without_questions': "quizzes without questions",
+}
+TOP_OFFENDERS = 5
+
+
+class AnalyticsSummary:
+    """
+    The counts behind the post-sync analytics report, kept up to date so a run
+    only recomputes the questions and quizzes it touched instead of scanning
+    every question, option and quiz:
+        v2.analytics_entities: one row per question and quiz with its subject and
+            the metrics it counts towards (questions_<type>, quizzes and the
+            ANOMALY_METRICS that apply)
+        v2.analytics_counts: how many entities count towards each metric, per subject
+    Writers touch() the questions and quizzes whose rows they wrote or deleted;
+    refresh() then takes just those entities' old metrics out of the counts and
+    puts their current ones in. A touched None stands for entities removed by a
+    cascade (see SUMMARY_CASCADE_TABLES) and makes refresh() rebuild instead.
+    A run marks v2.analytics_state incomplete when it starts and complete once
+    refreshed, so after a run that failed partway the next one rebuilds the
+    summary from scratch.
+    """
+
+    def __init__(self, cursor, rebuild=False):
+        self.cursor = cursor
+        self.rebuild = rebuild
+        self.entity_ids = set()
+
+    @staticmethod
+    def create_tables(cursor):
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {DB_SCHEMA}.analytics_entities (
+                entity_id UUID PRIMARY KEY,
+                subject_id UUID NOT NULL,
+                metrics TEXT[] NOT NULL
+            )
+        """)
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {DB_SCHEMA}.analytics_counts (
+                subject_id UUID NOT NULL,
+                metric TEXT NOT NULL,
+                value BIGINT NOT NULL,
+                PRIMARY KEY (subject_id, metric)
+            )
+        """)
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {DB_SCHEMA}.analytics_state (
+                id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                complete BOOLEAN NOT NULL,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        """)
+
+    @classmethod
+    def open(cls, cursor):
+        """
+        A summary to refresh() for the entities touched by one batch of changes,
+        creating its tables if needed. Its state is left alone: while a run is
+        still writing, or after one failed, the summary stays incomplete until a
+        run finishes and rebuilds it.
+        """
+        cls.create_tables(cursor)
+        return cls(cursor)
+
+    @classmethod
+    def start(cls, cursor, rebuild=False):
+        """
+        Begin a run: the summary is rebuilt at the end if rebuild is set or the
+        last run did not finish, and is marked incomplete until then
+        """
+        summary = cls.open(cursor)
+        cursor.execute(f"SELECT complete FROM {DB_SCHEMA}.analytics_state")
+        result = cursor.fetchone()
+        summary.rebuild = rebuild or result is None or not result[0]
+        summary.mark_complete(False)
+        return summary
+
+    def mark_complete(self, complete):
+        self.cursor.execute(f"""
+            INSERT INTO {DB_SCHEMA}.analytics_state (id, complete) VALUES (TRUE, %s)
+            ON CONFLICT (id) DO UPDATE SET complete = EXCLUDED.complete, updated_at = now()
+        """, (complete,))
+
+    def touch(self, entity_ids):
+        self.entity_ids.update(entity_ids)
+
+    def refresh(self):
+        """
+        Bring the summary up to date for the touched entities, or rebuild all of it
+        """
+        cursor = self.cursor
+        if None in self.entity_ids:
+            self.rebuild = True
+        if self.rebuild:
+            cursor.execute(f"TRUNCATE {DB_SCHEMA}.analytics_entities, {DB_SCHEMA}.analytics_counts")
+            condition = "TRUE"
+            params = ()
+        elif self.entity_ids:
+            ids = list(self.entity_ids)
+            # Take the touched entities' old metrics out of the counts
+            cursor.execute(f"""
+                WITH old AS (
+                    DELETE FROM {DB_SCHEMA}.analytics_entities WHERE entity_id = ANY(%s::uuid[])
+                    RETURNING subject_id, metrics
+                ), delta AS (
+                    SELECT subject_id, metric, count(*) AS value
+                    FROM old, unnest(old.metrics) AS metric
+                    GROUP BY subject_id, metric
+                )
+                UPDATE {DB_SCHEMA}.analytics_counts c
+                SET value = c.value - delta.value
+                FROM delta
+                WHERE c.subject_id = delta.subject_id AND c.metric = delta.metric
+            """, (ids,))
+            condition = "{id_column} = ANY(%s::uuid[])"
+            params = (ids, ids)
+        else:
+            return
+
+        # Summarise the entities as they are now and add their metrics to the counts
+        cursor.execute(f"""
+            WITH new AS (
+                INSERT INTO {DB_SCHEMA}.analytics_entities (entity_id, subject_id, metrics)
+                SELECT q.question_id, COALESCE(q.subject_id, '{NO_SUBJECT_ID}'::uuid), array_remove(ARRAY[
+                    'questions_' || q.question_type,
+                    CASE WHEN q.correct_answer_id IS NULL THEN 'questions_missing_correct_answer' END,
+                    CASE WHEN NOT EXISTS (SELECT 1 FROM {DB_SCHEMA}.options o WHERE o.question_id = q.question_id)
+                         THEN 'questions_without_options' END
+                ], NULL)
+                FROM {DB_SCHEMA}.questions q
+                WHERE {condition.format(id_column='q.question_id')}
+                UNION ALL
+                SELECT z.quiz_id, COALESCE(z.subject_id, '{NO_SUBJECT_ID}'::uuid), array_remove(ARRAY[
+                    'quizzes',
+                    CASE WHEN NOT EXISTS (SELECT 1 FROM {DB_SCHEMA}.quiz_questions qq WHERE qq.quiz_id = z.quiz_id)
+                         THEN 'quizzes_without_questions' END
+                ], NULL)
+                FROM {DB_SCHEMA}.quiz z
+                WHERE {condition.format(id_column='z.quiz_id')}
+                ON CONFLICT (entity_id) DO NOTHING
+                RETURNING subject_id, metrics
+            )
+            INSERT INTO {DB_SCHEMA}.analytics_counts (subject_id, metric, value)
+            SELECT subject_id, metric, count(*)
+            FROM new, unnest(new.metrics) AS metric
+            GROUP BY subject_id, metric
+            ON CONFLICT (subject_id, metric) DO UPDATE SET value = {DB_SCHEMA}.analytics_counts.value + EXCLUDED.value
+        """, params)
+        cursor.execute(f"DELETE FROM {DB_SCHEMA}.analytics_counts WHERE value = 0")
+        run_metrics.count('analytics_entities_refreshed_total', len(self.entity_ids))
+
+    def finish(self):
+        """
+        Refresh the summary at the end of a run, in the run's transaction, and mark it complete
+        """
+        start = time()
+        self.refresh()
+        self.mark_complete(True)
+        if self.rebuild:
+            print(f"\nAnalytics summary rebuilt in {time() - start:.2f}s")
+        else:
+            print(f"\nAnalytics summary refreshed for {len(self.entity_ids)} questions and quizzes in {time() - start:.2f}s")
+
+    def report(self):
+        """
+        Print totals, anomalies and the subjects with the most of each anomaly, from the summary tables alone
+        """
+        cursor = self.cursor
+        cursor.execute(f"SELECT count(*) FROM {DB_SCHEMA}.subjects")
+        subject_count = cursor.fetchone()[0]
+        cursor.execute(f"SELECT metric, sum(value) FROM {DB_SCHEMA}.analytics_counts GROUP BY metric ORDER BY metric")
+        totals = {metric: int(value) for metric, value in cursor.fetchall()}
+        question_types = {
+            metric[len('questions_'):]: value for metric, value in totals.items()
+            if metric.startswith('questions_') and metric not in ANOMALY_METRICS
+        }
+        by_type = ', '.join(f"{question_type}: {count}" for question_type, count in question_types.items())
+        print(f"Subjects: {subject_count}")
+        print(f"Questions: {sum(question_types.values())}" + (f" ({by_type})" if by_type else ""))
+        print(f"Quizzes: {totals.get('quizzes', 0)}")
+
+        anomalies = [metric for metric in ANOMALY_METRICS if totals.get(metric)]
+        if not anomalies:
+            print("\nNo anomalies")
+            return
+        print("\nAnomalies:")
+        for metric in anomalies:
+            print(f"- {ANOMALY_METRICS[metric]}: {totals[metric]}")
+
+        print("\nTop offenders:")
+        cursor.execute(f"""
+            SELECT c.metric, s.subject_name, s.subject_jurisdiction, c.value
+            FROM (
+                SELECT subject_id, metric, value,
+                       row_number() OVER (PARTITION BY metric ORDER BY value DESC, subject_id) AS rank
+                FROM {DB_SCHEMA}.analytics_counts
+                WHERE metric = ANY(%s::text[])
+            ) c
+            LEFT JOIN {DB_SCHEMA}.subjects s ON s.subject_id = c.subject_id
+            WHERE c.rank <= %s
+            ORDER BY c.metric, c.rank
+        """, (anomalies, TOP_OFFENDERS))
+        for metric, subject_name, jurisdiction, value in cursor.fetchall():
+            subject = f"{subject_name} ({jurisdiction})" if subject_name else "No subject"
+            print(f"- {subject}: {value} {ANOMALY_METRICS[metric]}")
+
+
+def get_sync_pages(client, sync_token=None):
+    """
+    Yield every Sync API page, starting from sync_token or from an initial sync.
+    The last page yielded carries the token for the next run in next_sync_token.
+    """
+    if sync_token:
+        query = {'sync_token': sync_token}
+    else:
+        query = {'initial': True}
+
+    while True:
+        page = get_contentful_entries_with_retry(client, query, fetch=client.sync)
+        yield page
+        if not page.next_page_url:
+            break
+        query = {'sync_token': page.next_sync_token}
+
+
+def get_localized_fields(entry):
+    """
+    Flatten Sync API fields ({'name': {'en-US': ...}}) down to LOCALE,
+    dropping fields that have no value in that locale
+    """
+    return {
+        name: values[LOCALE]
+        for name, values in entry.raw.get('fields', {}).items()
+        if LOCALE in values
+    }
+
+
+def upsert_subject(writer, hierarchy, entry_id, fields):
+    subject_id = convert_to_uuid(entry_id)
+    is_free = False
+    if fields['name'] == 'Evidence':
+        is_free = True
+    writer.add('subjects', {'subject_id': subject_id, 'subject_name': fields['name'], 'subject_jurisdiction': fields.get('jurisdiction'), 'is_free': is_free})
+    hierarchy.subjects[subject_id] = fields.get('jurisdiction')
+    return subject_id
+
+
+def upsert_topic(writer, hierarchy, entry_id, fields):
+    topic_id = convert_to_uuid(entry_id)
+    # Get the subject UUID based on the Contentful ID reference
+    subject_id = hierarchy.lookup('topics', 'subjects', convert_to_uuid(fields['subjectReference']['sys']['id']))
+    if subject_id:
+        writer.add('topics', {
+            'topic_id': topic_id,
+            'topic_name': fields['name'],
+            'subject_id': subject_id
+        })
+        hierarchy.topics[topic_id] = subject_id
+    return topic_id
+
+
+def upsert_subtopic(writer, hierarchy, entry_id, fields):
+    subtopic_id = convert_to_uuid(entry_id)
+    # Get the topic UUID based on the Contentful ID reference
+    topic_id = hierarchy.lookup('subtopics', 'topics', convert_to_uuid(fields['topicReference']['sys']['id']))
+    if topic_id:
+        writer.add('subtopics', {
+            'subtopic_id': subtopic_id,
+            'subtopic_name': fields['name'],
+            'topic_id': topic_id,  # Assign the topic_id directly from the reference
+            'parent_subtopic_id': None  # Subtopics do not have parent subtopics
+        })
+        hierarchy.subtopics[subtopic_id] = (topic_id, None)
+    return subtopic_id
+
+
+def upsert_issue(writer, hierarchy, entry_id, fields):
+    issue_id = convert_to_uuid(entry_id)
+    # Get the parent subtopic UUID based on the Contentful ID reference
+    parent_subtopic_id = hierarchy.lookup('issues', 'subtopics', convert_to_uuid(fields['subtopicReference']['sys']['id']))
+    if parent_subtopic_id:
+        # Use the topic_id of the parent subtopic
+        topic_id = hierarchy.subtopics[parent_subtopic_id][0]
+
+        writer.add('subtopics', {
+            'subtopic_id': issue_id,  # Use subtopic_id since we're treating issues as subtopics
+            'subtopic_name': fields['name'],
+            'topic_id': topic_id,  # Assign the same topic_id as the parent subtopic
+            'parent_subtopic_id': parent_subtopic_id  # Issues are children of a subtopic
+        })
+        hierarchy.subtopics[issue_id] = (topic_id, parent_subtopic_id)
+    return issue_id
+
+
+def upsert_question(writer, hierarchy, answer_entries, entry_id, fields, questionType):
+    """
+    Upsert a question and its options.
+    answer_entries maps answer option Contentful IDs to prefetched entries.
+    Returns (question_id, set of option_ids written for it)
+    """
+    question_id = convert_to_uuid(entry_id)
+    option_ids = set()
+    correct_option_id = None
+
+    question_text = fields['questionText']
+    hierarchy_ref = convert_to_uuid(fields['hierarchyReference']['sys']['id'])
+    hierarchy_level = fields['contentHierarchyLevelText']
+
+    # Determine the parent entity type and get the appropriate IDs
+    subject_id, topic_id, subtopic_id = hierarchy.resolve('questions', hierarchy_level, hierarchy_ref)
+
+    # Insert the question with appropriate references
+    writer.add('questions', {
+        'question_id': question_id,
+        'question_text': question_text,
+        'subtopic_id': subtopic_id,
+        'subject_id': subject_id,
+        'topic_id': topic_id,
+        'question_type': questionType
+    })
+
+    # Step 5: Insert Options for each question
+    if questionType == 'multiple_choice':
+        answer_options = fields['answerOptions']
+        for answer in answer_options:
+            answer_id = answer['sys']['id']
+            entity = answer_entries.get(answer_id)
+            if entity is None:
+                print(f"Warning: Answer option {answer_id} of question {entry_id} is not published. Skipping.")
+                continue
+            option_id = convert_to_uuid(answer_id)
+            option_ids.add(option_id)
+            if entity.raw['fields']['isCorrectAnswer'] and correct_option_id is None:
+                correct_option_id = option_id
+            writer.add('options', {
+                'option_id': option_id,
+                'question_id': question_id,
+                'option_text': entity.raw['fields']['answerText'],
+                'is_correct': entity.raw['fields']['isCorrectAnswer']
+            })
+    elif questionType == 'true_false':
+        for option in ['True', 'False']:
+            # Create a deterministic ID by combining question ID and T/F value
+            option_id = convert_to_uuid(f"{entry_id}_{option}")
+            option_ids.add(option_id)
+            isCorrectAnswer = str(fields['correctAnswer']).lower() == option.lower()
+            if isCorrectAnswer:
+                correct_option_id = option_id
+            writer.add('options', {
+                'option_id': option_id,
+                'question_id': question_id,
+                'option_text': option,
+                'is_correct': isCorrectAnswer
+            })
+
+    # Move these outside the if/elif block since they apply to both types
+    writer.add('question_answers', {
+        'question_id': question_id,
+        'correct_answer_id': correct_option_id,
+        'has_explanation': 'answerExplanation' in fields,
+        'explanation': fields.get('answerExplanation')
+    })
+
+    return question_id, option_ids
+
+
+def upsert_quiz(writer, hierarchy, entry_id, fields, known_question_ids):
+    """
+    Upsert a quiz and its quiz_questions rows.
+    Returns (quiz_id, set of (quiz_id, question_id) pairs written for it)
+    """
+    quiz_id = convert_to_uuid(entry_id)
+    quiz_pairs = set()
+    quiz_name = fields['name']
+
+    # Optional links to subject, topic, and subtopic based on hierarchy level
+    subject_id = None
+    topic_id = None
+    subtopic_id = None
+
+    # Determine if a subject, topic, or subtopic reference exists
+    if 'subjectReference' in fields:
+        subject_id = hierarchy.lookup('quiz', 'subjects', convert_to_uuid(fields['subjectReference']['sys']['id']))
+    if 'topicReference' in fields:
+        topic_id = hierarchy.lookup('quiz', 'topics', convert_to_uuid(fields['topicReference']['sys']['id']))
+    if 'subtopicReference' in fields:
+        subtopic_id = hierarchy.lookup('quiz', 'subtopics', convert_to_uuid(fields['subtopicReference']['sys']['id']))
+
+    # Insert the quiz record
+    writer.add('quiz', {
+        'quiz_id': quiz_id,
+        'quiz_name': quiz_name,
+        'subject_id': subject_id,
+        'topic_id': topic_id,
+        'subtopic_id': subtopic_id,
+        'distinction': fields.get('distinction', None)  # Optional distinction field
+    })
+
+    # Step 7: Insert Quiz Questions (with validation)
+    if 'questions' in fields:
+        questions = fields['questions']
+        for order, question_ref in enumerate(questions):
+            question_id = convert_to_uuid(question_ref['sys']['id'])
+            if question_id in known_question_ids:
+                quiz_pairs.add((quiz_id, question_id))
+                writer.add('quiz_questions', {
+                    'quiz_id': quiz_id,
+                    'question_id': question_id,
+                    'question_order': order + 1
+                })
+            else:
+                print(f"Warning: Question {question_id} not found in questions table. Skipping.")
+
+    return quiz_id, quiz_pairs
+
+
+def delete_entries(cursor, entry_uuids):
+    """
+    Delete rows for entries that were unpublished or deleted in Contentful.
+    Deleted entries carry no content type, so every table is checked by UUID,
+    children first to respect foreign key constraints.
+    Returns the deleted UUIDs along with the questions and quizzes that lost
+    options or questions with them, for AnalyticsSummary (see SUMMARY_CASCADE_TABLES).
+    """
+    ids = list(entry_uuids)
+    if not ids:
+        return set()
+
+    summary_ids = set(ids)
+    cursor.execute(f"""
+        DELETE FROM {DB_SCHEMA}.quiz_questions
+        WHERE quiz_id = ANY(%s::uuid[]) OR question_id = ANY(%s::uuid[])
+        RETURNING quiz_id
+    """, (ids, ids))
+    summary_ids.update(str(row[0]) for row in cursor.fetchall())
+    cursor.execute(f"DELETE FROM {DB_SCHEMA}.quiz WHERE quiz_id = ANY(%s::uuid[])", (ids,))
+    cursor.execute(f"""
+        DELETE FROM {DB_SCHEMA}.user_answers
+        WHERE chosen_answer_id IN (
+            SELECT option_id FROM {DB_SCHEMA}.options
+            WHERE option_id = ANY(%s::uuid[]) OR question_id = ANY(%s::uuid[])
+        )
+    """, (ids, ids))
+    print(f"Deleted {cursor.rowcount} stale user answers")
+    cursor.execute(f"""
+        DELETE FROM {DB_SCHEMA}.options
+        WHERE option_id = ANY(%s::uuid[]) OR question_id = ANY(%s::uuid[])
+        RETURNING question_id
+    """, (ids, ids))
+    summary_ids.update(str(row[0]) for row in cursor.fetchall())
+    for table_name in ['questions', 'subtopics', 'topics']:
+        id_column = f"{table_name[:-1]}_id"
+        cursor.execute(f"DELETE FROM {DB_SCHEMA}.{table_name} WHERE {id_column} = ANY(%s::uuid[])", (ids,))
+        print(f"Deleted {cursor.rowcount} records from {table_name}")
+        if table_name in SUMMARY_CASCADE_TABLES and cursor.rowcount > 0:
+            summary_ids.add(None)
+    cursor.execute(f"DELETE FROM {DB_SCHEMA}.subscriptions WHERE subject_id = ANY(%s::uuid[])", (ids,))
+    print(f"Deleted {cursor.rowcount} stale subscriptions")
+    cursor.execute(f"DELETE FROM {DB_SCHEMA}.subjects WHERE subject_id = ANY(%s::uuid[])", (ids,))
+    print(f"Deleted {cursor.rowcount} records from subjects")
+    if cursor.rowcount > 0:
+        summary_ids.add(None)
+    # A republished entry must be written again even if its rows hash the same
+    cursor.execute(f"DELETE FROM {DB_SCHEMA}.entry_state WHERE entry_uuid = ANY(%s::uuid[])", (ids,))
+    return summary_ids
+
+
+def sync_contentful_changes(cursor, client, sync_token, batch_size=DEFAULT_BATCH_SIZE,
+                            max_concurrency=DEFAULT_MAX_CONCURRENCY, cache=None, commits=None, pool=None, summary=None):
+    """
+    Apply only the entries created, updated or deleted since sync_token.
+    Returns the token to store for the next run.
+    """
+    changed = {}  # content type -> list of (entry_id, version, fields)
+    deleted_ids = set()
+    next_sync_token = sync_token
+
+    with run_metrics.stage('sync_changes'):
+        for page in get_sync_pages(client, sync_token):
+            for item in page.items:
+                item_type = item.raw['sys']['type']
+                if item_type == 'Entry':
+                    content_type = item.raw['sys']['contentType']['sys']['id']
+                    changed.setdefault(content_type, []).append(
+                        (item.raw['sys']['id'], get_entry_version(item), get_localized_fields(item))
+                    )
+                elif item_type == 'DeletedEntry':
+                    deleted_ids.add(convert_to_uuid(item.raw['sys']['id']))
+            next_sync_token = page.next_sync_token
+
+    print(f"Sync API returned {sum(len(entries) for entries in changed.values())} changed and {len(deleted_ids)} deleted entries")
+    apply_entry_changes(cursor, client, changed, deleted_ids, batch_size, max_concurrency, cache, commits, pool, summary)
+    return next_sync_token
+
+
+def rederive_correct_answers(cursor, question_ids):
+    """
+    Point questions.correct_answer_id of question_ids back at a correct option
+    after their options were edited or removed on their own: the current one if it is still
+    correct, else the first correct option by ID, else NULL. The questions'
+    watermarks are dropped, as their stored rows no longer match what a full
+    run would write, so the next full run rewrites them.
+    Returns the IDs of questions whose correct answer changed.
+    """
+    ids = list(question_ids)
+    cursor.execute(f"""
+        UPDATE {DB_SCHEMA}.questions q
+        SET correct_answer_id = c.correct_answer_id
+        FROM (
+            SELECT q2.question_id,
+                   CASE WHEN current.is_correct THEN q2.correct_answer_id ELSE (
+                       SELECT o.option_id FROM {DB_SCHEMA}.options o
+                       WHERE o.question_id = q2.question_id AND o.is_correct
+                       ORDER BY o.option_id LIMIT 1
+                   ) END
+            FROM {DB_SCHEMA}.questions q2
+            LEFT JOIN {DB_SCHEMA}.options current ON current.option_id = q2.correct_answer_id
+            WHERE q2.question_id = ANY(%s::uuid[])
+        ) AS c(question_id, correct_answer_id)
+        WHERE q.question_id = c.question_id
+        AND q.correct_answer_id IS DISTINCT FROM c.correct_answer_id
+        RETURNING q.question_id
+    """, (ids,))
+    changed_ids = [str(row[0]) for row in cursor.fetchall()]
+    cursor.execute(f"DELETE FROM {DB_SCHEMA}.entry_state WHERE entry_uuid = ANY(%s::uuid[])", (ids,))
+    if changed_ids:
+        print(f"Re-derived the correct answer of {len(changed_ids)} questions whose options were edited or removed")
+    return changed_ids
+
+
+def apply_entry_changes(cursor, client, changed, deleted_ids, batch_size=DEFAULT_BATCH_SIZE,
+                        max_concurrency=DEFAULT_MAX_CONCURRENCY, cache=None, commits=None, pool=None, summary=None):
+    """
+    Write the rows of a set of changed entries and delete those of removed ones,
+    touching nothing else: options and quiz questions an entry no longer links
+    to are removed, and user_answers correctness is recomputed for what changed.
+    Args:
+        changed: Dict of content type -> list of (entry_id, version, localized fields)
+        deleted_ids: UUIDs of unpublished or deleted entries
+        summary: Optional AnalyticsSummary to note the questions and quizzes touched in
+    """
+    # Only the changed entries are fetched, so their parents come from the database
+    start = time()
+    hierarchy = HierarchyIndex.from_database(cursor)
+    batch_writer = BatchWriter(cursor, batch_size, commits, pool)
+    writer = UnchangedEntryFilter(
+        cursor, batch_writer, entry_ids=[entry_id for entries in changed.values() for entry_id, _, _ in entries]
+    )
+
+    # Apply changes in the same order as a full run to satisfy foreign key constraints
+    for content_type, upsert in [(SUBJECT_CONTENT_TYPE, upsert_subject), (TOPIC_CONTENT_TYPE, upsert_topic),
+                                 (SUBTOPIC_CONTENT_TYPE, upsert_subtopic), (ISSUE_CONTENT_TYPE, upsert_issue)]:
+        for entry_id, version, fields in changed.get(content_type, []):
+            writer.begin_entry(entry_id, version)
+            upsert(writer, hierarchy, entry_id, fields)
+            writer.end_entry()
+
+    for content_type, questionType in QUESTION_CONTENT_TYPES.items():
+        question_entries = changed.get(content_type, [])
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            answer_entries = get_entries_by_id(
+                client, get_answer_option_ids(fields for _, _, fields in question_entries), executor=executor, cache=cache
+            )
+        for entry_id, version, fields in question_entries:
+            writer.begin_entry(entry_id, version)
+            question_id, option_ids = upsert_question(writer, hierarchy, answer_entries, entry_id, fields, questionType)
+            if not writer.end_entry():
+                continue
+            # Drop options that were removed from this question
+            cursor.execute(f"""
+                DELETE FROM {DB_SCHEMA}.user_answers
+                WHERE chosen_answer_id IN (
+                    SELECT option_id FROM {DB_SCHEMA}.options
+                    WHERE question_id = %s AND option_id != ALL(%s::uuid[])
+                )
+            """, (question_id, list(option_ids)))
+            cursor.execute(
+                f"DELETE FROM {DB_SCHEMA}.options WHERE question_id = %s AND option_id != ALL(%s::uuid[])",
+                (question_id, list(option_ids))
+            )
+
+    # Answer options edited on their own; their question link lives on the question,
+    # so only options already in the table are updated
+    writer.flush()
+    edited_option_question_ids = set()
+    for content_type, entries in changed.items():
+        for entry_id, _, fields in entries:
+            if 'answerText' in fields and 'isCorrectAnswer' in fields:
+                cursor.execute(
+                    f"SELECT question_id FROM {DB_SCHEMA}.options WHERE option_id = %s",
+                    (convert_to_uuid(entry_id),)
+                )
+                result = cursor.fetchone()
+                if result:
+                    edited_option_question_ids.add(str(result[0]))
+                    writer.add('options', {
+                        'option_id': convert_to_uuid(entry_id),
+                        'question_id': str(result[0]),
+                        'option_text': fields['answerText'],
+                        'is_correct': fields['isCorrectAnswer']
+                    })
+    if edited_option_question_ids:
+        writer.flush()
+        batch_writer.changed_question_ids.update(
+            rederive_correct_answers(cursor, edited_option_question_ids)
+        )
+
+    quiz_entries = changed.get(QUIZ_CONTENT_TYPE, [])
+    if quiz_entries:
+        writer.flush()
+        linked_question_ids = [
+            convert_to_uuid(link['sys']['id']) for _, _, fields in quiz_entries for link in fields.get('questions', [])
+        ]
+        cursor.execute(f"SELECT question_id FROM {DB_SCHEMA}.questions WHERE question_id = ANY(%s::uuid[])", (linked_question_ids,))
+        known_question_ids = {str(row[0]) for row in cursor.fetchall()}
+        for entry_id, version, fields in quiz_entries:
+            writer.begin_entry(entry_id, version)
+            quiz_id, quiz_pairs = upsert_quiz(writer, hierarchy, entry_id, fields, known_question_ids)
+            if not writer.end_entry():
+                continue
+            # Drop questions that were removed from this quiz
+            cursor.execute(
+                f"DELETE FROM {DB_SCHEMA}.quiz_questions WHERE quiz_id = %s AND question_id != ALL(%s::uuid[])",
+                (quiz_id, [pair[1] for pair in quiz_pairs])
+            )
+
+    writer.flush()
+    run_metrics.add_stage('load', time() - start)
+    writer.report()
+    hierarchy.report()
+    if commits:
+        commits.end_stage()
+
+    print("\nRemoving deleted entries...")
+    with run_metrics.stage('delete_entries'):
+        # Questions that lose options without being removed themselves may lose their correct answer
+        cursor.execute(f"""
+            SELECT DISTINCT question_id FROM {DB_SCHEMA}.options
+            WHERE option_id = ANY(%s::uuid[]) AND question_id != ALL(%s::uuid[])
+        """, (list(deleted_ids), list(deleted_ids)))
+        removed_option_question_ids = {str(row[0]) for row in cursor.fetchall()}
+        batch_writer.summary_ids.update(delete_entries(cursor, deleted_ids))
+        if removed_option_question_ids:
+            batch_writer.changed_question_ids.update(rederive_correct_answers(cursor, removed_option_question_ids))
+    recompute_user_answer_correctness(cursor, batch_writer.changed_question_ids, batch_writer.changed_option_ids)
+    if summary is not None:
+        summary.touch(batch_writer.summary_ids)
+    if commits:
+        commits.end_stage()
+
+
+def get_initial_sync_token(client, sync_token=None):
+    """
+    Return a Sync API token as of now. Used by full runs so the next incremental
+    run only sees edits made after this one started. With the stored sync_token,
+    only the changes since it are paged through and discarded, since the full
+    run refetches them anyway. Without one, this is a complete initial sync: a
+    download of the whole space in every locale, costing about as many requests
+    as the full run itself, which only the very first run pays.
+    """
+    for page in get_sync_pages(client, sync_token):
+        sync_token = page.next_sync_token
+    return sync_token
+
+
+def transform_all_contentful_data(writer, fetched, checkpoint=None):
+    """
+    Turn the pages of a full fetch (see stream_content_types) into rows for every v2 table,
+    handing them to writer in foreign key order as each page arrives, one
+    begin_entry/end_entry group per Contentful entry.
+    With a SyncCheckpoint, each page's rows are flushed and its active IDs and
+    keyset cursor recorded before the next page; a resumed run starts from the
+    active IDs and hierarchy the checkpoint already covers.
+    Returns the active IDs of each table for stale-row cleanup.
+    """
+    if checkpoint is None:
+        # Parents are resolved from what this run has loaded, not from the database
+        hierarchy = HierarchyIndex()
+        active_ids = {key_table: set() for key_table in CHECKPOINT_KEY_TABLES}
+    else:
+        active_ids = checkpoint.active_ids()
+        hierarchy = checkpoint.hierarchy(active_ids)
+
+    def pages(content_type):
+        """
+        Yield (page, page_ids) for each page of content_type; page_ids collects the
+        page's active keys per table and is merged (and checkpointed) once the page is done
+        """
+        for page in fetched[content_type]:
+            page_ids = {key_table: set() for key_table in CHECKPOINT_KEY_TABLES}
+            yield page, page_ids
+            for key_table, ids in page_ids.items():
+                active_ids[key_table].update(ids)
+            if checkpoint is not None:
+                # The rows a checkpoint covers are written before it is
+                writer.flush()
+                checkpoint.page_done(content_type, page[0] if content_type in QUESTION_CONTENT_TYPES else page, page_ids)
+
+    # Step 1: Insert Subjects
+    for page, page_ids in pages(SUBJECT_CONTENT_TYPE):
+        for subject in page:
+            writer.begin_entry(subject.sys['id'], get_entry_version(subject))
+            page_ids['subjects'].add(upsert_subject(writer, hierarchy, subject.sys['id'], subject.raw['fields']))
+            writer.end_entry()
+
+    # Step 2: Insert Topics
+    for page, page_ids in pages(TOPIC_CONTENT_TYPE):
+        for topic in page:
+            writer.begin_entry(topic.sys['id'], get_entry_version(topic))
+            page_ids['topics'].add(upsert_topic(writer, hierarchy, topic.sys['id'], topic.raw['fields']))
+            writer.end_entry()
+
+    # Step 3: Insert Subtopics
+    for page, page_ids in pages(SUBTOPIC_CONTENT_TYPE):
+        for subtopic in page:
+            writer.begin_entry(subtopic.sys['id'], get_entry_version(subtopic))
+            page_ids['subtopics'].add(upsert_subtopic(writer, hierarchy, subtopic.sys['id'], subtopic.raw['fields']))
+            writer.end_entry()
+
+    # Insert Issues as children of Subtopics
+    for page, page_ids in pages(ISSUE_CONTENT_TYPE):
+        for issue in page:
+            writer.begin_entry(issue.sys['id'], get_entry_version(issue))
+            page_ids['subtopics'].add(upsert_issue(writer, hierarchy, issue.sys['id'], issue.raw['fields']))
+            writer.end_entry()
+
+    # Step 4: Process Questions
+    count = 0
+    for content_type, questionType in QUESTION_CONTENT_TYPES.items():
+        for (entries, answer_entries), page_ids in pages(content_type):
+            for question in entries:
+                count += 1
+                writer.begin_entry(question.sys['id'], get_entry_version(question))
+                question_id, option_ids = upsert_question(writer, hierarchy, answer_entries, question.sys['id'], question.raw['fields'], questionType)
+                writer.end_entry()
+                page_ids['questions'].add(question_id)
+                page_ids['options'].update(option_ids)
+
+    print(f"Total number of questions processed: {len(active_ids['questions'])}")
+
+    # Step 6: Insert Quizzes
+    for page, page_ids in pages(QUIZ_CONTENT_TYPE):
+        for quiz in page:
+            writer.begin_entry(quiz.sys['id'], get_entry_version(quiz))
+            quiz_id, quiz_pairs = upsert_quiz(writer, hierarchy, quiz.sys['id'], quiz.raw['fields'], active_ids['questions'])
+            writer.end_entry()
+            page_ids['quiz'].add(quiz_id)
+            page_ids['quiz_questions'].update(quiz_pairs)
+
+    writer.flush()
+    print(count)
+    writer.report()
+    hierarchy.report()
+
+    return dict(
+        active_ids,
+        # Watermarks of every entry seen, so those of deleted entries are cleaned up too
+        entries=active_ids['subjects'] | active_ids['topics'] | active_ids['subtopics'] | active_ids['questions'] | active_ids['quiz'],
+    )
+
+
+def sync_all_contentful_data(cursor, batch_size=DEFAULT_BATCH_SIZE, max_delete_fraction=DEFAULT_MAX_DELETE_FRACTION,
+                             max_concurrency=DEFAULT_MAX_CONCURRENCY, cache=None, rewrite_all=False, commits=None,
+                             pool=None, checkpoint=None, summary=None):
+    """
+    Rebuild every table from a full fetch and delete whatever Contentful no longer has.
+    Entries unchanged since they were last written are skipped unless rewrite_all is set.
+    commits is the run's CommitPolicy; each stage ends with commits.end_stage().
+    With a ConnectionPool, writes and stale-row deletes are spread over its connections.
+    With a SyncCheckpoint, progress is recorded after every page, and a resumed
+    checkpoint fetches only what its run had not loaded yet. Stale rows are only
+    deleted once every content type has been loaded. The questions and quizzes
+    written or deleted are noted in summary, an AnalyticsSummary, if given.
+    """
+    start = None
+    if checkpoint is not None and checkpoint.resumed:
+        start = checkpoint.pending_content_types()
+        if cache is not None and cache.mode == 'offline':
+            # An offline replay cannot seek, so the content type in progress is replayed from its start
+            checkpoint.page_cursor = None
+            start = dict.fromkeys(start)
+
+    # Fetch every content type concurrently, inserting pages in the correct order to satisfy foreign key constraints
+    print("Fetching all content types..." if start is None else f"Fetching {len(start)} remaining content types...")
+    batch_writer = BatchWriter(cursor, batch_size, commits, pool)
+    with run_metrics.stage('load'), stream_content_types(client, max_concurrency, cache, start=start) as fetched:
+        active_ids = transform_all_contentful_data(UnchangedEntryFilter(cursor, batch_writer, rewrite_all), fetched, checkpoint)
+    print("Contentful data successfully synchronized with the database!")
+    if checkpoint is not None:
+        checkpoint.loaded()
+    if commits:
+        commits.end_stage()
+
+    # Clean up stale data in the correct order to respect foreign key constraints
+    print("\nCleaning up stale data...")
+    with run_metrics.stage('stale_cleanup'):
+        batch_writer.summary_ids.update(delete_all_stale_data(cursor, active_ids, max_delete_fraction, pool))
+    if checkpoint is not None and checkpoint.resumed:
+        # Questions and options changed before the resume are not known, so every answer is checked
+        recompute_user_answer_correctness(cursor, None, None)
+    else:
+        recompute_user_answer_correctness(cursor, batch_writer.changed_question_ids, batch_writer.changed_option_ids)
+    if summary is not None:
+        summary.touch(batch_writer.summary_ids)
+    if commits:
+        commits.end_stage()
+
+
+LOAD_PLAN_FORMAT = 'contentful-load-plan'
+LOAD_PLAN_VERSION = 2
+DEFAULT_LOAD_PLAN_PATH = 'load_plan.jsonl.gz'
+
+
+class LoadPlanWriter:
+    """
+    Stands in for BatchWriter during extraction: rows are written to a gzip JSONL
+    load plan instead of the database. The plan holds a header line, the columns
+    of each table the first time it appears, an {"entry": [id, version]} line
+    before the rows of each Contentful entry, one [table, values] line per row,
+    and finally the active IDs used for stale-row cleanup.
+    """
+
+    def __init__(self, path):
+        self.file = gzip.open(path, 'wt', encoding='utf-8')
+        self.columns = {}
+        self.counts = {}
+        self.write({
+            'format': LOAD_PLAN_FORMAT,
+            'version': LOAD_PLAN_VERSION,
+            'space_id': SPACE_ID,
+            'environment_id': ENVIRONMENT_ID,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+        })
+
+    def write(self, record):
+        self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def add(self, table_name, row):
+        if table_name not in self.columns:
+            self.columns[table_name] = list(row)
+            self.write({'columns': {table_name: self.columns[table_name]}})
+        self.write([table_name, list(row.values())])
+        self.counts[table_name] = self.counts.get(table_name, 0) + 1
+
+    def begin_entry(self, entry_id, version):
+        self.write({'entry': [entry_id, version]})
+
+    def end_entry(self):
+        return True
+
+    def flush(self, table_name=None):
+        pass
+
+    def report(self):
+        print("\nLoad plan rows:")
+        for name in TABLE_LOAD_ORDER:
+            if name in self.counts:
+                print(f"- {name}: {self.counts[name]} rows")
+
+    def close(self, active_ids):
+        self.write({'active': {
+            table_name: sorted(list(key) if isinstance(key, tuple) else key for key in ids)
+            for table_name, ids in active_ids.items()
+        }})
+        self.file.close()
+
+
+def extract_contentful_data(plan_path, max_concurrency=DEFAULT_MAX_CONCURRENCY, cache=None):
+    """
+    Fetch and transform everything into a load plan without touching the database
+    """
+    print("Fetching all content types...")
+    writer = LoadPlanWriter(plan_path)
+    with run_metrics.stage('extract'), stream_content_types(client, max_concurrency, cache) as fetched:
+        active_ids = transform_all_contentful_data(writer, fetched)
+    writer.close(active_ids)
+    request_scheduler.report()
+    print(f"Load plan written to {plan_path}")
+
+
+def load_plan(cursor, plan_path, batch_size=DEFAULT_BATCH_SIZE, max_delete_fraction=DEFAULT_MAX_DELETE_FRACTION,
+              rewrite_all=False, commits=None, pool=None, summary=None):
+    """
+    Stream a load plan into the database and delete rows it does not contain.
+    Entries unchanged since they were last written are skipped unless rewrite_all is set.
+    The questions and quizzes written or deleted are noted in summary, an AnalyticsSummary, if given.
+    """
+    batch_writer = BatchWriter(cursor, batch_size, commits, pool)
+    writer = UnchangedEntryFilter(cursor, batch_writer, rewrite_all)
+    columns = {}
+    active_ids = None
+    in_entry = False
+    start = time()
+
+    with gzip.open(plan_path, 'rt', encoding='utf-8') as plan:
+        header = json.loads(next(plan))
+        if header.get('format') != LOAD_PLAN_FORMAT or header.get('version') != LOAD_PLAN_VERSION:
+            raise ValueError(f"{plan_path} is not a version {LOAD_PLAN_VERSION} load plan")
+        print(f"Loading plan for {header['space_id']}/{header['environment_id']} created at {header['created_at']}")
+
+        for line in plan:
+            record = json.loads(line)
+            if isinstance(record, list):
+                table_name, values = record
+                writer.add(table_name, dict(zip(columns[table_name], values)))
+            elif 'entry' in record:
+                if in_entry:
+                    writer.end_entry()
+                writer.begin_entry(*record['entry'])
+                in_entry = True
+            elif 'columns' in record:
+                columns.update(record['columns'])
+            elif 'active' in record:
+                active_ids = record['active']
+        if in_entry:
+            writer.end_entry()
+
+    writer.flush()
+    run_metrics.add_stage('load', time() - start)
+    writer.report()
+    if commits:
+        commits.end_stage()
+
+    # A truncated plan has no active IDs; deleting against it would remove live rows
+    if active_ids is None:
+        raise ValueError(f"{plan_path} is incomplete; skipping stale-row cleanup")
+    print("\nCleaning up stale data...")
+    with run_metrics.stage('stale_cleanup'):
+        batch_writer.summary_ids.update(delete_all_stale_data(cursor, {
+            table_name: {tuple(key) if isinstance(key, list) else key for key in ids}
+            for table_name, ids in active_ids.items()
+        }, max_delete_fraction, pool))
+    recompute_user_answer_correctness(cursor, batch_writer.changed_question_ids, batch_writer.changed_option_ids)
+    if summary is not None:
+        summary.touch(batch_writer.summary_ids)
+    if commits:
+        commits.end_stage()
+
+
+# Insert Contentful data into the PostgreSQL schema with proper foreign key handling
+DEFAULT_WEBHOOK_PORT = 8080
+DEFAULT_DEBOUNCE_SECONDS = 2.0
+DEFAULT_MAX_BATCH_SECONDS = 10.0
+DEFAULT_MAX_BATCH_ENTRIES = 500
+MAX_WEBHOOK_RETRY_SECONDS = 60
+# Failed attempts after which an entry is dropped and left to the next sync run
+MAX_WEBHOOK_ATTEMPTS = 5
+# Entries leave the CDA when unpublished, deleted or archived (archiving requires unpublishing)
+REMOVE_ACTIONS = ('unpublish', 'delete', 'archive')
+
+
+class WebhookEvent:
+    """
+    The latest state of one entry seen in webhooks: its content type, version
+    and localized fields once published, or fields None once it was removed
+    """
+    __slots__ = ('content_type', 'version', 'fields', 'received_at')
+
+    def __init__(self, content_type, version, fields, received_at):
+        self.content_type = content_type
+        self.version = version
+        self.fields = fields
+        self.received_at = received_at
+
+
+class WebhookBatcher:
+    """
+    Coalesces webhook events into micro-batches applied by a single worker thread.
+    Events are kept per entry, so a burst of publishes of one entry is applied
+    once with its latest version. A batch is applied once no event has arrived
+    for debounce_s, once its oldest event has waited max_wait_s, or as soon as it
+    holds max_entries entries. A batch that fails is split in halves until the
+    entries that fail on their own are isolated, so the rest still land. Those
+    are put back, behind any newer events for the same entries, and retried with
+    exponential backoff. An entry that has failed MAX_WEBHOOK_ATTEMPTS times, or
+    any failed entry once stopping, is dropped and left to the next sync run,
+    which still sees it as the sync token was never advanced past it.
+    """
+
+    def __init__(self, apply, debounce_s=DEFAULT_DEBOUNCE_SECONDS, max_wait_s=DEFAULT_MAX_BATCH_SECONDS,
+                 max_entries=DEFAULT_MAX_BATCH_ENTRIES):
+        self.apply = apply
+        self.debounce_s = debounce_s
+        self.max_wait_s = max_wait_s
+        self.max_entries = max_entries
+        self.condition = threading.Condition()
+        self.pending = {}  # entry id -> WebhookEvent
+        self.first_at = None
+        self.last_at = None
+        self.retry_at = 0
+        self.failures = 0
+        self.attempts = {}  # entry id -> failed attempts of its pending event
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, name='webhook-batcher', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def submit(self, entry_id, event):
+        with self.condition:
+            current = self.pending.get(entry_id)
+            # Webhooks can arrive out of order; never replace a newer version with an older one
+            if current is not None and event.version is not None and current.version is not None \
+                    and event.version < current.version:
+                return
+            if current is not None:
+                event.received_at = min(event.received_at, current.received_at)
+            # A newer event may well apply where the old one failed
+            self.attempts.pop(entry_id, None)
+            self.pending[entry_id] = event
+            self.last_at = monotonic()
+            if self.first_at is None:
+                self.first_at = self.last_at
+            self.condition.notify()
+
+    def due_in(self):
+        """
+        Seconds until the pending batch should be applied (0 when due, None when empty)
+        """
+        if not self.pending:
+            return None
+        if self.stopping:
+            return 0
+        now = monotonic()
+        if len(self.pending) >= self.max_entries:
+            due = now
+        else:
+            due = min(self.last_at + self.debounce_s, self.first_at + self.max_wait_s)
+        return max(0, due - now, self.retry_at - now)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while True:
+                    wait_s = self.due_in()
+                    if wait_s == 0 or (wait_s is None and self.stopping):
+                        break
+                    self.condition.wait(wait_s)
+                if not self.pending:
+                    return
+                batch = dict(list(self.pending.items())[:self.max_entries])
+                for entry_id in batch:
+                    del self.pending[entry_id]
+                self.first_at = monotonic() if self.pending else None
+            self.apply_batch(batch)
+
+    def apply_batch(self, batch):
+        failed = self.apply_split(batch)
+        if not failed:
+            self.failures = 0
+            return
+        self.failures += 1
+        dropped = []
+        with self.condition:
+            for entry_id, event in failed.items():
+                attempts = self.attempts.get(entry_id, 0) + 1
+                if self.stopping or attempts >= MAX_WEBHOOK_ATTEMPTS:
+                    self.attempts.pop(entry_id, None)
+                    dropped.append(entry_id)
+                elif entry_id not in self.pending:
+                    self.attempts[entry_id] = attempts
+                    self.pending[entry_id] = event
+            retried = len(failed) - len(dropped)
+            if retried:
+                delay = min(MAX_WEBHOOK_RETRY_SECONDS, self.debounce_s * 2 ** self.failures)
+                now = monotonic()
+                self.first_at = self.first_at or now
+                self.last_at = self.last_at or now
+                self.retry_at = now + delay
+        if retried:
+            print(f"Retrying {retried} failed webhook entries in {delay:.0f}s")
+        if dropped:
+            # The sync token was never advanced past these, so the next incremental run applies them
+            run_metrics.count('webhook_entries_dropped_total', len(dropped))
+            print(f"Dropped {len(dropped)} webhook entries, left to the next sync run: {', '.join(sorted(dropped))}")
+
+    def apply_split(self, batch):
+        """
+        Apply batch, splitting it in halves on failure down to single entries.
+        Returns the entries that failed on their own (entry id -> WebhookEvent).
+        """
+        start = time()
+        try:
+            self.apply(batch)
+        except Exception as e:
+            run_metrics.count('webhook_batch_failures_total')
+            if len(batch) == 1:
+                print(f"Applying webhook entry {next(iter(batch))} failed: {e}")
+                return batch
+            print(f"Applying {len(batch)} webhook entries failed ({e}); splitting the batch")
+            entries = list(batch.items())
+            middle = len(entries) // 2
+            return {**self.apply_split(dict(entries[:middle])), **self.apply_split(dict(entries[middle:]))}
+        now = time()
+        with self.condition:
+            for entry_id in batch:
+                self.attempts.pop(entry_id, None)
+        run_metrics.count('webhook_batches_total')
+        run_metrics.observe('webhook_batch_seconds', now - start)
+        for event in batch.values():
+            run_metrics.observe('webhook_latency_seconds', now - event.received_at)
+        print(f"Applied {len(batch)} webhook entries in {now - start:.2f}s")
+        return {}
+
+    def stop(self):
+        """
+        Apply whatever is still pending, without waiting for the debounce, and stop the worker
+        """
+        with self.condition:
+            self.stopping = True
+            self.retry_at = 0
+            self.condition.notify()
+        self.thread.join()
+
+
+def apply_webhook_batch(client, batch, batch_size=DEFAULT_BATCH_SIZE, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+    """
+    Apply one micro-batch of WebhookEvents in a single transaction, together with
+    the analytics summary rows of the questions and quizzes it touched. The sync
+    token is left alone: the next incremental run sees these entries again and
+    skips them, as their watermarks in v2.entry_state already match.
+    """
+    changed = {}
+    deleted_ids = set()
+    for entry_id, event in batch.items():
+        if event.fields is None:
+            deleted_ids.add(convert_to_uuid(entry_id))
+        else:
+            changed.setdefault(event.content_type, []).append((entry_id, event.version, event.fields))
+
+    conn = connect_database()
+    cursor = InstrumentedCursor(conn.cursor())
+    commits = CommitPolicy(conn, 'atomic')
+    try:
+        summary = AnalyticsSummary.open(cursor)
+        apply_entry_changes(cursor, client, changed, deleted_ids, batch_size, max_concurrency, commits=commits,
+                            summary=summary)
+        summary.refresh()
+        commits.finish()
+    finally:
+        cursor.close()
+        conn.close()
+
+
+class WebhookServer(ThreadingHTTPServer):
+    """
+    Receives Contentful entry webhooks and hands them to a WebhookBatcher.
+    When secret is set, requests must carry it in the X-Webhook-Secret header
+    (configured as a custom header on the webhook in Contentful).
+    """
+    daemon_threads = True
+
+    def __init__(self, port, batcher, secret=None):
+        super().__init__(('', port), WebhookHandler)
+        self.batcher = batcher
+        self.secret = secret
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """
+    POST /: an Entry publish, unpublish, delete or archive webhook, answered 202 once queued.
+    GET /metrics: the service's metrics in Prometheus text format. GET /healthz: liveness.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            return self.respond(200, run_metrics.prometheus(), 'text/plain; version=0.0.4')
+        if self.path == '/healthz':
+            return self.respond(200, 'ok\n')
+        return self.respond(404, 'not found\n')
+
+    def do_POST(self):
+        received_at = time()
+        secret = self.server.secret
+        if secret and not hmac.compare_digest(self.headers.get('X-Webhook-Secret', ''), secret):
+            return self.respond(401, 'unauthorized\n')
+        try:
+            raw = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            sys = raw['sys']
+            entry_id = sys['id']
+        except (ValueError, KeyError, TypeError):
+            return self.respond(400, 'expected an entry payload\n')
+
+        # The topic header is untrusted, so metrics are labelled with a fixed set of values only
+        topic = self.headers.get('X-Contentful-Topic', '')
+        _, _, action = topic.rpartition('.')
+        environment = sys.get('environment', {}).get('sys', {}).get('id', ENVIRONMENT_ID)
+        if '.Entry.' not in topic:
+            ignored = 'topic'
+        elif environment != ENVIRONMENT_ID:
+            ignored = 'environment'
+        elif action != 'publish' and action not in REMOVE_ACTIONS:
+            ignored = 'action'
+        else:
+            ignored = None
+        if ignored:
+            run_metrics.count('webhook_events_total', outcome='ignored', reason=ignored)
+            return self.respond(200, 'ignored\n')
+
+        if action == 'publish':
+            entry = RawEntry(raw)
+            event = WebhookEvent(sys['contentType']['sys']['id'], get_entry_version(entry),
+                                 get_localized_fields(entry), received_at)
+        else:
+            event = WebhookEvent(None, None, None, received_at)
+        self.server.batcher.submit(entry_id, event)
+        run_metrics.count('webhook_events_total', outcome='queued', action=action)
+        return self.respond(202, 'queued\n')
+
+    def respond(self, status, text, content_type='text/plain'):
+        data = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve_webhooks(port=DEFAULT_WEBHOOK_PORT, debounce_s=DEFAULT_DEBOUNCE_SECONDS, max_wait_s=DEFAULT_MAX_BATCH_SECONDS,
+                   max_entries=DEFAULT_MAX_BATCH_ENTRIES, batch_size=DEFAULT_BATCH_SIZE,
+                   max_concurrency=DEFAULT_MAX_CONCURRENCY):
+    """
+    Run the webhook service until interrupted (Ctrl-C or SIGTERM), then apply
+    the events still pending before exiting.
+    Args:
+        debounce_s: Apply a batch once no webhook has arrived for this long
+        max_wait_s: Apply a batch once its oldest webhook has waited this long
+        max_entries: Apply a batch as soon as it holds this many entries
+    """
+    batcher = WebhookBatcher(
+        lambda batch: apply_webhook_batch(client, batch, batch_size, max_concurrency),
+        debounce_s, max_wait_s, max_entries
+    )
+    server = WebhookServer(port, batcher, os.environ.get('WEBHOOK_SECRET'))
+    batcher.start()
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    print(f"Listening for Contentful webhooks on port {server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping; applying pending webhooks...")
+    finally:
+        server.server_close()
+        batcher.stop()
+
+
+def insert_contentful_data(full=False, batch_size=DEFAULT_BATCH_SIZE, max_delete_fraction=DEFAULT_MAX_DELETE_FRACTION,
+                           max_concurrency=DEFAULT_MAX_CONCURRENCY, cache=None, plan_path=None,
+                           commit_mode='autocommit', commit_every=DEFAULT_COMMIT_EVERY, connections=1, resume=False):
+    """
+    Args:
+        full: Re-fetch everything, rewrite every row regardless of the stored entry
+              watermarks and rebuild the sync token instead of applying only the
+              changes since the last run
+        batch_size: Number of rows per multi-row upsert statement
+        max_delete_fraction: Largest share of any table a full run may delete as stale
+        max_concurrency: Most Contentful requests in flight at once
+        cache: Optional EntryCache; in offline mode the run is a full sync replayed from it
+        plan_path: Load this load plan (see extract_contentful_data) instead of reading Contentful
+        commit_mode: One of COMMIT_MODES (see CommitPolicy)
+        commit_every: Rows per transaction in batched commit mode
+        connections: Database connections to write with; above 1, independent tables
+                     and batches are written over that many connections at once
+                     (see ConnectionPool), which rules out atomic commit mode
+        resume: Continue the full sync an earlier run left unfinished from its last
+                checkpoint (see SyncCheckpoint) instead of starting over
+
+    Errors are reported and then re-raised, so a failed run exits non-zero.
+    """
+    if connections > 1 and commit_mode == 'atomic':
+        raise ValueError("Atomic commit mode needs a single connection; use batched or autocommit with more connections")
+    print("Starting to insert data")
+    # Establish connection to the PostgreSQL database using pg8000
+    conn = connect_database()
+    commits = CommitPolicy(conn, commit_mode, commit_every)
+    cursor = InstrumentedCursor(conn.cursor())
+    pool = None
+    checkpoint = None
+
+    try:
+        if connections > 1:
+            pool = ConnectionPool(connections, commit_mode, commit_every)
+        sync_token = get_sync_token(cursor)
+        checkpoint = None
+        summary = AnalyticsSummary.start(cursor, rebuild=full)
+        if resume and not plan_path:
+            checkpoint = SyncCheckpoint.load(cursor)
+            if checkpoint is None:
+                print("No unfinished full sync to resume; running as usual")
+        # In atomic mode a failed run leaves nothing behind, so there is nothing to checkpoint
+        checkpointed = commit_mode != 'atomic'
+        if plan_path:
+            # The plan is a full snapshot taken without the Sync API, so the sync token is left alone
+            load_plan(cursor, plan_path, batch_size, max_delete_fraction, rewrite_all=full, commits=commits, pool=pool,
+                      summary=summary)
+        elif checkpoint is not None:
+            print(f"Resuming the unfinished full sync from {checkpoint.describe()}")
+            sync_all_contentful_data(cursor, batch_size, max_delete_fraction, max_concurrency, cache,
+                                     rewrite_all=checkpoint.rewrite_all, commits=commits, pool=pool,
+                                     checkpoint=checkpoint, summary=summary)
+            # The token taken when the interrupted run started, unless it was an offline replay
+            if checkpoint.sync_token:
+                save_sync_token(cursor, checkpoint.sync_token)
+            checkpoint.clear()
+        elif cache is not None and cache.mode == 'offline':
+            # No network: replay the cached content and leave the sync token alone
+            print("Replaying Contentful content from the entry cache")
+            checkpoint = SyncCheckpoint.start(cursor, None, full) if checkpointed else None
+            sync_all_contentful_data(cursor, batch_size, max_delete_fraction, max_concurrency, cache,
+                                     rewrite_all=full, commits=commits, pool=pool, checkpoint=checkpoint,
+                                     summary=summary)
+            if checkpoint:
+                checkpoint.clear()
+        elif full or not sync_token:
+            if not full:
+                print("No sync token stored yet, running a full sync")
+            # Take the token before fetching so edits made during the run are replayed next time
+            with run_metrics.stage('sync_token'):
+                sync_token = get_initial_sync_token(client, sync_token)
+            checkpoint = SyncCheckpoint.start(cursor, sync_token, full) if checkpointed else None
+            sync_all_contentful_data(cursor, batch_size, max_delete_fraction, max_concurrency, cache,
+                                     rewrite_all=full, commits=commits, pool=pool, checkpoint=checkpoint,
+                                     summary=summary)
+            save_sync_token(cursor, sync_token)
+            if checkpoint:
+                checkpoint.clear()
+        else:
+            print("Applying Contentful changes since the last sync...")
+            sync_token = sync_contentful_changes(cursor, client, sync_token, batch_size, max_concurrency, cache, commits,
+                                                 pool, summary)
+            save_sync_token(cursor, sync_token)
+        with run_metrics.stage('analytics'):
+            summary.finish()
+        # The sync token and analytics summary are committed together with the data they describe
+        with run_metrics.stage('commit'):
+            commits.finish()
+        commits.report()
+        if pool:
+            pool.report()
+            pool.close()
+            pool = None
+        request_scheduler.report()
+
+        print("\n=== Data Migration Analytics ===\n")
+        # Same connection: the report reads only the summary tables refreshed above
+        with run_metrics.stage('analytics'):
+            summary.report()
+        print("\n=== End of Analytics ===\n")
+
+    except Exception as e:
+        print(f"Error inserting data: {e}")
+        if commit_mode != 'autocommit':
+            print("Changes since the last commit were rolled back")
+        if checkpoint is not None and commit_mode != 'atomic':
+            print("Run again with --resume to continue from the last checkpoint")
+        raise
+    finally:
+        if pool:
+            pool.close()
+        cursor.close()
+        conn.close()
+
+
+DEFAULT_JOBS_CONFIG_PATH = 'sync_jobs.json'
+DEFAULT_JOB_LOG_DIR = 'sync_job_logs'
+# Settings a job may override in its "options"; the rest come from the command line
+JOB_OPTIONS = ['full', 'batch_size', 'max_delete_fraction', 'max_concurrency', 'commit_mode', 'commit_every',
+               'connections', 'resume', 'raw_json', 'rate_limit', 'cache_mode', 'cache_max_mb']
+
+
+def job_connections(options):
+    """
+    Database connections a job holds at most: the main one, plus the pool when it writes over several
+    """
+    return options['connections'] + 1 if options['connections'] > 1 else 1
+
+
+def load_sync_jobs(path, defaults, max_total_connections=None):
+    """
+    Read the jobs config file: a JSON list with one object per space, environment
+    and locale to sync, e.g.
+        {"name": "ny-en", "space_id": "hxu8jsem6qms", "environment_id": "master", "locale": "en-US",
+         "access_token_env": "NY_ACCESS_TOKEN", "schema": "ny_en",
+         "db": {"host": "...", "port": 5432, "name": "...", "user": "...", "password": "..."},
+         "options": {"connections": 2, "max_concurrency": 4}}
+    Everything but name and space_id defaults to this script's own settings
+    (api_url to CONTENTFUL_API_URL, e.g. to read a space through the Preview API);
+    access_token may be given directly or read from the variable access_token_env
+    names. options override the defaults (JOB_OPTIONS from the command line) for
+    that job alone. No two jobs may write the same schema of the same database,
+    since each run deletes whatever its space no longer has.
+    Returns the jobs with every setting filled in.
+    """
+    with open(path) as file:
+        configs = json.load(file)
+    if not isinstance(configs, list) or not configs:
+        raise ValueError(f"{path} must hold a non-empty JSON list of jobs")
+
+    jobs = []
+    targets = {}
+    for index, config in enumerate(configs):
+        name = config.get('name')
+        if not name or not config.get('space_id'):
+            raise ValueError(f"Job {index + 1} in {path} needs a name and a space_id")
+        if any(job['name'] == name for job in jobs):
+            raise ValueError(f"Job name {name} is used twice in {path}")
+        unknown = set(config.get('options', {})) - set(JOB_OPTIONS)
+        if unknown:
+            raise ValueError(f"Job {name} has unknown options: {', '.join(sorted(unknown))}")
+        db = config.get('db', {})
+        job = {
+            'name': name,
+            'space_id': config['space_id'],
+            'environment_id': config.get('environment_id', ENVIRONMENT_ID),
+            'locale': config.get('locale', LOCALE),
+            'api_url': config.get('api_url', CONTENTFUL_API_URL),
+            'access_token': config.get('access_token') or os.environ.get(config.get('access_token_env', 'ACCESS_TOKEN'), ACCESS_TOKEN),
+            'schema': config.get('schema', DB_SCHEMA),
+            'db': {
+                'host': db.get('host', DB_HOST),
+                'port': int(db.get('port', DB_PORT)),
+                'name': db.get('name', DB_NAME),
+                'user': db.get('user', DB_USER),
+                'password': db.get('password', DB_PASSWORD),
+            },
+            'options': dict(defaults, **config.get('options', {})),
+        }
+        options = job['options']
+        if options['connections'] > 1 and options['commit_mode'] == 'atomic':
+            raise ValueError(f"Job {name}: atomic commit mode needs a single connection")
+        if max_total_connections and job_connections(options) > max_total_connections:
+            raise ValueError(f"Job {name} needs {job_connections(options)} database connections, "
+                             f"more than the {max_total_connections} allowed in total")
+        target = (job['db']['host'], job['db']['port'], job['db']['name'], job['schema'])
+        if target in targets:
+            raise ValueError(f"Jobs {targets[target]} and {name} both write schema {job['schema']} "
+                             f"of database {job['db']['name']}")
+        targets[target] = name
+        jobs.append(job)
+    return jobs
+
+
+job_http_slots = None  # semaphore shared by every job process, set by init_job_worker
+
+
+def init_job_worker(http_slots):
+    global job_http_slots
+    job_http_slots = http_slots
+
+
+def run_sync_job(job, log_dir):
+    """
+    Sync one job from load_sync_jobs in a worker process. The module's Contentful
+    and database settings are pointed at the job, and it gets its own client,
+    request scheduler, metrics and entry cache. Its output goes to <log_dir>/<name>.log
+    and its metrics to <log_dir>/<name>.metrics.json.
+    Returns the job's name, wall time and error (None if it succeeded).
+    """
+    global SPACE_ID, ENVIRONMENT_ID, LOCALE, ACCESS_TOKEN, CONTENTFUL_API_URL
+    global DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD, DB_SCHEMA
+    global client, request_scheduler, run_metrics
+    SPACE_ID = job['space_id']
+    ENVIRONMENT_ID = job['environment_id']
+    LOCALE = job['locale']
+    ACCESS_TOKEN = job['access_token']
+    CONTENTFUL_API_URL = job['api_url']
+    db = job['db']
+    DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD = db['host'], db['port'], db['name'], db['user'], db['password']
+    DB_SCHEMA = job['schema']
+    options = job['options']
+
+    name = job['name']
+    run_metrics = RunMetrics()
+    request_scheduler = RequestScheduler(rate=options['rate_limit'], slots=job_http_slots,
+                                         max_concurrency=options['max_concurrency'])
+    if options['raw_json']:
+        client = RawContentfulClient(SPACE_ID, ACCESS_TOKEN, environment=ENVIRONMENT_ID, pool_size=options['max_concurrency'])
+    else:
+        client = create_client()
+    cache = None
+    with open(os.path.join(log_dir, f"{name}.log"), 'w', buffering=1) as log, redirect_stdout(log):
+        try:
+            if options['cache_mode'] != 'off':
+                # One cache file per job: cached bodies are for a single locale
+                root, extension = os.path.splitext(DEFAULT_CACHE_PATH)
+                cache = EntryCache(f"{root}.{name}{extension}", options['cache_mode'], options['cache_max_mb'],
+                                   space_id=SPACE_ID, environment_id=ENVIRONMENT_ID)
+            print(f"Job {name}: space {SPACE_ID}, environment {ENVIRONMENT_ID}, locale {LOCALE}, "
+                  f"schema {DB_SCHEMA} of {DB_NAME} on {DB_HOST}")
+            insert_contentful_data(
+                full=options['full'],
+                batch_size=options['batch_size'],
+                max_delete_fraction=options['max_delete_fraction'],
+                max_concurrency=options['max_concurrency'],
+                cache=cache,
+                commit_mode=options['commit_mode'],
+                commit_every=options['commit_every'],
+                connections=options['connections'],
+                resume=options['resume']
+            )
+        except Exception as e:
+            print(f"Error running job {name}: {e}")
+            run_metrics.error = str(e)
+        finally:
+            if cache is not None:
+                cache.close()
+            run_metrics.write(
+                os.path.join(log_dir, f"{name}.metrics.json"), None, command='sync', job=name,
+                space_id=SPACE_ID, environment_id=ENVIRONMENT_ID, locale=LOCALE, schema=DB_SCHEMA,
+                **options
+            )
+    return name, time() - run_metrics.start, run_metrics.error
+
+
+def run_sync_jobs(jobs, workers=None, max_total_concurrency=None, max_total_connections=None,
+                  log_dir=DEFAULT_JOB_LOG_DIR):
+    """
+    Sync every job from load_sync_jobs at the same time, each in its own process.
+    Args:
+        jobs: Jobs as returned by load_sync_jobs
+        workers: Most jobs running at once (default: all of them)
+        max_total_concurrency: Most Contentful requests in flight across all jobs;
+                               each job's own max_concurrency still applies
+        max_total_connections: Most database connections open across all jobs. A job
+                               is only started once the connections it needs
+                               (see job_connections) are free; jobs further down
+                               the list that fit may start ahead of it.
+        log_dir: Directory for each job's log and metrics files
+    Returns the number of jobs that failed.
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    workers = workers or len(jobs)
+    # Spawned rather than forked, so no job inherits another's clients, connections or threads
+    context = multiprocessing.get_context('spawn')
+    http_slots = context.BoundedSemaphore(max_total_concurrency) if max_total_concurrency else None
+    print(f"Running {len(jobs)} sync jobs, {workers} at a time"
+          + (f", at most {max_total_concurrency} Contentful requests" if max_total_concurrency else "")
+          + (f" and {max_total_connections} database connections" if max_total_connections else "")
+          + f"; logs in {log_dir}")
+
+    pending = list(jobs)
+    running = {}  # future -> job
+    connections_in_use = 0
+    failures = 0
+    start = time()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=init_job_worker, initargs=(http_slots,)) as executor:
+        while pending or running:
+            for job in list(pending):
+                needed = job_connections(job['options'])
+                if len(running) == workers:
+                    break
+                if max_total_connections and connections_in_use + needed > max_total_connections:
+                    continue
+                pending.remove(job)
+                connections_in_use += needed
+                running[executor.submit(run_sync_job, job, log_dir)] = job
+                print(f"Started {job['name']} ({needed} database connection{'s' if needed > 1 else ''})")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                connections_in_use -= job_connections(job['options'])
+                try:
+                    name, seconds, error = future.result()
+                except Exception as e:
+                    # The worker process itself died
+                    name, seconds, error = job['name'], time() - start, str(e)
+                run_metrics.observe('job_seconds', seconds, job=name)
+                run_metrics.count('jobs_total', outcome='failed' if error else 'ok')
+                if error:
+                    failures += 1
+                    print(f"Job {name} failed after {seconds:.1f}s: {error} (see {os.path.join(log_dir, name + '.log')})")
+                else:
+                    print(f"Job {name} finished in {seconds:.1f}s")
+
+    print(f"\n{len(jobs) - failures} of {len(jobs)} sync jobs succeeded in {time() - start:.1f}s")
+    if failures:
+        run_metrics.error = f"{failures} of {len(jobs)} sync jobs failed"
+    return failures
+
+
+# Run the function to insert data
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Synchronize Contentful content into the v2 schema")
+    parser.add_argument(
+        'command', nargs='?', choices=['sync', 'extract', 'load', 'serve', 'sync-jobs'], default='sync',
+        help="sync (default) reads Contentful and writes the database; extract only writes a load plan "
+             "file; load only writes a load plan file into the database; serve runs a service that applies "
+             "Contentful entry webhooks as they arrive; sync-jobs runs every sync listed in --jobs-config "
+             "at the same time"
+    )
+    parser.add_argument('--plan', default=DEFAULT_LOAD_PLAN_PATH, help=f"load plan file for extract/load (default {DEFAULT_LOAD_PLAN_PATH})")
+    parser.add_argument(
+        '--full', action='store_true',
+        help="re-fetch every entry, rewrite every row even if unchanged, delete stale rows and rebuild the "
+             "stored sync token (with load: rewrite every row of the plan)"
+    )
+    parser.add_argument(
+        '--resume', action='store_true',
+        help="continue a full sync that failed partway from its last checkpoint instead of refetching "
+             "everything; without one to resume, runs as usual"
+    )
+    parser.add_argument(
+        '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+        help=f"rows per multi-row upsert statement (default {DEFAULT_BATCH_SIZE})"
+    )
+    parser.add_argument(
+        '--max-delete-fraction', type=float, default=DEFAULT_MAX_DELETE_FRACTION,
+        help=f"refuse to delete more than this share of any table as stale (default {DEFAULT_MAX_DELETE_FRACTION})"
+    )
+    parser.add_argument(
+        '--commit-mode', choices=COMMIT_MODES, default='autocommit',
+        help="autocommit (default) commits every statement; batched commits every --commit-every rows and "
+             "after each stage; atomic commits the whole run at once, so a failed run changes nothing"
+    )
+    parser.add_argument(
+        '--commit-every', type=int, default=DEFAULT_COMMIT_EVERY,
+        help=f"rows per transaction in batched commit mode (default {DEFAULT_COMMIT_EVERY})"
+    )
+    parser.add_argument(
+        '--connections', type=int, default=1,
+        help="database connections to write with (default 1); above 1, independent tables and batches "
+             "are written in parallel, one foreign key level at a time (not with --commit-mode atomic)"
+    )
+    parser.add_argument(
+        '--max-concurrency', type=int, default=DEFAULT_MAX_CONCURRENCY,
+        help=f"most Contentful requests in flight at once (default {DEFAULT_MAX_CONCURRENCY})"
+    )
+    parser.add_argument(
+        '--raw-json', action='store_true',
+        help="fetch through a pooled keep-alive HTTP session and parse responses as plain JSON "
+             "instead of building contentful.Entry objects"
+    )
+    parser.add_argument(
+        '--rate-limit', type=float, default=CONTENTFUL_RATE_LIMIT,
+        help=f"Contentful requests per second to stay under (default {CONTENTFUL_RATE_LIMIT})"
+    )
+    parser.add_argument(
+        '--cache-mode', choices=CACHE_MODES, default='off',
+        help="local entry cache: 'write' stores fetched entries, 'revalidate' downloads only entries whose "
+             "version changed, 'offline' replays the cache with no network calls (default off)"
+    )
+    parser.add_argument('--cache-path', default=DEFAULT_CACHE_PATH, help=f"entry cache file (default {DEFAULT_CACHE_PATH})")
+    parser.add_argument(
+        '--cache-max-mb', type=int, default=DEFAULT_CACHE_MAX_MB,
+        help=f"evict least recently used entries beyond this size (default {DEFAULT_CACHE_MAX_MB})"
+    )
+    parser.add_argument(
+        '--metrics-json', default=DEFAULT_METRICS_JSON_PATH,
+        help=f"write a JSON summary of the run's stage timings, counters and latency histograms here "
+             f"(default {DEFAULT_METRICS_JSON_PATH}; empty to skip)"
+    )
+    parser.add_argument(
+        '--metrics-textfile',
+        help="also write the run's metrics in Prometheus text format here, e.g. into the node_exporter "
+             "textfile collector directory as contentful_sync.prom"
+    )
+    parser.add_argument('--profile', help="profile this run with cProfile and write the stats here")
+    parser.add_argument(
+        '--webhook-port', type=int, default=DEFAULT_WEBHOOK_PORT,
+        help=f"port serve listens on (default {DEFAULT_WEBHOOK_PORT}); set WEBHOOK_SECRET to require it "
+             f"in an X-Webhook-Secret header"
+    )
+    parser.add_argument(
+        '--debounce-seconds', type=float, default=DEFAULT_DEBOUNCE_SECONDS,
+        help=f"serve applies queued webhooks once none has arrived for this long (default {DEFAULT_DEBOUNCE_SECONDS})"
+    )
+    parser.add_argument(
+        '--max-batch-seconds', type=float, default=DEFAULT_MAX_BATCH_SECONDS,
+        help=f"...or once the oldest has waited this long (default {DEFAULT_MAX_BATCH_SECONDS})"
+    )
+    parser.add_argument(
+        '--max-batch-entries', type=int, default=DEFAULT_MAX_BATCH_ENTRIES,
+        help=f"...or as soon as this many entries are queued (default {DEFAULT_MAX_BATCH_ENTRIES})"
+    )
+    parser.add_argument(
+        '--jobs-config', default=DEFAULT_JOBS_CONFIG_PATH,
+        help=f"JSON list of the spaces, environments and locales sync-jobs syncs and the database and "
+             f"schema each goes to (default {DEFAULT_JOBS_CONFIG_PATH}); the options above are every job's defaults"
+    )
+    parser.add_argument('--workers', type=int, help="most sync jobs running at once (default: all of them)")
+    parser.add_argument(
+        '--max-total-concurrency', type=int,
+        help="most Contentful requests in flight across all sync jobs (default: only each job's --max-concurrency)"
+    )
+    parser.add_argument(
+        '--max-total-connections', type=int,
+        help="most database connections open across all sync jobs; jobs wait to start until theirs are free"
+    )
+    parser.add_argument(
+        '--job-log-dir', default=DEFAULT_JOB_LOG_DIR,
+        help=f"directory for each sync job's log and metrics JSON (default {DEFAULT_JOB_LOG_DIR})"
+    )
+    args = parser.parse_args()
+    if args.connections > 1 and args.commit_mode == 'atomic':
+        parser.error("--commit-mode atomic needs a single connection")
+    request_scheduler = RequestScheduler(rate=args.rate_limit, max_concurrency=args.max_concurrency)
+    if args.raw_json:
+        client = RawContentfulClient(SPACE_ID, ACCESS_TOKEN, environment=ENVIRONMENT_ID, pool_size=args.max_concurrency)
+    cache = None
+    # Each sync job opens a cache of its own
+    if args.cache_mode != 'off' and args.command != 'sync-jobs':
+        cache = EntryCache(args.cache_path, args.cache_mode, args.cache_max_mb)
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    try:
+        if args.command == 'extract':
+            extract_contentful_data(args.plan, max_concurrency=args.max_concurrency, cache=cache)
+        elif args.command == 'serve':
+            serve_webhooks(args.webhook_port, args.debounce_seconds, args.max_batch_seconds,
+                           args.max_batch_entries, args.batch_size, args.max_concurrency)
+        elif args.command == 'sync-jobs':
+            jobs = load_sync_jobs(args.jobs_config, {option: getattr(args, option) for option in JOB_OPTIONS},
+                                  args.max_total_connections)
+            failures = run_sync_jobs(jobs, args.workers, args.max_total_concurrency, args.max_total_connections,
+                                     args.job_log_dir)
+            # Any failed job fails the whole command; metrics are still written below
+            if failures:
+                sys.exit(1)
+        else:
+            insert_contentful_data(
+                full=args.full,
+                batch_size=args.batch_size,
+                max_delete_fraction=args.max_delete_fraction,
+                max_concurrency=args.max_concurrency,
+                cache=cache,
+                plan_path=args.plan if args.command == 'load' else None,
+                commit_mode=args.commit_mode,
+                commit_every=args.commit_every,
+                connections=args.connections,
+                resume=args.resume
+            )
+    except Exception as e:
+        run_metrics.error = str(e)
+        raise
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            print(f"\nProfile written to {args.profile}; slowest calls by cumulative time:")
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)
+        if cache is not None:
+            cache.close()
+        run_metrics.write(
+            args.metrics_json, args.metrics_textfile,
+            command=args.command, full=args.full, commit_mode=args.commit_mode, raw_json=args.raw_json
+        )
\ No newline at end of file